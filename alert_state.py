@@ -0,0 +1,158 @@
+import os
+from datetime import datetime, timezone
+
+import boto3
+
+import inventory_batch
+
+# AWS resource initialization
+ddb = boto3.resource('dynamodb')
+sns_client = boto3.client('sns', region_name='eu-central-1')
+alert_state_table_name = 'AlertState'
+alert_state_table = ddb.Table(alert_state_table_name)
+restock_table_name = 'Restock'
+
+# Alert again while LOW only once stock fell this many units below the last alerted level
+ALERT_DROP_MARGIN = int(os.environ.get('ALERT_DROP_MARGIN', '5'))
+
+# A LOW key re-arms (goes back to OK) only once stock is this many units above the threshold
+ALERT_REARM_MARGIN = int(os.environ.get('ALERT_REARM_MARGIN', '5'))
+
+STATE_OK = 'OK'
+STATE_LOW = 'LOW'
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_SIZE = 100
+
+
+def _batch_get(table_name, keys):
+    """Reads many items of one table with BatchGetItem, retrying unprocessed keys."""
+    items = []
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request = {table_name: {'Keys': keys[start:start + BATCH_GET_SIZE]}}
+        while request:
+            response = ddb.batch_get_item(RequestItems=request)
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            request = response.get('UnprocessedKeys')
+    return items
+
+
+def load_states(keys):
+    """
+    Reads the alert state of many (ItemId, WarehouseName) pairs with BatchGetItem.
+
+    Args:
+        keys (iterable): (ItemId, WarehouseName) pairs
+
+    Returns:
+        dict: Maps (ItemId, WarehouseName) to the stored state item; unknown keys are missing
+    """
+    keys = [{'ItemId': item_id, 'WarehouseName': warehouse_name}
+            for item_id, warehouse_name in dict.fromkeys(keys)]
+    return {(item['ItemId'], item['WarehouseName']): item for item in _batch_get(alert_state_table_name, keys)}
+
+
+def load_restock_limits(item_ids):
+    """
+    Returns:
+        dict: Maps every given ItemId to its RestockIfBelow, or None if it has no threshold
+    """
+    item_ids = list(dict.fromkeys(item_ids))
+    limits = dict.fromkeys(item_ids)
+    for item in _batch_get(restock_table_name, [{'ItemId': item_id} for item_id in item_ids]):
+        limits[item['ItemId']] = item.get('RestockIfBelow')
+    return limits
+
+
+def evaluate(state, stock_level, threshold, now):
+    """
+    Decides whether a stock level should trigger an alert, with hysteresis.
+
+    OK -> LOW alerts, LOW -> lower (by ALERT_DROP_MARGIN) alerts again, and
+    LOW -> OK happens only once stock reaches threshold + ALERT_REARM_MARGIN.
+
+    Args:
+        state (dict): Stored state item, or None if the key was never alerted
+        stock_level (int): Current stock level
+        threshold (int): Current RestockIfBelow value
+        now (str): ISO8601 timestamp recorded with a new state
+
+    Returns:
+        tuple: (should_alert, new state item or None if the state is unchanged)
+    """
+    current = state.get('State', STATE_OK) if state else STATE_OK
+
+    if stock_level < threshold:
+        if current == STATE_OK:
+            return True, {'State': STATE_LOW, 'LastAlertLevel': stock_level, 'LastAlertTime': now}
+        if stock_level <= int(state['LastAlertLevel']) - ALERT_DROP_MARGIN:
+            return True, {'State': STATE_LOW, 'LastAlertLevel': stock_level, 'LastAlertTime': now}
+        return False, None
+
+    if current == STATE_LOW and stock_level >= threshold + ALERT_REARM_MARGIN:
+        return False, {'State': STATE_OK, 'LastAlertLevel': int(state['LastAlertLevel']),
+                       'LastAlertTime': state['LastAlertTime']}
+    return False, None
+
+
+def filter_alerts(candidates):
+    """
+    Returns the candidates that should actually be alerted and stores their new state.
+
+    Keys at or above threshold + ALERT_REARM_MARGIN should be passed too, they are
+    needed to re-arm (see inventory_batch.alert_candidates).
+
+    Args:
+        candidates (iterable): (ItemId, WarehouseName, stock level, threshold) tuples
+
+    Returns:
+        list: The (ItemId, WarehouseName, stock level, threshold) tuples to alert on
+    """
+    candidates = list(candidates)
+    if not candidates:
+        return []
+
+    states = load_states((item_id, warehouse_name) for item_id, warehouse_name, _, _ in candidates)
+    now = datetime.now(timezone.utc).isoformat()
+
+    to_alert = []
+    with alert_state_table.batch_writer(overwrite_by_pkeys=['ItemId', 'WarehouseName']) as batch:
+        for item_id, warehouse_name, stock_level, threshold in candidates:
+            should_alert, new_state = evaluate(states.get((item_id, warehouse_name)), stock_level, threshold, now)
+            if new_state is not None:
+                new_state.update({'ItemId': item_id, 'WarehouseName': warehouse_name})
+                batch.put_item(Item=new_state)
+                states[(item_id, warehouse_name)] = new_state
+            if should_alert:
+                to_alert.append((item_id, warehouse_name, stock_level, threshold))
+
+    return to_alert
+
+
+def notify_low_stock(stock_levels):
+    """
+    Sends a stock alert for every key whose alert state changed.
+
+    Args:
+        stock_levels (dict): Maps (ItemId, WarehouseName) to the stock level after an update
+
+    Returns:
+        int: Number of notifications sent
+    """
+    restock_limits = load_restock_limits(item_id for item_id, _ in stock_levels)
+    candidates = inventory_batch.alert_candidates(stock_levels, restock_limits, ALERT_REARM_MARGIN)
+
+    to_alert = filter_alerts(candidates)
+    for item_id, warehouse_name, current_stock_level, restock_limit in to_alert:
+        # Item is below restock threshold, send notification
+        message = (f"Item ID: {item_id}, Warehouse Name: {warehouse_name} "
+                   f"has its current stock ({current_stock_level}) "
+                   f"below the threshold limit ({restock_limit})")
+        sns_client.publish(
+            TopicArn=os.environ['SNS_TOPIC_ARN'],
+            Message=message,
+            Subject="Stock Alert"
+        )
+        print("Notification sent successfully!")
+
+    return len(to_alert)
@@ -1,47 +1,67 @@
 import json
 import boto3
+import math
 import time
 import os
+import uuid
 from datetime import datetime
 
+import inventory_reader
+import profiling
+import report_publisher
+
 sqs = boto3.client('sqs')
 s3 = boto3.client('s3')
-sns = boto3.client('sns')
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# Fan-out mode: one worker per MESSAGES_PER_WORKER queued files, at most MAX_WORKERS
+MESSAGES_PER_WORKER = int(os.environ.get('MESSAGES_PER_WORKER', '10'))
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '10'))
+# A worker takes no new message once less time than this is left in its invocation
+WORKER_TIME_MARGIN_SECONDS = int(os.environ.get('WORKER_TIME_MARGIN_SECONDS', '120'))
 
 def check_transaction(transaction):
     """Long and complex check for each transaction"""
     time.sleep(10)  # "Process" for 10 seconds
 
 def process_file(bucket, key):
-    response = s3.get_object(Bucket=bucket, Key=key)
-    content = response['Body'].read().decode('utf-8')
-
-    transactions = content.split('\n')[1:]  # Skip header
-    for transaction in transactions:
+    # Read the whole (small) file first, the S3 response would time out during the slow checks
+    with inventory_reader.open_inventory_object(s3, bucket, key) as stream:
+        lines = stream.read().splitlines()
+    rows = 0
+    for transaction in lines[1:]:  # Skip header
         if transaction:
             check_transaction(transaction)
+            rows += 1
+    profiling.record(key, rows)
 
-def lambda_handler(event, context):
-    QUEUE_URL = os.environ.get('QUEUE_URL')
-    SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')  # Get the SNS topic ARN from environment variables
+def drain_queue(queue_url, context=None):
+    """
+    Processes files from the queue until it is empty.
 
-    if not SNS_TOPIC_ARN:
-        raise ValueError("SNS_TOPIC_ARN environment variable is not set")
-    
-    start_time = datetime.now()  # Get the start time
+    With a Lambda context, no new message is taken once less than
+    WORKER_TIME_MARGIN_SECONDS of the invocation are left.
 
+    Returns:
+        tuple: (list of processed file keys, whether the queue was found empty)
+    """
     files_processed = []  # List to store processed files
-    
+
     while True:
+        if context is not None and context.get_remaining_time_in_millis() < WORKER_TIME_MARGIN_SECONDS * 1000:
+            print(f"Stopping with {len(files_processed)} files processed, the invocation is about to time out.")
+            return files_processed, False
+
         response = sqs.receive_message(
-            QueueUrl=QUEUE_URL,
+            QueueUrl=queue_url,
             MaxNumberOfMessages=1,
             WaitTimeSeconds=10
         )
 
         if 'Messages' not in response:
             # If no messages left in the queue, break the loop
-            break
+            return files_processed, True
 
         for message in response['Messages']:
             body = json.loads(message['Body'])
@@ -53,24 +73,164 @@ def lambda_handler(event, context):
             process_file(bucket, key)
 
             sqs.delete_message(
-                QueueUrl=QUEUE_URL,
+                QueueUrl=queue_url,
                 ReceiptHandle=message['ReceiptHandle']
             )
 
-    # Calculate the total execution time
-    finish_time = datetime.now()
-    duration = finish_time - start_time
+def _file_list_prefix(run):
+    return f"{report_publisher.REPORT_PREFIX}batch_operation/runs/{run}/"
+
+def save_file_list(run, worker, files_processed):
+    """
+    Writes the keys a fan-out worker processed to S3, one object per worker invocation.
+
+    The Step Function state only carries counts, a list of every key would
+    outgrow its 256 KB limit on a large backlog.
+    """
+    if not report_publisher.REPORT_BUCKET:
+        raise ValueError("REPORT_BUCKET environment variable is not set")
+    if files_processed:
+        s3.put_object(
+            Bucket=report_publisher.REPORT_BUCKET,
+            Key=f"{_file_list_prefix(run)}worker-{worker}-{uuid.uuid4().hex}.txt",
+            Body="\n".join(files_processed).encode('utf-8'),
+            ContentType='text/plain'
+        )
+
+def load_file_lists(run):
+    """
+    Returns:
+        list: The keys processed by all workers of a run, in the order the lists were written
+    """
+    files_processed = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=report_publisher.REPORT_BUCKET, Prefix=_file_list_prefix(run)):
+        for obj in sorted(page.get('Contents', []), key=lambda obj: obj['LastModified']):
+            body = s3.get_object(Bucket=report_publisher.REPORT_BUCKET, Key=obj['Key'])['Body'].read()
+            files_processed.extend(body.decode('utf-8').splitlines())
+    return files_processed
 
+def publish_summary(sns_topic_arn, start_time, finish_time, files_processed, workers=None):
     # Send SNS notification with files processed information
-    sns.publish(
-        TopicArn=SNS_TOPIC_ARN,
-        Message=f"The Step Function execution has succeeded. No messages left in the SQS queue.\n\nStart Time: {start_time.strftime('%Y-%m-%d %H:%M:%S')}\nFinish Time: {finish_time.strftime('%Y-%m-%d %H:%M:%S')}\nDuration: {duration}\n\nNumber of files: {len(files_processed)}\nFiles processed: {files_processed}",
-        Subject="Step Function Execution Succeeded"
+    duration = finish_time - start_time
+    intro = (f"The Step Function execution has succeeded. No messages left in the SQS queue.\n\n"
+             f"Start Time: {start_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+             f"Finish Time: {finish_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+             f"Duration: {duration}\n\n")
+    if workers is not None:
+        intro += f"Workers: {workers}\n"
+    intro += f"Number of files: {len(files_processed)}\nFiles processed:\n"
+
+    report_publisher.publish_report(
+        sns_topic_arn,
+        "Step Function Execution Succeeded",
+        ((key,) for key in files_processed),
+        lambda row: row[0],
+        intro=intro,
+        columns=["Key"],
+        report_name="batch_operation"
     )
 
+@profiling.profiled('batch_operation')
+def lambda_handler(event, context):
+    QUEUE_URL = os.environ.get('QUEUE_URL')
+
+    if 'worker' in event:
+        # Started by the dispatcher's Map state: the report is sent once all workers are done
+        start_time = datetime.now()
+        files_processed, queue_empty = drain_queue(QUEUE_URL, context)
+        save_file_list(event['run'], event['worker'], files_processed)
+        print(f"Worker {event['worker']} processed {len(files_processed)} files.")
+        return {
+            'worker': event['worker'],
+            'files': len(files_processed),
+            'queueEmpty': queue_empty,
+            'start_time': start_time.strftime(TIME_FORMAT),
+            'finish_time': datetime.now().strftime(TIME_FORMAT)
+        }
+
+    SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')  # Get the SNS topic ARN from environment variables
+
+    if not SNS_TOPIC_ARN:
+        raise ValueError("SNS_TOPIC_ARN environment variable is not set")
+    
+    start_time = datetime.now()  # Get the start time
+
+    files_processed, _ = drain_queue(QUEUE_URL)
+
+    # Calculate the total execution time
+    finish_time = datetime.now()
+
+    publish_summary(SNS_TOPIC_ARN, start_time, finish_time, files_processed)
+
     return {
         'statusCode': 200,
         'body': 'Message processed successfully',
         'queueEmpty': True,
-        'start_time': start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')  # Return the start time
+        'start_time': start_time.strftime(TIME_FORMAT)  # Return the start time
+    }
+
+def dispatch_handler(event, context):
+    """
+    First state of the fan-out mode: sizes the worker pool from the queue depth.
+
+    Returns the Step Function state with one entry per worker for the Map state;
+    the run id, processed file count and start time of earlier rounds are carried along.
+    """
+    QUEUE_URL = os.environ.get('QUEUE_URL')
+
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=QUEUE_URL,
+        AttributeNames=['ApproximateNumberOfMessages']
+    )['Attributes']
+    queue_depth = int(attributes.get('ApproximateNumberOfMessages', 0))
+
+    # At least one worker, so an empty queue still ends with a report
+    workers = max(1, min(MAX_WORKERS, math.ceil(queue_depth / MESSAGES_PER_WORKER)))
+    print(f"Queue depth {queue_depth}, starting {workers} worker(s).")
+
+    # The workers of every round write their file lists below the run id
+    run = event.get('run') or uuid.uuid4().hex
+    return {
+        'queueDepth': queue_depth,
+        'run': run,
+        'workers': [{'worker': i, 'run': run} for i in range(workers)],
+        'files_processed': event.get('files_processed', 0),
+        'start_time': event.get('start_time') or datetime.now().strftime(TIME_FORMAT)
+    }
+
+def report_handler(event, context):
+    """
+    Last state of a fan-out round: merges the worker summaries.
+
+    Sends the single SNS report, with the file lists the workers wrote to S3,
+    once the workers found the queue empty; otherwise the state machine starts
+    another round.
+    """
+    SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
+
+    if not SNS_TOPIC_ARN:
+        raise ValueError("SNS_TOPIC_ARN environment variable is not set")
+
+    summaries = event.get('summaries', [])
+    files_processed = event.get('files_processed', 0)
+    for summary in summaries:
+        files_processed += summary['files']
+        print(f"Worker {summary['worker']}: {summary['files']} files "
+              f"from {summary['start_time']} to {summary['finish_time']}")
+
+    queue_empty = all(summary['queueEmpty'] for summary in summaries)
+    start_time = datetime.strptime(event['start_time'], TIME_FORMAT)
+
+    if queue_empty:
+        publish_summary(SNS_TOPIC_ARN, start_time, datetime.now(), load_file_lists(event['run']),
+                        workers=len(summaries))
+        print(f"{files_processed} files processed in run {event['run']}.")
+
+    return {
+        'statusCode': 200,
+        'queueEmpty': queue_empty,
+        'run': event['run'],
+        'files_processed': files_processed,
+        'start_time': event['start_time']
     }
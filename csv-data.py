@@ -1,8 +1,9 @@
 import boto3
-import csv
-from io import StringIO
 import os
 
+import alert_state
+import inventory_reader
+
 # AWS resource initialization
 dynamodb = boto3.resource('dynamodb', region_name='eu-central-1')
 sns_client = boto3.client('sns', region_name='eu-central-1')
@@ -34,11 +35,13 @@ def insert_items_from_csv(event, context):
 
             # Download CSV file from S3
             s3_client = boto3.client('s3')
-            response = s3_client.get_object(Bucket=s3_bucket, Key=s3_key)
-            csv_body = response['Body'].read().decode('utf-8')
+            csv_stream = inventory_reader.open_inventory_object(s3_client, s3_bucket, s3_key)
+
+            # Latest stock level and threshold per key, alerts are checked once per file
+            alert_candidates = {}
 
             # Read CSV file
-            csv_data = csv.DictReader(StringIO(csv_body), delimiter=';')
+            csv_data = inventory_reader.iter_rows(csv_stream)
             for row in csv_data:
                 try:
                     timestamp = row['Timestamp']
@@ -77,21 +80,28 @@ def insert_items_from_csv(event, context):
                     restock_item = restock_response.get('Item')
                     if restock_item:
                         restock_limit = restock_item.get('RestockIfBelow')
-                        if new_stock_level < restock_limit:
-                            # Item is below restock threshold, send notification
-                            message = (f"Item ID: {item_id}, Warehouse Name: {warehouse_name} "
-                                       f"has its current stock ({new_stock_level}) "
-                                       f"below the threshold limit ({restock_limit})")
-                            sns_client.publish(
-                                TopicArn=sns_topic_arn,
-                                Message=message,
-                                Subject="Stock Alert"
-                            )
-                            print("Notification sent successfully!")
+                        alert_candidates[(item_id, warehouse_name)] = (new_stock_level, restock_limit)
 
                 except Exception as e:
                     print(f"Failed to process row: {str(e)}")
 
+            # Only keys whose alert state changed are notified
+            to_alert = alert_state.filter_alerts(
+                (item_id, warehouse_name, stock, limit)
+                for (item_id, warehouse_name), (stock, limit) in alert_candidates.items()
+            )
+            for item_id, warehouse_name, new_stock_level, restock_limit in to_alert:
+                # Item is below restock threshold, send notification
+                message = (f"Item ID: {item_id}, Warehouse Name: {warehouse_name} "
+                           f"has its current stock ({new_stock_level}) "
+                           f"below the threshold limit ({restock_limit})")
+                sns_client.publish(
+                    TopicArn=sns_topic_arn,
+                    Message=message,
+                    Subject="Stock Alert"
+                )
+                print("Notification sent successfully!")
+
             print("CSV item insertion/update completed.")
     except Exception as e:
         print(f"Failed to process CSV file: {str(e)}")
@@ -1,17 +1,40 @@
+import queue
+import threading
+
 import boto3
-import csv
-from io import StringIO
 
-# Configurações do cliente DynamoDB
-dynamodb = boto3.resource('dynamodb', region_name='eu-central-1')
+import inventory_reader
+import throttle
+
+# Configurações do cliente DynamoDB (as tentativas são feitas pelo controlador de throttling)
+dynamodb = boto3.resource('dynamodb', region_name='eu-central-1', config=throttle.CLIENT_CONFIG)
 table = dynamodb.Table('Inventory')
 
+# Controlador de taxa: recua com jitter em caso de throttling e respeita um orçamento de tentativas
+write_controller = throttle.ThrottleController()
+
+# Threads de escrita; o controlador decide quantas escrevem ao mesmo tempo. Cada chave
+# (ItemId, WarehouseName) vai sempre para a mesma thread, mantendo a ordem das linhas
+write_queues = [queue.Queue(maxsize=1000) for _ in range(write_controller.max_concurrency)]
+
+def write_items(items):
+    while True:
+        item = items.get()
+        if item is None:
+            return
+        try:
+            # Inserir o item no DynamoDB
+            write_controller.call(table.put_item, Item=item, ReturnConsumedCapacity='TOTAL')
+            print(f"Inserido com sucesso: {item}")
+        except Exception as e:
+            print(f"Falha ao inserir: {str(e)}")
+
 # Dicionário para armazenar o último nível de estoque de cada item em cada armazém
 last_stock_levels = {}
 
 # Função para inserir itens no DynamoDB a partir de um arquivo CSV
 def insert_items_from_csv(csv_body):
-    csv_data = csv.DictReader(csv_body, delimiter=';')
+    csv_data = inventory_reader.iter_rows(csv_body)
     for row in csv_data:
         try:
             timestamp = row['Timestamp']
@@ -48,9 +71,8 @@ def insert_items_from_csv(csv_body):
                 'StockLevelChange': stock_level_change
             }
 
-            # Inserir o item no DynamoDB
-            table.put_item(Item=item)
-            print(f"Inserido com sucesso: {item}")
+            # Enviar o item para a thread de escrita da sua chave
+            write_queues[hash((item_id, warehouse_name)) % len(write_queues)].put(item)
         except Exception as e:
             print(f"Falha ao inserir: {str(e)}")
 
@@ -63,21 +85,35 @@ bucket_name = "unique-name-for-inventory-bucket-example"
 # Prefixo do diretório no seu bucket S3
 prefix = "inventory_files/"
 
-# Listar objetos no bucket S3
-response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-
-# Iterar sobre os objetos encontrados
-for obj in response.get('Contents', []):
-    # Obter o nome do objeto (chave)
-    object_key = obj['Key']
-    
-    # Obter o objeto do S3
-    response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-    
-    # Ler o corpo do arquivo CSV
-    csv_body = response['Body'].read().decode('utf-8')
-    
-    # Processar o arquivo CSV e inserir os itens no DynamoDB
-    insert_items_from_csv(StringIO(csv_body))
+# Threads daemon: um erro fora do laço por linha (listagem, descompressão) não deixa o processo preso
+write_threads = [threading.Thread(target=write_items, args=(items,), daemon=True) for items in write_queues]
+for write_thread in write_threads:
+    write_thread.start()
+
+try:
+    # Listar objetos no bucket S3
+    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+
+    # Iterar sobre os objetos encontrados
+    for obj in response.get('Contents', []):
+        # Obter o nome do objeto (chave)
+        object_key = obj['Key']
+
+        # Ignorar objetos que não são arquivos de inventário (.csv, .csv.gz, .csv.zst)
+        if not inventory_reader.is_inventory_key(object_key):
+            continue
+
+        # Ler o arquivo CSV do S3 como stream, descomprimindo se necessário
+        csv_body = inventory_reader.open_inventory_object(s3_client, bucket_name, object_key)
+
+        # Processar o arquivo CSV e inserir os itens no DynamoDB
+        insert_items_from_csv(csv_body)
+finally:
+    # Aguardar as escritas pendentes, também quando a leitura falhou
+    for items in write_queues:
+        items.put(None)
+    for write_thread in write_threads:
+        write_thread.join()
 
+write_controller.report("csv-loop")
 print("Inserção de itens de todos os arquivos CSV concluída.")
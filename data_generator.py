@@ -1,3 +1,4 @@
+import argparse
 import collections
 import csv
 import hashlib
@@ -24,6 +25,16 @@ AMOUNT_OF_TRANSACTIONS = 100_000
 AMOUNT_OF_THRESHOLD_UPDATES = 20
 AMOUNT_OF_THRESHOLD_UPDATES_PER_FILE = 40
 
+# How products are picked for the transaction stream
+DISTRIBUTIONS = ["uniform", "zipf", "hotset"]
+ZIPF_EXPONENT = 1.1
+# A small, rotating set of products receives most of the transactions
+HOT_SET_SIZE = 10
+HOT_SET_SHARE = 0.8
+HOT_SET_ROTATION = 2_000
+# Transactions added to a product/warehouse pair whose list ran out in a skewed stream
+REFILL_TRANSACTIONS = 100
+
 def product_generator(n: int) -> typing.List[str]:
     """
     Returns a list of product names with length n.
@@ -75,21 +86,76 @@ def create_transactions(product_names: typing.List[str], n: int) -> dict:
 
     return transactions
 
-def create_transaction_stream(transactions: dict, max_num: int=-1):
+def product_weights(products: typing.List[str], distribution: str, hot_set: typing.List[str]=None) -> dict:
+    """
+    Returns the relative probability of each product being picked next.
+
+    Args:
+        products (typing.List[str]): Product names, their order is the popularity rank
+        distribution (str): One of DISTRIBUTIONS
+        hot_set (typing.List[str]): The currently hot products for "hotset"
+
+    Returns:
+        dict: Maps each product name to its weight
+    """
+    if distribution == "uniform":
+        return {product: 1.0 for product in products}
+
+    if distribution == "zipf":
+        return {product: 1.0 / (rank ** ZIPF_EXPONENT) for rank, product in enumerate(products, start=1)}
+
+    if distribution == "hotset":
+        hot_set = set(hot_set or [])
+        cold_count = max(len(products) - len(hot_set), 1)
+        return {
+            product: HOT_SET_SHARE / len(hot_set) if product in hot_set else (1 - HOT_SET_SHARE) / cold_count
+            for product in products
+        }
+
+    raise ValueError(f"Unknown distribution {distribution}, expected one of {DISTRIBUTIONS}")
+
+def create_transaction_stream(transactions: dict, max_num: int=-1, distribution: str="uniform"):
+    """
+    Yields transactions of random products with increasing timestamps.
+
+    With a skewed distribution, hot products run out of pre-generated
+    transactions long before the stream ends, so their lists are refilled
+    instead of removed; pass max_num to bound such a stream.
+
+    Args:
+        transactions (dict): Transactions per product and warehouse, see create_transactions
+        max_num (int): Stop after this many transactions, -1 for all of them
+        distribution (str): One of DISTRIBUTIONS
+    """
 
     timestamp = datetime.now()
     number_of_transactions = 0
 
+    # Popularity ranks are fixed up front so a seeded run is reproducible
+    ranked_products = list(transactions.keys())
+    hot_set = None
+    if distribution == "hotset":
+        hot_set = random.sample(ranked_products, min(HOT_SET_SIZE, len(ranked_products)))
+    weights = product_weights(ranked_products, distribution, hot_set)
+
     while True:
-        product: str = random.choice(list(transactions.keys()))
+        if distribution == "uniform":
+            product: str = random.choice(list(transactions.keys()))
+        else:
+            candidates = list(transactions.keys())
+            product = random.choices(candidates, weights=[weights[name] for name in candidates])[0]
         product_id: str = hashlib.sha256(product.encode("utf-8")).hexdigest()
         warehouse: str = random.choice(list(transactions[product].keys()))
         transaction_value: int = transactions[product][warehouse].pop(0)
         timestamp += timedelta(seconds=random.randint(1, 40))
 
         if len(transactions[product][warehouse]) == 0:
-            # Remove the warehouse whose transactions have been exhausted
-            del transactions[product][warehouse]
+            if distribution != "uniform":
+                # Keep hot products hot: the new list starts with a restock
+                transactions[product][warehouse] = create_random_transactions(REFILL_TRANSACTIONS)
+            else:
+                # Remove the warehouse whose transactions have been exhausted
+                del transactions[product][warehouse]
         
         if len(transactions[product].keys()) == 0:
             # Remove the product whose transactions have been exhausted
@@ -98,13 +164,18 @@ def create_transaction_stream(transactions: dict, max_num: int=-1):
         number_of_transactions += 1
         yield [timestamp.isoformat()+"Z", warehouse, product_id, product, transaction_value]
 
+        if distribution == "hotset" and number_of_transactions % HOT_SET_ROTATION == 0:
+            # Move the burst to a different set of products
+            hot_set = random.sample(ranked_products, min(HOT_SET_SIZE, len(ranked_products)))
+            weights = product_weights(ranked_products, distribution, hot_set)
+
         if max_num != -1 and number_of_transactions >= max_num:
             break
 
         if len(transactions.keys()) == 0:
             break
     
-def write_batch(batch_of_transactions: typing.List[list]):
+def write_batch(batch_of_transactions: typing.List[list], directory: str=DIR_INVENTORY_FILES) -> str:
     
     last_timestamp = batch_of_transactions[-1][0]
     year, month, day = last_timestamp.split("T")[0].split("-")
@@ -112,7 +183,7 @@ def write_batch(batch_of_transactions: typing.List[list]):
     file_name = last_timestamp[:16].replace("T", "").replace("-", "").replace(":", "") + "_inventory.csv"
 
     # Create the file path if it doesn't exist.
-    file_path = f"{DIR_INVENTORY_FILES}/{year}/{month}/{day}/"
+    file_path = f"{directory}/{year}/{month}/{day}/"
     pathlib.Path(file_path).mkdir(parents=True, exist_ok=True)
 
     with open(file_path + file_name, mode="w", newline="") as inventory_file:
@@ -123,25 +194,37 @@ def write_batch(batch_of_transactions: typing.List[list]):
         for transaction in batch_of_transactions:
             writer.writerow(transaction)
 
-def create_transaction_files(transactions: dict):
+    return file_path + file_name
+
+def create_transaction_files(transactions: dict, max_num: int=AMOUNT_OF_TRANSACTIONS,
+                             distribution: str="uniform", directory: str=DIR_INVENTORY_FILES) -> typing.List[str]:
+    """
+    Writes the transaction stream to one inventory file per hour.
+
+    Returns:
+        typing.List[str]: Paths of the written files, in stream order
+    """
     start_prefix = ""
     batch = []
+    paths = []
 
-    for transaction in create_transaction_stream(transactions, AMOUNT_OF_TRANSACTIONS):
+    for transaction in create_transaction_stream(transactions, max_num, distribution):
 
         current_prefix = transaction[0][:13] # Select the part including the hour
 
         if current_prefix != start_prefix:
             start_prefix = current_prefix
             if len(batch) != 0:
-                write_batch(batch)
+                paths.append(write_batch(batch, directory))
             batch = []
         
         batch.append(transaction)
     
     # Write the last batch
     if len(batch) != 0:
-        write_batch(batch)
+        paths.append(write_batch(batch, directory))
+
+    return paths
 
 def create_thresholds(product_list: typing.List[str]) -> dict:
     
@@ -198,6 +281,11 @@ def create_threshold_stream(thresholds: dict, max_num: int):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Generate inventory and restock threshold files")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="uniform",
+                        help="How often each product appears in the transaction stream")
+    args = parser.parse_args()
+
     random.seed(7)  # Making this consistent
 
     create_directories_if_not_exist()
@@ -210,7 +298,7 @@ def main():
         int(AMOUNT_OF_TRANSACTIONS/AMOUNT_OF_PRODUCTS) + 10
     )
 
-    create_transaction_files(transactions)
+    create_transaction_files(transactions, distribution=args.distribution)
 
     thresholds = create_thresholds(product_list)
 
@@ -0,0 +1,256 @@
+import argparse
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import boto3
+
+import data_generator
+import inventory_batch
+import inventory_reader
+import throttle
+
+# Mirrors local.inventory_indexes / inventory_index_profiles in main.tf:
+# name -> (hash key, range key, projection, projected non-key attributes)
+INVENTORY_INDEXES = {
+    'StockLevelChangeIndex': ('StockLevelChange', None, 'ALL', None),
+    'ItemNameIndex': ('ItemName', None, 'ALL', None),
+    'WarehouseNameIndex': ('WarehouseName', None, 'ALL', None),
+    'TimestampIndex': ('Timestamp', None, 'ALL', None),
+    'WarehouseStockIndex': ('WarehouseName', 'StockLevelChange', 'INCLUDE', ['ItemName']),
+}
+# "original" is the index set the table was created with and the baseline of the
+# comparison. The lean profile keeps WarehouseStockIndex, whose range key is the
+# stock itself: every stock update still moves its entry (a delete and a put).
+INDEX_PROFILES = {
+    'original': ['StockLevelChangeIndex', 'ItemNameIndex', 'WarehouseNameIndex', 'TimestampIndex'],
+    'full': list(INVENTORY_INDEXES),
+    'lean': ['WarehouseStockIndex'],
+}
+
+TABLE_KEYS = ('ItemId', 'WarehouseName')
+
+# Index entries carry ~100 bytes of overhead on top of their attributes
+INDEX_ENTRY_OVERHEAD = 100
+WRITE_UNIT_BYTES = 1024
+
+
+def _attribute_size(name, value):
+    if isinstance(value, (int, float)):
+        # Numbers take about one byte per two significant digits plus one
+        return len(name) + 1 + (len(str(abs(value))) + 1) // 2
+    return len(name) + len(str(value).encode('utf-8'))
+
+
+def item_size(item):
+    return sum(_attribute_size(name, value) for name, value in item.items())
+
+
+def index_entry(item, index):
+    """
+    Returns:
+        dict: The attributes the index stores for `item`, or None if the item
+              lacks an index key (sparse index)
+    """
+    hash_key, range_key, projection, non_key_attributes = index
+    if hash_key not in item or (range_key and range_key not in item):
+        return None
+
+    if projection == 'ALL':
+        return dict(item)
+    names = set(TABLE_KEYS) | {hash_key} | ({range_key} if range_key else set())
+    if projection == 'INCLUDE':
+        names |= set(non_key_attributes)
+    return {name: value for name, value in item.items() if name in names}
+
+
+def _units(size):
+    return max(1, math.ceil(size / WRITE_UNIT_BYTES))
+
+
+def write_units(old_item, new_item, indexes):
+    """
+    Write units of replacing `old_item` with `new_item` in the table and its indexes.
+
+    Follows DynamoDB's GSI accounting: a changed index key deletes the old entry
+    and puts a new one, a changed projected attribute updates the entry in place,
+    and indexes whose projection did not change are not written at all.
+
+    Returns:
+        tuple: (table units, dict of index name -> units)
+    """
+    table_units = _units(max(item_size(old_item or {}), item_size(new_item)))
+
+    index_units = {}
+    for name, index in indexes.items():
+        hash_key, range_key = index[0], index[1]
+        old_entry = index_entry(old_item, index) if old_item else None
+        new_entry = index_entry(new_item, index)
+        if old_entry == new_entry:
+            continue
+
+        units = 0
+        key_changed = (old_entry is None or new_entry is None
+                       or old_entry.get(hash_key) != new_entry.get(hash_key)
+                       or (range_key and old_entry.get(range_key) != new_entry.get(range_key)))
+        if key_changed:
+            if old_entry is not None:
+                units += _units(item_size(old_entry) + INDEX_ENTRY_OVERHEAD)
+            if new_entry is not None:
+                units += _units(item_size(new_entry) + INDEX_ENTRY_OVERHEAD)
+        else:
+            units += _units(max(item_size(old_entry), item_size(new_entry)) + INDEX_ENTRY_OVERHEAD)
+        index_units[name] = units
+
+    return table_units, index_units
+
+
+def iter_files(directory):
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            key = "inventory_files/" + os.path.relpath(path, directory).replace(os.sep, '/')
+            if inventory_reader.is_inventory_key(key):
+                yield key, path
+
+
+def estimate(directory, profile, writer):
+    """
+    Replays the inventory files against an in-memory model of the Inventory table.
+
+    Args:
+        directory (str): The inventory_files directory
+        profile (str): Index profile from INDEX_PROFILES
+        writer (str): "handler" (one ADD per key and file, like inventory_handler)
+                      or "rows" (one put_item per row, like csv-loop)
+
+    Returns:
+        dict: Write units of the table and every index, and units per ingested row
+    """
+    indexes = {name: INVENTORY_INDEXES[name] for name in INDEX_PROFILES[profile]}
+    items = {}
+    rows = 0
+    writes = 0
+    table_units = 0
+    index_units = defaultdict(int)
+
+    for object_key, path in sorted(iter_files(directory)):
+        with open(path, 'rb') as raw:
+            batch = inventory_batch.parse_inventory_batch(inventory_reader.open_text(raw, object_key))
+        rows += len(batch)
+
+        if writer == 'handler':
+            updates = []
+            for (item_id, warehouse_name), delta in batch.sum_by_key().items():
+                old_item = items.get((item_id, warehouse_name))
+                new_item = dict(old_item or {'ItemId': item_id, 'WarehouseName': warehouse_name})
+                new_item['StockLevelChange'] = new_item.get('StockLevelChange', 0) + delta
+                updates.append(((item_id, warehouse_name), old_item, new_item))
+        else:
+            updates = []
+            for i in range(len(batch)):
+                item_id = batch.item_ids[batch.item_column[i]]
+                warehouse_name = batch.warehouses[batch.warehouse_column[i]]
+                old_item = items.get((item_id, warehouse_name))
+                new_item = {'ItemId': item_id, 'WarehouseName': warehouse_name,
+                            'ItemName': batch.item_names[batch.item_column[i]],
+                            'Timestamp': datetime.fromtimestamp(batch.timestamp_column[i], timezone.utc).isoformat(),
+                            'StockLevelChange': batch.delta_column[i]}
+                updates.append(((item_id, warehouse_name), old_item, new_item))
+                items[(item_id, warehouse_name)] = new_item
+
+        for key, old_item, new_item in updates:
+            units, per_index = write_units(old_item, new_item, indexes)
+            table_units += units
+            for name, value in per_index.items():
+                index_units[name] += value
+            items[key] = new_item
+            writes += 1
+
+    total = table_units + sum(index_units.values())
+    return {
+        'profile': profile,
+        'writer': writer,
+        'rows': rows,
+        'writes': writes,
+        'table_units': table_units,
+        'index_units': dict(index_units),
+        'total_units': total,
+        'units_per_row': round(total / rows, 3) if rows else 0.0,
+        'units_per_write': round(total / writes, 3) if writes else 0.0,
+    }
+
+
+def measure(directory, table_name, limit=None):
+    """
+    Applies the files' deltas to a (test) table like inventory_handler does and
+    sums the consumed write units DynamoDB reports per table and index.
+    """
+    client = boto3.client('dynamodb', config=throttle.CLIENT_CONFIG)
+    controller = throttle.ThrottleController()
+    rows = 0
+    table_units = 0.0
+    index_units = defaultdict(float)
+
+    for count, (object_key, path) in enumerate(sorted(iter_files(directory))):
+        if limit is not None and count >= limit:
+            break
+        with open(path, 'rb') as raw:
+            batch = inventory_batch.parse_inventory_batch(inventory_reader.open_text(raw, object_key))
+        rows += len(batch)
+
+        for (item_id, warehouse_name), delta in batch.sum_by_key().items():
+            response = controller.call(
+                client.update_item,
+                TableName=table_name,
+                Key={'ItemId': {'S': item_id}, 'WarehouseName': {'S': warehouse_name}},
+                UpdateExpression='ADD StockLevelChange :val',
+                ExpressionAttributeValues={':val': {'N': str(delta)}},
+                ReturnConsumedCapacity='INDEXES'
+            )
+            consumed = response['ConsumedCapacity']
+            table_units += consumed.get('Table', {}).get('CapacityUnits', 0.0)
+            for name, capacity in consumed.get('GlobalSecondaryIndexes', {}).items():
+                index_units[name] += capacity['CapacityUnits']
+
+    total = table_units + sum(index_units.values())
+    return {
+        'table': table_name,
+        'rows': rows,
+        'table_units': table_units,
+        'index_units': dict(index_units),
+        'total_units': total,
+        'units_per_row': round(total / rows, 3) if rows else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write units per ingested row for the Inventory index profiles")
+    parser.add_argument("--directory", default=data_generator.DIR_INVENTORY_FILES,
+                        help="The inventory_files directory to replay")
+    parser.add_argument("--writer", choices=["handler", "rows"], default="handler",
+                        help="handler: one ADD per key and file, rows: one put_item per row")
+    parser.add_argument("--table", help="Measure the consumed capacity on this (test) table instead of estimating")
+    parser.add_argument("--limit", type=int, help="Only replay this many files when measuring")
+    args = parser.parse_args()
+
+    if args.table:
+        print(f"Measured: {measure(args.directory, args.table, args.limit)}")
+        return
+
+    results = {profile: estimate(args.directory, profile, args.writer) for profile in INDEX_PROFILES}
+    for result in results.values():
+        print(f"{result['profile']:>8}: {result['units_per_row']} WCU/row, {result['units_per_write']} WCU/write, "
+              f"table {result['table_units']}, indexes {result['index_units']}")
+    lean = results['lean']['total_units']
+    if lean:
+        for profile in ('original', 'full'):
+            print(f"The lean profile needs {results[profile]['total_units'] / lean:.2f}x fewer write units "
+                  f"than the {profile} one.")
+        print(f"WarehouseStockIndex writes: {results['lean']['index_units'].get('WarehouseStockIndex', 0)} units, "
+              f"its entry moves with every stock update.")
+
+
+if __name__ == "__main__":
+    main()
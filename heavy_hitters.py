@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+import inventory_batch
+import inventory_reader
+
+# Sketch size: an estimate exceeds the true count by at most e / width * total
+# with probability 1 - e^-depth; 2048 x 4 counters are 64 KB per sketch
+HEAVY_HITTERS_WIDTH = int(os.environ.get('HEAVY_HITTERS_WIDTH', '2048'))
+HEAVY_HITTERS_DEPTH = int(os.environ.get('HEAVY_HITTERS_DEPTH', '4'))
+HEAVY_HITTERS_TOP_K = int(os.environ.get('HEAVY_HITTERS_TOP_K', '10'))
+# Directory the command line reads by default, the same as data_generator's output
+HEAVY_HITTERS_DIRECTORY = os.environ.get('HEAVY_HITTERS_DIRECTORY',
+                                         os.path.join(os.path.dirname(__file__), "inventory_files"))
+# Counts are halved every half-life, so keys that stay hot across warm invocations
+# rise to the top while keys that cooled down fade out; 0 never decays
+HEAVY_HITTERS_HALF_LIFE_SECONDS = float(os.environ.get('HEAVY_HITTERS_HALF_LIFE_SECONDS', '900'))
+# CloudWatch namespace of the hot key metrics
+HEAVY_HITTERS_METRICS_NAMESPACE = os.environ.get('HEAVY_HITTERS_METRICS_NAMESPACE', 'Inventory')
+
+
+class CountMinSketch:
+    """
+    Fixed-size frequency summary; estimates never undercount.
+
+    Uses conservative update: a key's counters are only raised to its new
+    estimate, which keeps the overcount of cold keys that share counters low.
+    """
+
+    def __init__(self, width=HEAVY_HITTERS_WIDTH, depth=HEAVY_HITTERS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('q', bytes(8 * width)) for _ in range(depth)]
+        self.total = 0
+
+    def _columns(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[4 * i:4 * i + 4], 'little') % self.width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """
+        Returns:
+            int: The estimate of the key after the update
+        """
+        columns = self._columns(key)
+        estimate = min(row[column] for row, column in zip(self.rows, columns)) + count
+        for row, column in zip(self.rows, columns):
+            if row[column] < estimate:
+                row[column] = estimate
+        self.total += count
+        return estimate
+
+    def estimate(self, key):
+        return min(row[column] for row, column in zip(self.rows, self._columns(key)))
+
+    def decay(self, factor):
+        """Scales every counter by `factor`, estimates stay upper bounds of the decayed counts."""
+        self.rows = [array('q', (int(value * factor) for value in row)) for row in self.rows]
+        self.total = int(self.total * factor)
+
+
+class TopK:
+    """
+    The k keys with the largest estimates, in a min-heap with lazy deletion.
+    """
+
+    def __init__(self, k=HEAVY_HITTERS_TOP_K):
+        self.k = k
+        self.estimates = {}
+        self._heap = []
+
+    def update(self, key, estimate):
+        if self.k <= 0:
+            return
+        if key in self.estimates or len(self.estimates) < self.k:
+            self.estimates[key] = estimate
+            heapq.heappush(self._heap, (estimate, key))
+        elif estimate > self._minimum():
+            _, evicted = heapq.heappop(self._heap)
+            del self.estimates[evicted]
+            self.estimates[key] = estimate
+            heapq.heappush(self._heap, (estimate, key))
+
+        if len(self._heap) > 4 * self.k:
+            # Drop the stale entries of keys whose estimate grew
+            self._heap = [(value, key) for key, value in self.estimates.items()]
+            heapq.heapify(self._heap)
+
+    def _minimum(self):
+        # Entries whose estimate changed since they were pushed are skipped
+        while self._heap[0][0] != self.estimates.get(self._heap[0][1]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0]
+
+    def items(self):
+        return sorted(self.estimates.items(), key=lambda entry: entry[1], reverse=True)
+
+    def decay(self, factor):
+        self.estimates = {key: int(value * factor) for key, value in self.estimates.items()}
+        self._heap = [(value, key) for key, value in self.estimates.items()]
+        heapq.heapify(self._heap)
+
+
+class HeavyHitters:
+    """
+    Tracks the hottest (ItemId, WarehouseName) keys by number of updates and by absolute stock change.
+
+    Meant to live as long as the process (a warm Lambda container), with the
+    counts decaying by half every `half_life` seconds.
+    """
+
+    def __init__(self, width=HEAVY_HITTERS_WIDTH, depth=HEAVY_HITTERS_DEPTH, k=HEAVY_HITTERS_TOP_K,
+                 half_life=HEAVY_HITTERS_HALF_LIFE_SECONDS):
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.updates = CountMinSketch(self.width, self.depth)
+            self.volume = CountMinSketch(self.width, self.depth)
+            self.top_updates = TopK(self.k)
+            self.top_volume = TopK(self.k)
+            self.decayed_at = time.monotonic()
+
+    def _decay(self):
+        # Whole half-lives only, so the decay does not depend on how often keys are added
+        half_lives = int((time.monotonic() - self.decayed_at) / self.half_life) if self.half_life else 0
+        if half_lives:
+            factor = 0.5 ** half_lives
+            for sketch in (self.updates, self.volume):
+                sketch.decay(factor)
+            for top in (self.top_updates, self.top_volume):
+                top.decay(factor)
+            self.decayed_at += half_lives * self.half_life
+
+    def add(self, item_id, warehouse_name, updates, volume):
+        key = f"{item_id}\x00{warehouse_name}"
+        with self._lock:
+            self._decay()
+            self.top_updates.update(key, self.updates.add(key, updates))
+            self.top_volume.update(key, self.volume.add(key, volume))
+
+    def add_batch(self, batch):
+        """
+        Counts the rows and the absolute stock change of every key in an InventoryBatch.
+
+        Rows are summed per key first, so the sketches are updated once per key and file.
+        """
+        updates = defaultdict(int)
+        volume = defaultdict(int)
+        for item_code, warehouse_code, delta in zip(batch.item_column, batch.warehouse_column, batch.delta_column):
+            updates[(item_code, warehouse_code)] += 1
+            volume[(item_code, warehouse_code)] += abs(delta)
+
+        for (item_code, warehouse_code), count in updates.items():
+            self.add(batch.item_ids[item_code], batch.warehouses[warehouse_code],
+                     count, volume[(item_code, warehouse_code)])
+
+    def top(self):
+        """
+        Returns:
+            dict: 'updates' and 'volume', each a list of (ItemId, WarehouseName, estimate), largest first
+        """
+        with self._lock:
+            self._decay()
+            return {
+                name: [tuple(key.split('\x00')) + (estimate,) for key, estimate in top.items()]
+                for name, top in (('updates', self.top_updates), ('volume', self.top_volume))
+            }
+
+    def report(self, name="Ingest"):
+        top = self.top()
+        print(f"{name} hot keys by updates (of {self.updates.total}): "
+              f"{[(item_id[:12], warehouse_name, count) for item_id, warehouse_name, count in top['updates']]}")
+        print(f"{name} hot keys by absolute change (of {self.volume.total}): "
+              f"{[(item_id[:12], warehouse_name, count) for item_id, warehouse_name, count in top['volume']]}")
+
+    def emit_metrics(self, name="Ingest"):
+        """
+        Prints the top-k keys as CloudWatch Embedded Metric Format records, one per rank.
+
+        Only the source and the rank are dimensions, which keeps the number of
+        custom metrics at k per source; the key itself is a property of the log record.
+        """
+        top = self.top()
+        by_volume = {(item_id, warehouse_name): count for item_id, warehouse_name, count in top['volume']}
+        timestamp = int(time.time() * 1000)
+        for rank, (item_id, warehouse_name, count) in enumerate(top['updates'], start=1):
+            metrics = [{'Name': 'HotKeyUpdates', 'Unit': 'Count'}]
+            record = {'Source': name, 'Rank': str(rank), 'ItemId': item_id, 'WarehouseName': warehouse_name,
+                      'HotKeyUpdates': count}
+            if (item_id, warehouse_name) in by_volume:
+                metrics.append({'Name': 'HotKeyVolume', 'Unit': 'Count'})
+                record['HotKeyVolume'] = by_volume[(item_id, warehouse_name)]
+            record['_aws'] = {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': HEAVY_HITTERS_METRICS_NAMESPACE,
+                    'Dimensions': [['Source', 'Rank']],
+                    'Metrics': metrics,
+                }],
+            }
+            print(json.dumps(record))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the hottest Inventory keys in local inventory files")
+    parser.add_argument("--directory", default=HEAVY_HITTERS_DIRECTORY,
+                        help="The inventory_files directory to read")
+    parser.add_argument("--top", type=int, default=HEAVY_HITTERS_TOP_K)
+    parser.add_argument("--width", type=int, default=HEAVY_HITTERS_WIDTH)
+    parser.add_argument("--depth", type=int, default=HEAVY_HITTERS_DEPTH)
+    parser.add_argument("--exact", action="store_true", help="Also count exactly and print the estimation error")
+    args = parser.parse_args()
+
+    hitters = HeavyHitters(args.width, args.depth, args.top)
+    exact = defaultdict(int)
+    files = 0
+    for root, _, names in os.walk(args.directory):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            object_key = "inventory_files/" + os.path.relpath(path, args.directory).replace(os.sep, '/')
+            if not inventory_reader.is_inventory_key(object_key):
+                continue
+            with open(path, 'rb') as raw:
+                batch = inventory_batch.parse_inventory_batch(inventory_reader.open_text(raw, object_key))
+            hitters.add_batch(batch)
+            files += 1
+            if args.exact:
+                for _, warehouse_name, item_id, _ in batch.transactions():
+                    exact[(item_id, warehouse_name)] += 1
+
+    print(f"Read {files} files.")
+    hitters.report("Offline")
+
+    if args.exact:
+        for item_id, warehouse_name, estimate in hitters.top()['updates']:
+            print(f"  {item_id[:12]} {warehouse_name:<12} estimated {estimate:>6} exact {exact[(item_id, warehouse_name)]:>6}")
+
+
+if __name__ == "__main__":
+    main()
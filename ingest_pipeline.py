@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrency per stage and depth of the bounded queues between the stages.
+# The notify stage always runs on one thread of its own: the notifier uses
+# DynamoDB resources, which must not be shared between threads.
+FETCH_CONCURRENCY = int(os.environ.get('PIPELINE_FETCH_CONCURRENCY', '4'))
+WRITE_CONCURRENCY = int(os.environ.get('PIPELINE_WRITE_CONCURRENCY', '16'))
+QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '64'))
+
+# Keys per write task, small enough to spread one file over all writers
+WRITE_CHUNK_SIZE = int(os.environ.get('PIPELINE_WRITE_CHUNK_SIZE', '25'))
+
+
+class _FileState:
+    """Progress of one inventory file through the write and notify stages."""
+
+    def __init__(self, bucket_name, object_key, batch, chunks):
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.batch = batch
+        self.pending_chunks = chunks
+        self.stock_levels = {}
+        self.error = None
+
+
+async def run_pipeline(files, read, write, notify, finish,
+                       fetch_concurrency=FETCH_CONCURRENCY, write_concurrency=WRITE_CONCURRENCY,
+                       queue_size=QUEUE_SIZE, chunk_size=WRITE_CHUNK_SIZE):
+    """
+    Processes inventory files in overlapping stages connected by bounded queues.
+
+    fetch/parse -> write (pool) -> notify/finish
+
+    Several files are fetched and parsed at once while earlier files are being
+    written; a full queue blocks the stage in front of it, so a slow stage
+    throttles the ones before it instead of buffering whole files in memory.
+    The stage callables are blocking (boto3); fetch and write share a thread
+    pool, notify and finish run on a single thread that is never shared.
+
+    Args:
+        files (list): (bucket name, object key) pairs
+        read (callable): (bucket, key) -> InventoryBatch
+        write (callable): (bucket, key, deltas) -> dict of stock levels after the write
+        notify (callable): (stock levels) -> None, checks the restock thresholds
+        finish (callable): (bucket, key, batch) -> None, runs once a file is fully written
+        chunk_size (int): Keys per write task; 0 writes every file in one task, as the
+            write-behind queue expects one compacted batch per file
+
+    Returns:
+        dict: Counters of the run
+
+    Raises:
+        Exception: The first error of any file, after all other files were processed
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=fetch_concurrency + write_concurrency)
+    notify_executor = ThreadPoolExecutor(max_workers=1)
+
+    fetch_queue = asyncio.Queue()
+    for bucket_name, object_key in files:
+        fetch_queue.put_nowait((bucket_name, object_key))
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    notify_queue = asyncio.Queue(maxsize=queue_size)
+
+    errors = []
+    stats = {'files': 0, 'rows': 0, 'keys': 0, 'writes': 0}
+
+    async def fetcher():
+        while not fetch_queue.empty():
+            bucket_name, object_key = fetch_queue.get_nowait()
+            try:
+                batch = await loop.run_in_executor(executor, read, bucket_name, object_key)
+                deltas = list(batch.sum_by_key().items())
+            except Exception as e:
+                print(f"Failed to read {object_key}: {str(e)}")
+                errors.append(e)
+                continue
+
+            stats['rows'] += len(batch)
+            stats['keys'] += len(deltas)
+            size = chunk_size or len(deltas) or 1
+            chunks = [dict(deltas[start:start + size]) for start in range(0, len(deltas), size)]
+            state = _FileState(bucket_name, object_key, batch, len(chunks))
+
+            if not chunks:
+                await notify_queue.put(state)
+            for chunk in chunks:
+                await write_queue.put((state, chunk))
+
+    async def writer():
+        while True:
+            task = await write_queue.get()
+            if task is None:
+                return
+            state, chunk = task
+            try:
+                stock_levels = await loop.run_in_executor(
+                    executor, write, state.bucket_name, state.object_key, chunk)
+                state.stock_levels.update(stock_levels)
+                stats['writes'] += len(chunk)
+            except Exception as e:
+                print(f"Failed to write deltas of {state.object_key}: {str(e)}")
+                state.error = e
+
+            state.pending_chunks -= 1
+            if state.pending_chunks == 0:
+                await notify_queue.put(state)
+
+    async def notifier():
+        while True:
+            state = await notify_queue.get()
+            if state is None:
+                return
+            if state.error is not None:
+                errors.append(state.error)
+                continue
+            try:
+                if state.stock_levels:
+                    await loop.run_in_executor(notify_executor, notify, state.stock_levels)
+                await loop.run_in_executor(notify_executor, finish, state.bucket_name, state.object_key, state.batch)
+                stats['files'] += 1
+            except Exception as e:
+                print(f"Failed to finish {state.object_key}: {str(e)}")
+                errors.append(e)
+
+    start = time.monotonic()
+    writers = [asyncio.ensure_future(writer()) for _ in range(write_concurrency)]
+    notify_task = asyncio.ensure_future(notifier())
+    try:
+        await asyncio.gather(*(fetcher() for _ in range(fetch_concurrency)))
+        for _ in writers:
+            await write_queue.put(None)
+        await asyncio.gather(*writers)
+        await notify_queue.put(None)
+        await notify_task
+    finally:
+        executor.shutdown(wait=False)
+        notify_executor.shutdown(wait=False)
+
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    print(f"Pipeline processed {stats['files']} of {len(files)} files: {stats}")
+
+    if errors:
+        raise errors[0]
+    return stats
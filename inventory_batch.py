@@ -0,0 +1,171 @@
+import csv
+from array import array
+from collections import defaultdict
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # Optional, the pure Python fallbacks give the same results
+    np = None
+
+COLUMNS = ["Timestamp", "WarehouseName", "ItemId", "ItemName", "StockLevelChange"]
+
+
+def parse_timestamp(value: str) -> int:
+    """
+    Converts an ISO8601 timestamp from an inventory file to epoch seconds.
+
+    Python 3.8's fromisoformat rejects offsets without a colon (+0000) and
+    fractions other than 3 or 6 digits, those fall back to the file format's
+    strptime pattern.
+    """
+    try:
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+    except ValueError:
+        return int(datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp())
+
+
+class InventoryBatch:
+    """
+    Columnar, dictionary-encoded representation of one inventory file.
+
+    ItemId and WarehouseName are stored once in the dictionaries, the rows only
+    hold their integer codes next to the timestamp and the stock change.
+    """
+
+    def __init__(self):
+        # Dictionaries, the code of a value is its position
+        self.item_ids = []
+        self.item_names = []
+        self.warehouses = []
+        self._item_codes = {}
+        self._warehouse_codes = {}
+
+        # One entry per row
+        self.item_column = array('I')
+        self.warehouse_column = array('H')
+        self.timestamp_column = array('q')
+        self.delta_column = array('i')
+
+        # Rows that could not be parsed
+        self.errors = 0
+
+    def __len__(self):
+        return len(self.delta_column)
+
+    def append(self, timestamp: int, warehouse_name: str, item_id: str, item_name: str, stock_level_change: int):
+        item_code = self._item_codes.get(item_id)
+        if item_code is None:
+            item_code = self._item_codes[item_id] = len(self.item_ids)
+            self.item_ids.append(item_id)
+            self.item_names.append(item_name)
+
+        warehouse_code = self._warehouse_codes.get(warehouse_name)
+        if warehouse_code is None:
+            warehouse_code = self._warehouse_codes[warehouse_name] = len(self.warehouses)
+            self.warehouses.append(warehouse_name)
+
+        self.item_column.append(item_code)
+        self.warehouse_column.append(warehouse_code)
+        self.timestamp_column.append(timestamp)
+        self.delta_column.append(stock_level_change)
+
+    def transactions(self):
+        """
+        Returns:
+            typing.Iterator[tuple]: (epoch seconds, WarehouseName, ItemId, StockLevelChange) per row
+        """
+        for i in range(len(self)):
+            yield (self.timestamp_column[i], self.warehouses[self.warehouse_column[i]],
+                   self.item_ids[self.item_column[i]], self.delta_column[i])
+
+    def sum_by_key(self) -> dict:
+        """
+        Sums the stock changes per (ItemId, WarehouseName).
+
+        Returns:
+            dict: Maps (ItemId, WarehouseName) to the net StockLevelChange of the file
+        """
+        warehouse_count = max(len(self.warehouses), 1)
+
+        if np is not None and len(self):
+            keys = (np.frombuffer(self.item_column, dtype=np.uint32).astype(np.int64) * warehouse_count
+                    + np.frombuffer(self.warehouse_column, dtype=np.uint16))
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            sums = np.zeros(len(unique_keys), dtype=np.int64)
+            np.add.at(sums, inverse, np.frombuffer(self.delta_column, dtype=np.int32))
+            pairs = zip(unique_keys.tolist(), sums.tolist())
+        else:
+            totals = defaultdict(int)
+            for item_code, warehouse_code, delta in zip(self.item_column, self.warehouse_column, self.delta_column):
+                totals[item_code * warehouse_count + warehouse_code] += delta
+            pairs = totals.items()
+
+        return {
+            (self.item_ids[key // warehouse_count], self.warehouses[key % warehouse_count]): total
+            for key, total in pairs
+        }
+
+
+def parse_inventory_batch(text_stream) -> InventoryBatch:
+    """
+    Parses a ';' delimited inventory file into an InventoryBatch.
+
+    Args:
+        text_stream: Iterable of CSV lines, e.g. from inventory_reader.open_text
+
+    Returns:
+        InventoryBatch: The parsed rows; unparseable rows are counted in `errors`
+    """
+    batch = InventoryBatch()
+    reader = csv.reader(text_stream, delimiter=';')
+
+    header = next(reader, None)
+    if header is None:
+        return batch
+    timestamp_i, warehouse_i, item_id_i, item_name_i, change_i = (header.index(column) for column in COLUMNS)
+
+    for row in reader:
+        if not row:
+            continue
+        try:
+            batch.append(parse_timestamp(row[timestamp_i]), row[warehouse_i], row[item_id_i],
+                         row[item_name_i], int(row[change_i]))
+        except Exception as e:
+            batch.errors += 1
+            print(f"Failed to process row: {str(e)}")
+
+    return batch
+
+
+def alert_candidates(stock_levels: dict, restock_limits: dict, rearm_margin: int) -> list:
+    """
+    Compares stock levels against the restock thresholds in one pass.
+
+    Keys inside the band threshold <= stock < threshold + rearm_margin can
+    neither raise nor re-arm an alert and are left out, as are items without
+    a threshold.
+
+    Args:
+        stock_levels (dict): Maps (ItemId, WarehouseName) to the current stock level
+        restock_limits (dict): Maps ItemId to RestockIfBelow (None if not set)
+        rearm_margin (int): alert_state.ALERT_REARM_MARGIN
+
+    Returns:
+        list: (ItemId, WarehouseName, stock level, threshold) tuples for alert_state.filter_alerts
+    """
+    keys = [key for key in stock_levels if restock_limits.get(key[0]) is not None]
+    if not keys:
+        return []
+
+    stock = [stock_levels[key] for key in keys]
+    limits = [int(restock_limits[key[0]]) for key in keys]
+
+    if np is not None:
+        stock_array = np.array(stock, dtype=np.int64)
+        limit_array = np.array(limits, dtype=np.int64)
+        mask = ((stock_array < limit_array) | (stock_array >= limit_array + rearm_margin)).tolist()
+    else:
+        mask = [s < limit or s >= limit + rearm_margin for s, limit in zip(stock, limits)]
+
+    return [(key[0], key[1], s, limit) for key, s, limit, keep in zip(keys, stock, limits, mask) if keep]
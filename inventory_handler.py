@@ -1,22 +1,112 @@
+import asyncio
 import boto3
-import csv
 import json
-from io import StringIO
-from datetime import datetime
 import os
 
+import alert_state
+import heavy_hitters
+import ingest_pipeline
+import inventory_batch
+import inventory_reader
+import profiling
+import throttle
+import transaction_log
+import write_behind
+
 # AWS resource initialization
-ddb = boto3.resource('dynamodb')
+ddb = boto3.resource('dynamodb', config=throttle.CLIENT_CONFIG)
 inventory_table = ddb.Table('Inventory')
-restock_table = ddb.Table('Restock')
-sns_client = boto3.client('sns', region_name='eu-central-1')
+s3 = boto3.client('s3')
 sqs_client = boto3.client('sqs', region_name='eu-central-1')
 sqs_queue_url = os.environ['SQS_QUEUE_URL']
 
+# Run the files of an event through the staged asyncio pipeline instead of one after another
+PIPELINE_ENABLED = os.environ.get('PIPELINE_ENABLED', '').lower() == 'true'
+
+# Adapts the number of concurrent Inventory writes to throttling (shared by the pipeline's writers)
+write_controller = throttle.ThrottleController(max_concurrency=ingest_pipeline.WRITE_CONCURRENCY)
+
+# Hottest ItemId/WarehouseName keys by number of updates and by absolute change, kept across
+# warm invocations with decaying counts
+hot_keys = heavy_hitters.HeavyHitters()
+
+def read_inventory_file(bucket_name, object_key):
+    # Stream the (possibly compressed) CSV file from S3 into a columnar batch
+    csv_stream = inventory_reader.open_inventory_object(s3, bucket_name, object_key)
+    batch = inventory_batch.parse_inventory_batch(csv_stream)
+    print(f"Parsed {len(batch)} rows ({batch.errors} failed) for {len(batch.item_ids)} items from {object_key}.")
+    profiling.record(object_key, len(batch))
+    hot_keys.add_batch(batch)
+    return batch
+
+def apply_deltas(deltas):
+    """
+    Adds the net stock change of every key to the Inventory table, one write per key.
+
+    Uses the table's client, which unlike the resource is safe to share between
+    the pipeline's writer threads.
+
+    Returns:
+        dict: Maps (ItemId, WarehouseName) to the stock level after the update
+    """
+    stock_levels = {}
+    for (item_id, warehouse_name), delta in deltas.items():
+        try:
+            response = write_controller.call(
+                inventory_table.meta.client.update_item,
+                TableName=inventory_table.name,
+                Key={'ItemId': item_id, 'WarehouseName': warehouse_name},
+                UpdateExpression='ADD StockLevelChange :val',
+                ExpressionAttributeValues={':val': delta},
+                ReturnValues='UPDATED_NEW',
+                ReturnConsumedCapacity='TOTAL'
+            )
+            stock_levels[(item_id, warehouse_name)] = int(response['Attributes']['StockLevelChange'])
+        except Exception as e:
+            print(f"Failed to update item {item_id} in warehouse {warehouse_name} (delta {delta}): {str(e)}")
+
+    print(f"{len(stock_levels)} items updated in DynamoDB.")
+    return stock_levels
+
+def write_deltas(bucket_name, object_key, deltas):
+    if write_behind.write_behind_queue_url:
+        # The accumulator applies the deltas and checks the thresholds
+        write_behind.enqueue_deltas(bucket_name, object_key, deltas)
+        return {}
+    return apply_deltas(deltas)
+
+def notify_stock_levels(stock_levels):
+    try:
+        # Only keys whose alert state changed are notified
+        alert_state.notify_low_stock(stock_levels)
+    except Exception as e:
+        print(f"Failed to check restock levels: {str(e)}")
+
+def finish_inventory_file(bucket_name, object_key, batch):
+    if transaction_log.TRANSACTION_LOG_BUCKET:
+        transaction_log.append_segment(object_key, batch)
+
+    # Send the file reference to SQS, the batch job reads the file from S3
+    sqs_client.send_message(
+        QueueUrl=sqs_queue_url,
+        MessageBody=json.dumps({"bucket": bucket_name, "key": object_key})
+    )
+    print(f"CSV file {object_key} sent to SQS.")
+
+def process_inventory_file(bucket_name, object_key):
+    batch = read_inventory_file(bucket_name, object_key)
+    stock_levels = write_deltas(bucket_name, object_key, batch.sum_by_key())
+    if stock_levels:
+        notify_stock_levels(stock_levels)
+    finish_inventory_file(bucket_name, object_key, batch)
+
+@profiling.profiled('inventory_handler')
 def handler(event, context):
     try:
         print("Received event:", event)
-        
+        write_controller.reset_stats()
+
+        files = []
         if 'Records' in event:
             # Lambda triggered by S3 event
             for record in event['Records']:
@@ -24,69 +114,31 @@ def handler(event, context):
                 if 's3' in record and 'bucket' in record['s3'] and 'name' in record['s3']['bucket'] and 'object' in record['s3']:
                     bucket_name = record['s3']['bucket']['name']
                     object_key = record['s3']['object']['key']
-                    
-                    # Check if the file is an inventory update file
-                    if object_key.startswith("inventory_files/") and object_key.endswith("_inventory.csv"):
-                        # Read the CSV file from S3
-                        s3 = boto3.client('s3')
-                        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-                        csv_body = response['Body'].read().decode('utf-8')
-
-                        # Process each row of the CSV file
-                        csv_data = csv.DictReader(StringIO(csv_body), delimiter=';')
-                        for row in csv_data:
-                            try:
-                                timestamp = datetime.strptime(row['Timestamp'], '%Y-%m-%dT%H:%M:%S.%f%z')
-                                warehouse_name = row['WarehouseName']
-                                item_id = row['ItemId']
-                                item_name = row['ItemName']
-                                stock_level_change = int(row['StockLevelChange'])
-
-                                # Update the item in DynamoDB
-                                inventory_table.update_item(
-                                    Key={'ItemId': item_id, 'WarehouseName': warehouse_name},
-                                    UpdateExpression='ADD StockLevelChange :val',
-                                    ExpressionAttributeValues={':val': stock_level_change}
-                                )
-
-                                print(f"Item {item_id} in warehouse {warehouse_name} updated in DynamoDB.")
-
-                                # Check if the item is below restock threshold
-                                restock_response = restock_table.get_item(Key={'ItemId': item_id})
-                                restock_item = restock_response.get('Item')
-                                if restock_item:
-                                    restock_limit = restock_item.get('RestockIfBelow')
-                                    response = inventory_table.get_item(
-                                        Key={'ItemId': item_id, 'WarehouseName': warehouse_name}
-                                    )
-                                    item_in_db = response.get('Item')
-                                    if item_in_db:
-                                        current_stock_level = int(item_in_db.get('StockLevelChange', 0))
-                                        if current_stock_level < restock_limit:
-                                            # Item is below restock threshold, send notification
-                                            message = (f"Item ID: {item_id}, Warehouse Name: {warehouse_name} "
-                                                       f"has its current stock ({current_stock_level}) "
-                                                       f"below the threshold limit ({restock_limit})")
-                                            sns_client.publish(
-                                                TopicArn=os.environ['SNS_TOPIC_ARN'],
-                                                Message=message,
-                                                Subject="Stock Alert"
-                                            )
-                                            print("Notification sent successfully!")
-
-                            except Exception as e:
-                                print(f"Failed to process row: {str(e)}")
-                        
-                        # Send CSV to SQS
-                        sqs_client.send_message(
-                            QueueUrl=sqs_queue_url,
-                            MessageBody=json.dumps({"bucket": bucket_name, "key": object_key, "content": csv_body})
-                        )
-                        print(f"CSV file {object_key} sent to SQS.")
 
+                    # Check if the file is an inventory update file
+                    if inventory_reader.is_inventory_key(object_key):
+                        files.append((bucket_name, object_key))
                     else:
                         print(f"Skipping file {object_key}. Not an inventory update file.")
-        
+
+        if PIPELINE_ENABLED and files:
+            asyncio.run(ingest_pipeline.run_pipeline(
+                files,
+                read=read_inventory_file,
+                write=write_deltas,
+                notify=notify_stock_levels,
+                finish=finish_inventory_file,
+                # Write-behind takes each file's deltas as one message, only direct writes are chunked
+                chunk_size=0 if write_behind.write_behind_queue_url else ingest_pipeline.WRITE_CHUNK_SIZE
+            ))
+        else:
+            for bucket_name, object_key in files:
+                process_inventory_file(bucket_name, object_key)
+
+        write_controller.report("Inventory")
+        hot_keys.report("Inventory")
+        hot_keys.emit_metrics("Inventory")
+
         return {
             'statusCode': 200,
             'body': 'Inventory update processed successfully'
@@ -0,0 +1,64 @@
+import csv
+import gzip
+import io
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for .zst inventory files
+    zstandard = None
+
+# Plain, gzip and zstd compressed inventory files
+INVENTORY_SUFFIXES = ('_inventory.csv', '_inventory.csv.gz', '_inventory.csv.zst')
+
+
+def is_inventory_key(object_key: str) -> bool:
+    """
+    Checks whether an object key is an inventory update file.
+
+    Args:
+        object_key (str): S3 object key or local path relative to the bucket root
+
+    Returns:
+        bool: True for (compressed) inventory files below inventory_files/
+    """
+    return object_key.startswith("inventory_files/") and object_key.endswith(INVENTORY_SUFFIXES)
+
+
+def open_text(raw, object_key: str):
+    """
+    Wraps a binary stream in a decompressing, decoding text stream.
+
+    Nothing is read up front, the file is decompressed while the caller iterates it.
+
+    Args:
+        raw: Binary file-like object with a read() method (S3 StreamingBody, open file)
+        object_key (str): Key or path of the object, its suffix selects the codec
+
+    Returns:
+        A text stream yielding the lines of the CSV file
+    """
+    if object_key.endswith('.gz'):
+        raw = gzip.GzipFile(fileobj=raw, mode='rb')
+    elif object_key.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f"The zstandard package is required to read {object_key}")
+        raw = zstandard.ZstdDecompressor().stream_reader(raw)
+
+    # newline='' leaves line endings inside quoted fields to the csv module
+    return io.TextIOWrapper(raw, encoding='utf-8', newline='')
+
+
+def open_inventory_object(s3_client, bucket_name: str, object_key: str):
+    """
+    Streams an inventory file from S3 as text, decompressing it on the fly.
+    """
+    response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+    return open_text(response['Body'], object_key)
+
+
+def iter_rows(text_stream):
+    """
+    Returns:
+        csv.DictReader: Rows of the ';' delimited inventory file
+    """
+    return csv.DictReader(text_stream, delimiter=';')
@@ -2,32 +2,36 @@ import boto3
 import json
 import datetime
 
-# DynamoDB client settings
-dynamodb = boto3.resource('dynamodb', region_name='eu-central-1')
+import throttle
+
+# DynamoDB client settings (retries are left to the throttle controller)
+dynamodb = boto3.resource('dynamodb', region_name='eu-central-1', config=throttle.CLIENT_CONFIG)
 table = dynamodb.Table('Restock')
 
+# Backs off on throttling and resubmits unprocessed items within a retry budget
+write_controller = throttle.ThrottleController()
+
 # Function to insert items into DynamoDB from a JSON file
 def insert_items_from_json(json_body):
     json_data = json.loads(json_body)
     current_time = datetime.datetime.utcnow().isoformat() + 'Z'  # Get current time in ISO 8601 format
+    items = []
     for threshold in json_data['ThresholdList']:
         try:
-            item_id = threshold['ItemId']
-            restock_if_below = int(threshold['RestockIfBelow'])
-
             # Item object for insertion into DynamoDB
-            item = {
+            items.append({
                 'Timestamp': current_time,  # Using the current timestamp
-                'ItemId': item_id,
-                'RestockIfBelow': restock_if_below
-            }
-
-            # Insert item into DynamoDB
-            table.put_item(Item=item)
-            print(f"Successfully inserted: {item}")
+                'ItemId': threshold['ItemId'],
+                'RestockIfBelow': int(threshold['RestockIfBelow'])
+            })
         except Exception as e:
             print(f"Failed to insert: {str(e)}")
 
+    # Insert the items into DynamoDB in batches of 25, written in parallel up to the controller's limit
+    written = write_controller.batch_write(table.meta.client, table.name, items, key_names=['ItemId'],
+                                           workers=write_controller.max_concurrency)
+    print(f"Successfully inserted {written} items.")
+
 # S3 client settings
 s3_client = boto3.client('s3')
 
@@ -54,4 +58,5 @@ for obj in response.get('Contents', []):
     # Process the JSON file and insert items into DynamoDB
     insert_items_from_json(json_body)
 
+write_controller.report("json-loop")
 print("Insertion of items from all JSON files completed.")
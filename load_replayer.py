@@ -0,0 +1,507 @@
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+# The handler modules create their clients and read their settings on import;
+# the clients are replaced by LocalHarness and never reach AWS
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.setdefault('SQS_QUEUE_URL', 'local-batch-queue')
+os.environ.setdefault('SNS_TOPIC_ARN', 'local-stock-alerts')
+
+import alert_state
+import data_generator
+import inventory_handler
+import inventory_reader
+import throttle
+import transaction_log
+import write_behind
+
+# Bucket name used in the generated events, the same as in the sample event
+DEFAULT_BUCKET = "unique-name-for-inventory-bucket-example"
+
+# A DynamoDB partition serves ~1000 writes per second. The replay sends a small
+# fraction of the production traffic, so the limit is scaled down with it: with
+# the default 20k zipf transactions the hottest items' partitions are throttled
+DEFAULT_PARTITION_WRITE_LIMIT = 50
+DEFAULT_PARTITIONS = 64
+
+# RestockIfBelow of every item in the simulated Restock table
+DEFAULT_RESTOCK_IF_BELOW = 10
+
+# Messages per write-behind accumulator invocation, like the event source mapping's batch size
+WRITE_BEHIND_BATCH_SIZE = 100
+
+
+def build_s3_event(bucket_name, object_key, event_time=None):
+    """
+    Builds an S3 ObjectCreated notification for one object, in the shape the inventory handler receives.
+    """
+    event_time = event_time or datetime.now(timezone.utc)
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "eventName": "ObjectCreated:Put",
+                "eventTime": event_time.isoformat().replace('+00:00', 'Z'),
+                "s3": {
+                    "bucket": {"name": bucket_name},
+                    "object": {"key": object_key}
+                }
+            }
+        ]
+    }
+
+
+def generate_inventory_files(directory, transactions, products, distribution, seed=7):
+    """
+    Writes inventory files with the data generator below `directory`/inventory_files.
+
+    Returns:
+        typing.List[str]: Object keys of the files relative to `directory`, in stream order
+    """
+    random.seed(seed)
+    product_list = data_generator.product_generator(products)
+    generated = data_generator.create_transactions(
+        product_list, int(transactions / products) + 10
+    )
+    root = os.path.join(directory, "inventory_files")
+    paths = data_generator.create_transaction_files(generated, transactions, distribution, root)
+    return [os.path.relpath(path, directory).replace(os.sep, '/') for path in paths]
+
+
+def list_inventory_files(directory):
+    """Lists the inventory files below `directory`/inventory_files as object keys."""
+    keys = []
+    for root, _, names in os.walk(os.path.join(directory, "inventory_files")):
+        for name in names:
+            key = os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+            if inventory_reader.is_inventory_key(key):
+                keys.append(key)
+    return sorted(keys)
+
+
+def schedule(count, rate=None, burst_size=None, burst_interval=None):
+    """
+    Offsets in seconds after the start at which each event is fired.
+
+    A constant `rate` spaces the events evenly; `burst_size` events fired together
+    every `burst_interval` seconds reproduce a bursty upload pattern. Without
+    either, all events are fired at once.
+    """
+    if burst_size:
+        return [(i // burst_size) * burst_interval for i in range(count)]
+    if rate:
+        return [i / rate for i in range(count)]
+    return [0.0] * count
+
+
+class SimulatedInventoryTable:
+    """
+    In-memory stand-in for the Inventory table's update_item.
+
+    ItemId is the partition key, so every item is hashed to one of `partitions`
+    partitions, and each partition has a token bucket of `partition_write_limit`
+    writes per second. A write to an exhausted partition raises the same
+    ProvisionedThroughputExceededException a hot partition does; all the
+    warehouses of a hot item share its partition's limit.
+
+    The table is its own `meta.client`, so the handler's client calls and the
+    accumulator's resource calls both land here. The write-behind window
+    condition is honored, a window writes a key only once.
+    """
+
+    name = 'Inventory'
+
+    def __init__(self, partition_write_limit=DEFAULT_PARTITION_WRITE_LIMIT, partitions=DEFAULT_PARTITIONS,
+                 write_latency=0.0):
+        self.partition_write_limit = partition_write_limit
+        self.partitions = partitions
+        self.write_latency = write_latency
+        self.meta = SimpleNamespace(client=self)
+        self.stock = {}
+        self.windows = {}
+        self.writes = Counter()
+        self.throttles = Counter()
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def partition(self, item_id):
+        return zlib.crc32(item_id.encode('utf-8')) % self.partitions
+
+    def _take_token(self, partition, now):
+        tokens, updated = self._tokens.get(partition, (self.partition_write_limit, now))
+        tokens = min(self.partition_write_limit, tokens + (now - updated) * self.partition_write_limit)
+        if tokens < 1:
+            self._tokens[partition] = (tokens, now)
+            return False
+        self._tokens[partition] = (tokens - 1, now)
+        return True
+
+    def update_item(self, Key, ExpressionAttributeValues, **kwargs):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+
+        key = (Key['ItemId'], Key['WarehouseName'])
+        window_id = ExpressionAttributeValues.get(':window')
+        with self._lock:
+            if not self._take_token(self.partition(key[0]), time.monotonic()):
+                self.throttles[key] += 1
+                raise ClientError(
+                    {'Error': {'Code': 'ProvisionedThroughputExceededException',
+                               'Message': 'The level of configured provisioned throughput for the table was exceeded.'}},
+                    'UpdateItem'
+                )
+            if window_id is not None and self.windows.get(key) == window_id:
+                raise ClientError(
+                    {'Error': {'Code': 'ConditionalCheckFailedException',
+                               'Message': 'The conditional request failed'}},
+                    'UpdateItem'
+                )
+            self.writes[key] += 1
+            self.stock[key] = self.stock.get(key, 0) + ExpressionAttributeValues[':val']
+            if window_id is not None:
+                self.windows[key] = window_id
+            stock = self.stock[key]
+
+        return {'Attributes': {'StockLevelChange': stock},
+                'ConsumedCapacity': {'TableName': self.name, 'CapacityUnits': 1.0}}
+
+
+def _not_found(operation):
+    return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, operation)
+
+
+class LocalBucket:
+    """
+    In-memory stand-in for the S3 calls of the handler and the transaction log.
+
+    Objects that were not put are read from `directory`, so the inventory files
+    are served from disk and the transaction log stays in memory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.objects = {}
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self.reads += 1
+            stored = self.objects.get(Key)
+        if stored is None:
+            path = os.path.join(self.directory, Key)
+            if not os.path.isfile(path):
+                raise _not_found('GetObject')
+            with open(path, 'rb') as f:
+                stored = (f.read(), {})
+        body, metadata = stored
+        return {'Body': io.BytesIO(body), 'Metadata': metadata}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            if Key not in self.objects:
+                raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+            return {'Metadata': self.objects[Key][1]}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        with self._lock:
+            self.objects[Key] = (Body if isinstance(Body, bytes) else Body.encode('utf-8'), Metadata or {})
+        return {}
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix='', StartAfter='', **kwargs):
+        with self._lock:
+            keys = sorted(key for key in self.objects if key.startswith(Prefix) and key > StartAfter)
+        yield {'Contents': [{'Key': key} for key in keys]}
+
+
+class LocalQueue:
+    """In-memory stand-in for an SQS queue's send_message."""
+
+    def __init__(self):
+        self.messages = deque()
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        with self._lock:
+            self.sent += 1
+            self.messages.append(MessageBody)
+            return {'MessageId': str(self.sent)}
+
+    def receive(self, count):
+        with self._lock:
+            return [self.messages.popleft() for _ in range(min(count, len(self.messages)))]
+
+
+class LocalAlertTables:
+    """
+    In-memory stand-in for the Restock and AlertState tables and the SNS topic of alert_state.
+
+    Every item has the same RestockIfBelow threshold.
+    """
+
+    def __init__(self, restock_if_below=DEFAULT_RESTOCK_IF_BELOW):
+        self.restock_if_below = restock_if_below
+        self.states = {}
+        self.alerts = 0
+        self._lock = threading.Lock()
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        with self._lock:
+            for table_name, request in RequestItems.items():
+                if table_name == alert_state.restock_table_name:
+                    responses[table_name] = [{'ItemId': key['ItemId'], 'RestockIfBelow': self.restock_if_below}
+                                             for key in request['Keys']]
+                else:
+                    keys = ((key['ItemId'], key['WarehouseName']) for key in request['Keys'])
+                    responses[table_name] = [dict(self.states[key]) for key in keys if key in self.states]
+        return {'Responses': responses}
+
+    def batch_writer(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def put_item(self, Item, **kwargs):
+        with self._lock:
+            self.states[(Item['ItemId'], Item['WarehouseName'])] = dict(Item)
+
+    def publish(self, **kwargs):
+        with self._lock:
+            self.alerts += 1
+
+
+class LocalHarness:
+    """
+    Runs the real inventory_handler.handler against local files and in-memory services.
+
+    The handler module's S3 and SQS clients, Inventory table and write
+    controller are replaced, as are the clients of alert_state, and with
+    `write_behind` or `log_transactions` those of write_behind and
+    transaction_log. Reading, summing, the pipeline, the throttled writes,
+    alerting, write-behind and the transaction log therefore all run the
+    handler's own code, without AWS.
+    """
+
+    def __init__(self, directory, table, controller, alerts, pipeline=False, write_behind_enabled=False,
+                 log_transactions=False):
+        self.table = table
+        self.alerts = alerts
+        self.bucket = LocalBucket(directory)
+        self.notifications = LocalQueue()
+        self.write_behind_queue = LocalQueue()
+
+        inventory_handler.s3 = self.bucket
+        inventory_handler.sqs_client = self.notifications
+        inventory_handler.inventory_table = table
+        inventory_handler.write_controller = controller
+        inventory_handler.PIPELINE_ENABLED = pipeline
+
+        alert_state.ddb = alerts
+        alert_state.alert_state_table = alerts
+        alert_state.sns_client = alerts
+
+        write_behind.inventory_table = table
+        write_behind.sqs_client = self.write_behind_queue
+        write_behind.write_behind_queue_url = 'local-write-behind' if write_behind_enabled else ''
+
+        transaction_log.s3 = self.bucket
+        transaction_log.TRANSACTION_LOG_BUCKET = 'local-transaction-log' if log_transactions else ''
+
+    def handler(self, event, context):
+        return inventory_handler.handler(event, context)
+
+    def drain_write_behind(self, batch_size=WRITE_BEHIND_BATCH_SIZE):
+        """
+        Feeds the queued delta batches to the write-behind accumulator's handler until the queue is empty.
+
+        Returns:
+            int: Number of accumulator invocations
+        """
+        invocations = 0
+        while True:
+            bodies = self.write_behind_queue.receive(batch_size)
+            if not bodies:
+                return invocations
+            records = [{'messageId': f"{invocations}-{index}", 'body': body} for index, body in enumerate(bodies)]
+            write_behind.lambda_handler({'Records': records}, None)
+            invocations += 1
+
+
+def replay(events, offsets, handler, concurrency):
+    """
+    Fires the events at their scheduled offsets into a pool of `concurrency` handlers.
+
+    Queue lag is the time an event waited for a free handler after its scheduled
+    time (what the S3 -> Lambda queue adds once the concurrency is used up),
+    latency the time the handler took.
+
+    Returns:
+        typing.List[dict]: One measurement per event
+    """
+    results = []
+    results_lock = threading.Lock()
+    start = time.monotonic()
+
+    def run(index, event, scheduled):
+        started = time.monotonic()
+        error = None
+        try:
+            handler(event, None)
+        except Exception as e:
+            error = str(e)
+        finished = time.monotonic()
+        with results_lock:
+            results.append({
+                'event': index,
+                'key': event['Records'][0]['s3']['object']['key'],
+                'queue_lag': started - scheduled,
+                'latency': finished - started,
+                'error': error
+            })
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, (event, offset) in enumerate(zip(events, offsets)):
+            scheduled = start + offset
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run, index, event, scheduled)
+
+    return sorted(results, key=lambda result: result['event'])
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+def summarize(results, elapsed):
+    """
+    Returns:
+        dict: Throughput plus percentiles of latency and queue lag in milliseconds
+    """
+    latencies = [result['latency'] for result in results]
+    lags = [result['queue_lag'] for result in results]
+    summary = {
+        'events': len(results),
+        'errors': sum(1 for result in results if result['error']),
+        'seconds': round(elapsed, 3),
+        'events_per_second': round(len(results) / elapsed, 2) if elapsed else 0.0,
+    }
+    for name, values in (('latency', latencies), ('queue_lag', lags)):
+        summary[name + '_ms'] = {
+            'mean': round(statistics.mean(values) * 1000, 1) if values else 0.0,
+            'p50': round(_percentile(values, 50) * 1000, 1),
+            'p95': round(_percentile(values, 95) * 1000, 1),
+            'p99': round(_percentile(values, 99) * 1000, 1),
+            'max': round(max(values, default=0.0) * 1000, 1),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic S3 inventory events at a controlled rate")
+    parser.add_argument("--directory", help="Directory holding inventory_files/ (default: generate into a temp dir)")
+    parser.add_argument("--transactions", type=int, default=20_000, help="Transactions to generate")
+    parser.add_argument("--products", type=int, default=data_generator.AMOUNT_OF_PRODUCTS)
+    parser.add_argument("--distribution", choices=data_generator.DISTRIBUTIONS, default="zipf")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--rate", type=float, help="Events per second")
+    parser.add_argument("--burst-size", type=int, help="Events fired together in each burst")
+    parser.add_argument("--burst-interval", type=float, default=1.0, help="Seconds between bursts")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent handler invocations")
+    parser.add_argument("--partition-write-limit", type=float, default=DEFAULT_PARTITION_WRITE_LIMIT,
+                        help="Writes per second a single partition accepts before it is throttled")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS,
+                        help="Partitions the items are hashed to")
+    parser.add_argument("--write-latency-ms", type=float, default=2.0, help="Simulated latency of one write")
+    parser.add_argument("--restock-if-below", type=int, default=DEFAULT_RESTOCK_IF_BELOW,
+                        help="Restock threshold of every item")
+    parser.add_argument("--pipeline", action="store_true", help="Run the files through the staged pipeline")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="Queue the deltas and apply them with the write-behind accumulator")
+    parser.add_argument("--transaction-log", action="store_true", help="Append the files to the transaction log")
+    parser.add_argument("--verbose", action="store_true", help="Show the handler's own output")
+    parser.add_argument("--bucket", default=DEFAULT_BUCKET, help="Bucket name put into the events")
+    parser.add_argument("--top", type=int, default=10, help="Hottest keys to print")
+    args = parser.parse_args()
+
+    directory = args.directory
+    if directory:
+        keys = list_inventory_files(directory)
+    else:
+        directory = tempfile.mkdtemp(prefix="inventory-replay-")
+        keys = generate_inventory_files(directory, args.transactions, args.products, args.distribution, args.seed)
+        print(f"Generated {len(keys)} files with a {args.distribution} item distribution in {directory}")
+
+    if not keys:
+        print(f"No inventory files found below {directory}/inventory_files")
+        return
+
+    events = [build_s3_event(args.bucket, key) for key in keys]
+    offsets = schedule(len(events), args.rate, args.burst_size, args.burst_interval)
+
+    table = SimulatedInventoryTable(args.partition_write_limit, args.partitions, args.write_latency_ms / 1000)
+    controller = throttle.ThrottleController(max_concurrency=args.concurrency * 4)
+    alerts = LocalAlertTables(args.restock_if_below)
+    harness = LocalHarness(directory, table, controller, alerts, args.pipeline, args.write_behind,
+                           args.transaction_log)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.monotonic()
+    with output:
+        results = replay(events, offsets, harness.handler, args.concurrency)
+    elapsed = time.monotonic() - start
+
+    summary = summarize(results, elapsed)
+    if args.write_behind:
+        flush_start = time.monotonic()
+        with output:
+            summary['write_behind_invocations'] = harness.drain_write_behind()
+        summary['write_behind_seconds'] = round(time.monotonic() - flush_start, 3)
+    summary['writes'] = sum(table.writes.values())
+    summary['throttled_writes'] = sum(table.throttles.values())
+    summary['alerts'] = alerts.alerts
+    summary['notifications'] = harness.notifications.sent
+    if args.transaction_log:
+        segments = transaction_log.TRANSACTION_LOG_PREFIX + 'segments/'
+        summary['log_segments'] = sum(1 for key in harness.bucket.objects if key.startswith(segments))
+    print(f"Replay summary: {summary}")
+    controller.report("Replay")
+
+    for result in results:
+        if result['error']:
+            print(f"Event {result['event']} ({result['key']}) failed: {result['error']}")
+
+    print("Hottest keys (writes, throttles):")
+    for (item_id, warehouse_name), writes in table.writes.most_common(args.top):
+        print(f"  {item_id[:12]} {warehouse_name:<12} {writes:>6} {table.throttles[(item_id, warehouse_name)]:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,60 @@ provider "aws" {
   region = "eu-central-1"  # Define the desired region
 }
 
+# Merge inventory deltas in an accumulator before they are written to DynamoDB
+variable "write_behind_enabled" {
+  type    = bool
+  default = false
+}
+
+# Write every ingested file to the append-only transaction log and take hourly snapshots
+variable "transaction_log_enabled" {
+  type    = bool
+  default = false
+}
+
+# Process inventory files in the staged asyncio pipeline (concurrent fetch, write and notify)
+variable "ingest_pipeline_enabled" {
+  type    = bool
+  default = false
+}
+
+# Maximum time a delta may wait in the accumulator (SQS batching window)
+variable "write_behind_max_staleness_seconds" {
+  type    = number
+  default = 30
+}
+
+# Drain the inventory queue with parallel batch workers (dispatcher + Map state) instead of one consumer
+variable "sqs_consumer_fanout_enabled" {
+  type    = bool
+  default = false
+}
+
+# Upper bound of concurrent batch workers in fan-out mode
+variable "sqs_consumer_max_workers" {
+  type    = number
+  default = 10
+}
+
+# Queued files per batch worker; the dispatcher starts ceil(depth / this) workers
+variable "sqs_consumer_messages_per_worker" {
+  type    = number
+  default = 10
+}
+
+# Profile the ingest and batch Lambdas with cProfile/tracemalloc: "", "cpu", "memory" or "both"
+variable "profile_mode" {
+  type    = string
+  default = ""
+}
+
+# Fraction of the invocations that are profiled while profile_mode is set
+variable "profile_sample_rate" {
+  type    = number
+  default = 0.1
+}
+
 # Creation of the S3 bucket
 resource "aws_s3_bucket" "inventory_files" {
   bucket = "unique-name-for-inventory-bucket-example"  # Unique name for your S3 bucket
@@ -31,6 +85,83 @@ resource "aws_s3_object" "restock_thresholds" {
   source   = each.value  
 }
 
+# Global secondary indexes of the Inventory table. "full" keeps every index (the original
+# set plus WarehouseStockIndex), "lean" only the one the query tools read. WarehouseStockIndex
+# is keyed on the stock itself, so even "lean" moves an index entry on every stock update;
+# gsi_benchmark.py compares the profiles with the original index set.
+variable "inventory_index_profile" {
+  type    = string
+  default = "full"
+
+  validation {
+    condition     = contains(["full", "lean"], var.inventory_index_profile)
+    error_message = "inventory_index_profile must be \"full\" or \"lean\"."
+  }
+}
+
+locals {
+  inventory_indexes = {
+    StockLevelChangeIndex = {
+      hash_key           = "StockLevelChange"
+      range_key          = null
+      projection_type    = "ALL"
+      non_key_attributes = null
+    }
+    ItemNameIndex = {
+      hash_key           = "ItemName"
+      range_key          = null
+      projection_type    = "ALL"
+      non_key_attributes = null
+    }
+    WarehouseNameIndex = {
+      hash_key           = "WarehouseName"
+      range_key          = null
+      projection_type    = "ALL"
+      non_key_attributes = null
+    }
+    # Stock levels per warehouse sorted by stock, for "stock > x", "stock < x" and top-N reports
+    WarehouseStockIndex = {
+      hash_key           = "WarehouseName"
+      range_key          = "StockLevelChange"
+      projection_type    = "INCLUDE"
+      non_key_attributes = ["ItemName"]
+    }
+    TimestampIndex = {
+      hash_key           = "Timestamp"
+      range_key          = null
+      projection_type    = "ALL"
+      non_key_attributes = null
+    }
+  }
+
+  # stock_index.py is the only reader of a secondary index
+  inventory_index_profiles = {
+    full = keys(local.inventory_indexes)
+    lean = ["WarehouseStockIndex"]
+  }
+
+  inventory_selected_indexes = {
+    for name in local.inventory_index_profiles[var.inventory_index_profile] : name => local.inventory_indexes[name]
+  }
+
+  inventory_attribute_types = {
+    ItemId           = "S"
+    WarehouseName    = "S"
+    Timestamp        = "S"
+    ItemName         = "S"
+    StockLevelChange = "N"
+  }
+
+  # DynamoDB only accepts attribute definitions for key attributes of the table or an index
+  inventory_key_attributes = distinct(concat(
+    ["ItemId", "WarehouseName"],
+    flatten([
+      for index in values(local.inventory_selected_indexes) :
+      compact([index.hash_key, index.range_key == null ? "" : index.range_key])
+    ])
+  ))
+}
+
 # Define the DynamoDB table to store the inventory
 resource "aws_dynamodb_table" "inventory_table" {
   name           = "Inventory"
@@ -39,53 +170,27 @@ resource "aws_dynamodb_table" "inventory_table" {
   hash_key       = "ItemId"
   range_key      = "WarehouseName"  
 
-  attribute {
-    name = "ItemId"
-    type = "S"
-  }
-  
-  attribute {
-    name = "WarehouseName"
-    type = "S"
-  }
-  
-  attribute {
-    name = "Timestamp"
-    type = "S"
-  }
-  
-  attribute {
-    name = "ItemName"
-    type = "S"
-  }
-  
-  attribute {
-    name = "StockLevelChange"
-    type = "N"
-  }
-  
-  global_secondary_index {
-    name               = "StockLevelChangeIndex"
-    hash_key           = "StockLevelChange"
-    projection_type    = "ALL"
-  }
-  
-  global_secondary_index {
-    name               = "ItemNameIndex"
-    hash_key           = "ItemName"
-    projection_type    = "ALL"
-  }
-  
-  global_secondary_index {
-    name               = "WarehouseNameIndex"
-    hash_key           = "WarehouseName"
-    projection_type    = "ALL"
+  # Change feed that keeps the query service's in-memory index current
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+
+  dynamic "attribute" {
+    for_each = local.inventory_key_attributes
+    content {
+      name = attribute.value
+      type = local.inventory_attribute_types[attribute.value]
+    }
   }
-  
-  global_secondary_index {
-    name               = "TimestampIndex"
-    hash_key           = "Timestamp"
-    projection_type    = "ALL"
+
+  dynamic "global_secondary_index" {
+    for_each = local.inventory_selected_indexes
+    content {
+      name               = global_secondary_index.key
+      hash_key           = global_secondary_index.value.hash_key
+      range_key          = global_secondary_index.value.range_key
+      projection_type    = global_secondary_index.value.projection_type
+      non_key_attributes = global_secondary_index.value.non_key_attributes
+    }
   }
 }
 
@@ -116,6 +221,61 @@ resource "aws_dynamodb_table" "restock_table" {
   }
 }
 
+# Define the DynamoDB table holding the last stock alert per item and warehouse
+resource "aws_dynamodb_table" "alert_state_table" {
+  name         = "AlertState"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "ItemId"
+  range_key    = "WarehouseName"
+
+  attribute {
+    name = "ItemId"
+    type = "S"
+  }
+
+  attribute {
+    name = "WarehouseName"
+    type = "S"
+  }
+
+  tags = {
+    Name = "Alert State Table"
+  }
+}
+
+# Allow the alerting Lambda functions to read and write the alert state in batches
+resource "aws_iam_policy" "alert_state_policy" {
+  name        = "AlertStatePolicy"
+  description = "Policy to allow batch reads and writes on the AlertState table and batch reads on the Restock table"
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{
+      Effect   = "Allow",
+      Action   = [
+        "dynamodb:BatchGetItem",
+        "dynamodb:BatchWriteItem"
+      ],
+      Resource = aws_dynamodb_table.alert_state_table.arn
+    },
+    {
+      Effect   = "Allow",
+      Action   = "dynamodb:BatchGetItem",
+      Resource = aws_dynamodb_table.restock_table.arn
+    }]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "alert_state_attachment" {
+  role       = aws_iam_role.lambda_execution_role.name
+  policy_arn = aws_iam_policy.alert_state_policy.arn
+}
+
+resource "aws_iam_role_policy_attachment" "alert_state_attachment_sns" {
+  role       = aws_iam_role.lambda_execution_role_sns.name
+  policy_arn = aws_iam_policy.alert_state_policy.arn
+}
+
 # Define the IAM execution role for Lambda functions
 resource "aws_iam_role" "lambda_execution_role" {
   name = "lambda_execution_role"
@@ -134,19 +294,58 @@ resource "aws_iam_role" "lambda_execution_role" {
   })
 }
 
+# Modules packaged into each Lambda: the handler module and the repo modules it imports
+locals {
+  lambda_packages = {
+    inventory_handler = [
+      "inventory_handler.py", "alert_state.py", "heavy_hitters.py", "ingest_pipeline.py", "inventory_batch.py",
+      "inventory_reader.py", "profiling.py", "throttle.py", "transaction_log.py", "write_behind.py"
+    ]
+    restock_handler = ["restock_handler.py", "report_publisher.py", "throttle.py"]
+    csv_loop        = ["csv-loop.py", "inventory_reader.py", "throttle.py"]
+    json_loop       = ["json-loop.py", "throttle.py"]
+    restock_checker = ["restock_checker.py", "alert_state.py", "inventory_batch.py", "report_publisher.py"]
+    write_behind    = ["write_behind.py", "alert_state.py", "inventory_batch.py", "throttle.py"]
+    transaction_log = ["transaction_log.py"]
+    batch_operation = ["batch_operation.py", "inventory_reader.py", "profiling.py", "report_publisher.py"]
+  }
+}
+
+# Build the Lambda packages from the sources (terraform plan/apply writes them to build/)
+data "archive_file" "lambda_package" {
+  for_each    = local.lambda_packages
+  type        = "zip"
+  output_path = "${path.module}/build/${each.key}.zip"
+
+  dynamic "source" {
+    for_each = each.value
+    content {
+      content  = file("${path.module}/${source.value}")
+      filename = source.value
+    }
+  }
+}
+
 # Define the Lambda function to process inventory files
 resource "aws_lambda_function" "inventory_handler" {
-  function_name = "inventory_handler"
-  filename      = "inventory_handler.zip"
-  handler       = "inventory_handler.handler"  
-  runtime       = "python3.8"
-  role          = aws_iam_role.lambda_execution_role.arn
+  function_name    = "inventory_handler"
+  filename         = data.archive_file.lambda_package["inventory_handler"].output_path
+  source_code_hash = data.archive_file.lambda_package["inventory_handler"].output_base64sha256
+  handler          = "inventory_handler.handler"  
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
 
    environment {
     variables = {
       TABLE_NAME      = aws_dynamodb_table.inventory_table.name
       SNS_TOPIC_ARN   = aws_sns_topic.restock_notifications.arn
       SQS_QUEUE_URL   = aws_sqs_queue.inventory_queue.url
+      WRITE_BEHIND_QUEUE_URL = var.write_behind_enabled ? aws_sqs_queue.write_behind_queue[0].url : ""
+      TRANSACTION_LOG_BUCKET = var.transaction_log_enabled ? aws_s3_bucket.inventory_files.bucket : ""
+      PIPELINE_ENABLED       = var.ingest_pipeline_enabled ? "true" : "false"
+      PROFILE_MODE           = var.profile_mode
+      PROFILE_SAMPLE_RATE    = var.profile_sample_rate
+      PROFILE_S3_BUCKET      = var.profile_mode != "" ? aws_s3_bucket.inventory_files.bucket : ""
     }
   }
 }
@@ -165,10 +364,12 @@ resource "aws_iam_policy" "lambda_execution_policy" {
           "dynamodb:UpdateItem",
           "s3:GetObject",
           "dynamodb:Scan",
+          "dynamodb:Query",
           "s3:ListBucket"
         ],
         "Resource": [
           aws_dynamodb_table.inventory_table.arn,
+          "${aws_dynamodb_table.inventory_table.arn}/index/*",
           aws_dynamodb_table.restock_table.arn,
           "${aws_s3_bucket.inventory_files.arn}/*",
           "${aws_s3_bucket.inventory_files.arn}"
@@ -226,16 +427,18 @@ resource "aws_s3_bucket_notification" "data_bucket_notifications" {
 
 # Define the Lambda function to process restock thresholds files
 resource "aws_lambda_function" "restock_handler" {
-  function_name = "restock_handler"
-  filename      = "restock_handler.zip"
-  handler       = "restock_handler.lambda_handler"
-  runtime       = "python3.8"
-  role          = aws_iam_role.lambda_execution_role.arn
+  function_name    = "restock_handler"
+  filename         = data.archive_file.lambda_package["restock_handler"].output_path
+  source_code_hash = data.archive_file.lambda_package["restock_handler"].output_base64sha256
+  handler          = "restock_handler.lambda_handler"
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
 
   environment {
     variables = {
       TABLE_NAME = aws_dynamodb_table.inventory_table.name
       SNS_TOPIC_ARN = aws_sns_topic.restock_notifications.arn
+      REPORT_BUCKET = aws_s3_bucket.inventory_files.bucket
     }
   }
 }
@@ -253,11 +456,12 @@ resource "aws_lambda_permission" "restock_bucket_permission" {
 
 # Define the Lambda function for processing CSV files with loop
 resource "aws_lambda_function" "csv_loop_handler" {
-  function_name = "csv-loop"
-  filename      = "csv-loop.zip"
-  handler       = "csv-loop.insert_items_from_csv"  
-  runtime       = "python3.8"
-  role          = aws_iam_role.lambda_execution_role.arn
+  function_name    = "csv-loop"
+  filename         = data.archive_file.lambda_package["csv_loop"].output_path
+  source_code_hash = data.archive_file.lambda_package["csv_loop"].output_base64sha256
+  handler          = "csv-loop.insert_items_from_csv"  
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
 
   environment {
     variables = {
@@ -271,11 +475,12 @@ resource "aws_lambda_function" "csv_loop_handler" {
 
 # Define the Lambda function to process JSON files with loop
 resource "aws_lambda_function" "json_loop_handler" {
-  function_name = "json-loop"
-  filename      = "json-loop.zip"
-  handler       = "json-loop.process_json_files"  # Check the handler name
-  runtime       = "python3.8"
-  role          = aws_iam_role.lambda_execution_role.arn
+  function_name    = "json-loop"
+  filename         = data.archive_file.lambda_package["json_loop"].output_path
+  source_code_hash = data.archive_file.lambda_package["json_loop"].output_base64sha256
+  handler          = "json-loop.process_json_files"  # Check the handler name
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
 
   environment {
     variables = {
@@ -361,17 +566,19 @@ resource "aws_sns_topic_policy" "sns_topic_policy" {
 
 # Define the Lambda function to check inventory and send notifications
 resource "aws_lambda_function" "restock_checker" {
-  filename      = "restock_checker.zip"
-  function_name = "restock_checker"
-  role          = aws_iam_role.lambda_execution_role_sns.arn
-  handler       = "restock_checker.restock_checker"
-  runtime       = "python3.8"
-  timeout       = 10
-  memory_size   = 128
+  filename         = data.archive_file.lambda_package["restock_checker"].output_path
+  source_code_hash = data.archive_file.lambda_package["restock_checker"].output_base64sha256
+  function_name    = "restock_checker"
+  role             = aws_iam_role.lambda_execution_role_sns.arn
+  handler          = "restock_checker.restock_checker"
+  runtime          = "python3.8"
+  timeout          = 10
+  memory_size      = 128
 
   environment {
     variables = {
       SNS_TOPIC_ARN = aws_sns_topic.restock_notifications.arn 
+      REPORT_BUCKET = aws_s3_bucket.inventory_files.bucket
     }
   }
 
@@ -537,9 +744,41 @@ resource "aws_iam_policy_attachment" "lambda_sns_policy_attachment_publish" {
   policy_arn = aws_iam_policy.lambda_sns_policy_publish.arn
 }
 
+# Large alert reports are stored as gzip CSV files and shared with a presigned link
+resource "aws_iam_policy" "report_overflow_policy" {
+  name        = "ReportOverflowPolicy"
+  description = "Policy to allow writing and sharing alert reports that exceed the SNS message size"
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{
+      Effect   = "Allow",
+      Action   = [
+        "s3:PutObject",
+        "s3:GetObject"
+      ],
+      Resource = "${aws_s3_bucket.inventory_files.arn}/reports/*"
+    }],
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "report_overflow_attachment" {
+  role       = aws_iam_role.lambda_execution_role.name
+  policy_arn = aws_iam_policy.report_overflow_policy.arn
+}
+
+resource "aws_iam_role_policy_attachment" "report_overflow_attachment_sns" {
+  role       = aws_iam_role.lambda_execution_role_sns.name
+  policy_arn = aws_iam_policy.report_overflow_policy.arn
+}
+
 # Criação da fila SQS
 resource "aws_sqs_queue" "inventory_queue" {
   name = "inventory_queue"
+
+  # A worker checks one file for up to its whole 900 s timeout; a shorter timeout
+  # would hand the file to a sibling worker of the fan-out Map while it is checked
+  visibility_timeout_seconds = 900
 }
 
 # Política IAM para envio de mensagens para a fila SQS
@@ -586,6 +825,165 @@ resource "aws_sqs_queue_policy" "inventory_queue_policy" {
   })
 }
 
+# Queue carrying per-file delta batches to the write-behind accumulator
+resource "aws_sqs_queue" "write_behind_queue" {
+  count = var.write_behind_enabled ? 1 : 0
+  name  = "inventory_write_behind_queue"
+
+  # Messages stay invisible while the accumulator holds them in its window
+  visibility_timeout_seconds = var.write_behind_max_staleness_seconds + 120
+}
+
+resource "aws_iam_policy" "write_behind_queue_policy" {
+  count       = var.write_behind_enabled ? 1 : 0
+  name        = "WriteBehindQueuePolicy"
+  description = "Policy to allow the inventory handler and the accumulator to use the write-behind queue"
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{
+      Effect   = "Allow",
+      Action   = [
+        "sqs:SendMessage",
+        "sqs:ReceiveMessage",
+        "sqs:DeleteMessage",
+        "sqs:GetQueueAttributes"
+      ],
+      Resource = aws_sqs_queue.write_behind_queue[0].arn,
+    }],
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "write_behind_queue_attachment" {
+  count      = var.write_behind_enabled ? 1 : 0
+  role       = aws_iam_role.lambda_execution_role.name
+  policy_arn = aws_iam_policy.write_behind_queue_policy[0].arn
+}
+
+# Define the Lambda function that merges and applies the queued deltas
+resource "aws_lambda_function" "write_behind_accumulator" {
+  count            = var.write_behind_enabled ? 1 : 0
+  function_name    = "write-behind-accumulator"
+  filename         = data.archive_file.lambda_package["write_behind"].output_path
+  source_code_hash = data.archive_file.lambda_package["write_behind"].output_base64sha256
+  handler          = "write_behind.lambda_handler"
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
+  timeout          = 60
+
+  environment {
+    variables = {
+      TABLE_NAME             = aws_dynamodb_table.inventory_table.name
+      SNS_TOPIC_ARN          = aws_sns_topic.restock_notifications.arn
+      WRITE_BEHIND_QUEUE_URL = aws_sqs_queue.write_behind_queue[0].url
+    }
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "write_behind_accumulator" {
+  count            = var.write_behind_enabled ? 1 : 0
+  event_source_arn = aws_sqs_queue.write_behind_queue[0].arn
+  function_name    = aws_lambda_function.write_behind_accumulator[0].arn
+
+  batch_size                         = 1000
+  maximum_batching_window_in_seconds = var.write_behind_max_staleness_seconds
+
+  # The accumulator acknowledges partly written batches and only reports untouched messages as failed
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+# Allow the Lambda functions to write and list the transaction log
+resource "aws_iam_policy" "transaction_log_policy" {
+  count       = var.transaction_log_enabled ? 1 : 0
+  name        = "TransactionLogPolicy"
+  description = "Policy to allow writing segments and snapshots of the transaction log"
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{
+      Effect   = "Allow",
+      Action   = [
+        "s3:PutObject",
+        "s3:GetObject",
+        "s3:ListBucket"
+      ],
+      Resource = [
+        "${aws_s3_bucket.inventory_files.arn}/transaction_log/*",
+        aws_s3_bucket.inventory_files.arn
+      ]
+    }],
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "transaction_log_attachment" {
+  count      = var.transaction_log_enabled ? 1 : 0
+  role       = aws_iam_role.lambda_execution_role.name
+  policy_arn = aws_iam_policy.transaction_log_policy[0].arn
+}
+
+# Allow the profiled Lambda functions to upload their profiles
+resource "aws_iam_policy" "profile_upload_policy" {
+  count       = var.profile_mode != "" ? 1 : 0
+  name        = "ProfileUploadPolicy"
+  description = "Policy to allow uploading cProfile and tracemalloc captures"
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{
+      Effect   = "Allow",
+      Action   = "s3:PutObject",
+      Resource = "${aws_s3_bucket.inventory_files.arn}/profiles/*"
+    }],
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "profile_upload_attachment" {
+  count      = var.profile_mode != "" ? 1 : 0
+  role       = aws_iam_role.lambda_execution_role.name
+  policy_arn = aws_iam_policy.profile_upload_policy[0].arn
+}
+
+# Define the Lambda function that writes the hourly stock snapshots
+resource "aws_lambda_function" "transaction_log_snapshot" {
+  count            = var.transaction_log_enabled ? 1 : 0
+  function_name    = "transaction-log-snapshot"
+  filename         = data.archive_file.lambda_package["transaction_log"].output_path
+  source_code_hash = data.archive_file.lambda_package["transaction_log"].output_base64sha256
+  handler          = "transaction_log.snapshot_handler"
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
+  timeout          = 300
+
+  environment {
+    variables = {
+      TRANSACTION_LOG_BUCKET = aws_s3_bucket.inventory_files.bucket
+    }
+  }
+}
+
+resource "aws_cloudwatch_event_rule" "transaction_log_snapshot" {
+  count               = var.transaction_log_enabled ? 1 : 0
+  name                = "TransactionLogSnapshotRule"
+  description         = "Snapshot the stock levels at the start of every hour"
+  schedule_expression = "cron(5 * * * ? *)"
+}
+
+resource "aws_cloudwatch_event_target" "transaction_log_snapshot" {
+  count     = var.transaction_log_enabled ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.transaction_log_snapshot[0].name
+  target_id = "TransactionLogSnapshot"
+  arn       = aws_lambda_function.transaction_log_snapshot[0].arn
+}
+
+resource "aws_lambda_permission" "transaction_log_snapshot" {
+  count         = var.transaction_log_enabled ? 1 : 0
+  statement_id  = "AllowExecutionFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.transaction_log_snapshot[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.transaction_log_snapshot[0].arn
+}
+
 # Create the IAM role for Step Functions
 resource "aws_iam_role" "step_function_role" {
   name = "StepFunctionExecutionRole"
@@ -618,9 +1016,11 @@ resource "aws_iam_role_policy" "step_function_policy" {
           "lambda:InvokeFunction",
           "lambda:InvokeAsync"
         ],
-        "Resource": [
-          aws_lambda_function.sqs_consumer_lambda.arn
-        ]
+        "Resource": concat(
+          [aws_lambda_function.sqs_consumer_lambda.arn],
+          aws_lambda_function.sqs_dispatcher_lambda[*].arn,
+          aws_lambda_function.sqs_report_lambda[*].arn
+        )
       },
       {
         "Effect": "Allow",
@@ -634,11 +1034,12 @@ resource "aws_iam_role_policy" "step_function_policy" {
 
 # Define the Lambda function to process SQS messages
 resource "aws_lambda_function" "sqs_consumer_lambda" {
-  function_name = "sqs-consumer-lambda"
-  filename      = "batch_operation.zip"
-  handler       = "batch_operation.lambda_handler"
-  runtime       = "python3.8"
-  role          = aws_iam_role.lambda_execution_role.arn
+  function_name    = "sqs-consumer-lambda"
+  filename         = data.archive_file.lambda_package["batch_operation"].output_path
+  source_code_hash = data.archive_file.lambda_package["batch_operation"].output_base64sha256
+  handler          = "batch_operation.lambda_handler"
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
 
   timeout       = 900  # Max allowed timeout is 15 minutes
 
@@ -646,6 +1047,50 @@ resource "aws_lambda_function" "sqs_consumer_lambda" {
     variables = {
       QUEUE_URL     = aws_sqs_queue.inventory_queue.url
       SNS_TOPIC_ARN = aws_sns_topic.restock_notifications.arn
+      REPORT_BUCKET = aws_s3_bucket.inventory_files.bucket
+      PROFILE_MODE        = var.profile_mode
+      PROFILE_SAMPLE_RATE = var.profile_sample_rate
+      PROFILE_S3_BUCKET   = var.profile_mode != "" ? aws_s3_bucket.inventory_files.bucket : ""
+    }
+  }
+}
+
+# Fan-out mode: sizes the worker pool from the queue depth
+resource "aws_lambda_function" "sqs_dispatcher_lambda" {
+  count            = var.sqs_consumer_fanout_enabled ? 1 : 0
+  function_name    = "sqs-dispatcher-lambda"
+  filename         = data.archive_file.lambda_package["batch_operation"].output_path
+  source_code_hash = data.archive_file.lambda_package["batch_operation"].output_base64sha256
+  handler          = "batch_operation.dispatch_handler"
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
+
+  environment {
+    variables = {
+      QUEUE_URL           = aws_sqs_queue.inventory_queue.url
+      MAX_WORKERS         = var.sqs_consumer_max_workers
+      MESSAGES_PER_WORKER = var.sqs_consumer_messages_per_worker
+    }
+  }
+}
+
+# Fan-out mode: merges the worker summaries into the single completion report
+resource "aws_lambda_function" "sqs_report_lambda" {
+  count            = var.sqs_consumer_fanout_enabled ? 1 : 0
+  function_name    = "sqs-report-lambda"
+  filename         = data.archive_file.lambda_package["batch_operation"].output_path
+  source_code_hash = data.archive_file.lambda_package["batch_operation"].output_base64sha256
+  handler          = "batch_operation.report_handler"
+  runtime          = "python3.8"
+  role             = aws_iam_role.lambda_execution_role.arn
+
+  timeout       = 60
+
+  environment {
+    variables = {
+      QUEUE_URL     = aws_sqs_queue.inventory_queue.url
+      SNS_TOPIC_ARN = aws_sns_topic.restock_notifications.arn
+      REPORT_BUCKET = aws_s3_bucket.inventory_files.bucket
     }
   }
 }
@@ -658,10 +1103,9 @@ data "aws_iam_policy_document" "step_function_policy" {
     effect    = "Allow"
   }
 }
-resource "aws_sfn_state_machine" "sqs_processor" {
-  name     = "SQSProcessor"
-  role_arn = aws_iam_role.step_function_role.arn
-  definition = jsonencode({
+locals {
+  # One consumer drains the queue
+  sqs_processor_serial = jsonencode({
     "Comment": "A description of my state machine",
     "StartAt": "ProcessSQSMessage",
     "States": {
@@ -704,6 +1148,79 @@ resource "aws_sfn_state_machine" "sqs_processor" {
       }
     }
   })
+
+  # The dispatcher starts one worker per batch of queued files, the report state sends one SNS summary
+  sqs_processor_fanout = jsonencode({
+    "Comment": "Drains the inventory queue with parallel batch workers",
+    "StartAt": "Dispatch",
+    "States": {
+      "Dispatch": {
+        "Type": "Task",
+        "Resource": one(aws_lambda_function.sqs_dispatcher_lambda[*].arn),
+        "Next": "ProcessSQSMessages"
+      },
+      "ProcessSQSMessages": {
+        "Type": "Map",
+        "ItemsPath": "$.workers",
+        "MaxConcurrency": var.sqs_consumer_max_workers,
+        "ResultPath": "$.summaries",
+        "Iterator": {
+          "StartAt": "Worker",
+          "States": {
+            "Worker": {
+              "Type": "Task",
+              "Resource": aws_lambda_function.sqs_consumer_lambda.arn,
+              "Retry": [
+                {
+                  "ErrorEquals": ["States.ALL"],
+                  "IntervalSeconds": 5,
+                  "MaxAttempts": 3,
+                  "BackoffRate": 2
+                }
+              ],
+              "End": true
+            }
+          }
+        },
+        "Next": "Report",
+        "Catch": [
+          {
+            "ErrorEquals": ["States.ALL"],
+            "Next": "FailState"
+          }
+        ]
+      },
+      "Report": {
+        "Type": "Task",
+        "Resource": one(aws_lambda_function.sqs_report_lambda[*].arn),
+        "Next": "CheckIfMoreMessages"
+      },
+      "CheckIfMoreMessages": {
+        "Type": "Choice",
+        "Choices": [
+          {
+            "Variable": "$.queueEmpty",
+            "BooleanEquals": true,
+            "Next": "StopExecution"
+          }
+        ],
+        "Default": "Dispatch"
+      },
+      "StopExecution": {
+        "Type": "Succeed"
+      },
+      "FailState": {
+        "Type": "Fail",
+        "Error": "Failed to process SQS messages"
+      }
+    }
+  })
+}
+
+resource "aws_sfn_state_machine" "sqs_processor" {
+  name     = "SQSProcessor"
+  role_arn = aws_iam_role.step_function_role.arn
+  definition = var.sqs_consumer_fanout_enabled ? local.sqs_processor_fanout : local.sqs_processor_serial
 }
 
 # Create a CloudWatch Event rule to trigger the Step Function
@@ -747,7 +1264,8 @@ resource "aws_iam_policy" "sqs_receive_message_policy" {
     Statement = [{
       Effect   = "Allow",
       "Action": ["sqs:ReceiveMessage",
-                 "sqs:DeleteMessage"],
+                 "sqs:DeleteMessage",
+                 "sqs:GetQueueAttributes"],
       Resource = aws_sqs_queue.inventory_queue.arn,
     }],
   })
@@ -759,3 +1277,8 @@ resource "aws_iam_role_policy_attachment" "lambda_sqs_receive_message_attachment
 }
 
 
+
+# Stream ARN for the query service (query_service.py --stream-arn)
+output "inventory_stream_arn" {
+  value = aws_dynamodb_table.inventory_table.stream_arn
+}
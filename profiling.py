@@ -0,0 +1,262 @@
+import argparse
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import boto3
+
+s3 = boto3.client('s3')
+
+# cpu, memory or both; empty disables profiling
+PROFILE_MODE = os.environ.get('PROFILE_MODE', '').lower()
+# Fraction of the invocations that are profiled while a mode is set
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '1'))
+# Where the captured profiles are uploaded (no bucket keeps them in /tmp only)
+PROFILE_S3_BUCKET = os.environ.get('PROFILE_S3_BUCKET', '')
+PROFILE_S3_PREFIX = os.environ.get('PROFILE_S3_PREFIX', 'profiles/')
+# Number of allocation sites kept from the tracemalloc snapshot
+PROFILE_TOP_ALLOCATIONS = int(os.environ.get('PROFILE_TOP_ALLOCATIONS', '25'))
+
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'profiles')
+
+_lock = threading.Lock()
+_current = None
+
+
+def _should_profile():
+    return PROFILE_MODE in ('cpu', 'memory', 'both') and random.random() < PROFILE_SAMPLE_RATE
+
+
+def record(object_key, rows):
+    """
+    Tags the running profile with a processed file and its row count.
+
+    Does nothing if the current invocation is not profiled, so handlers can call it unconditionally.
+    """
+    with _lock:
+        if _current is not None:
+            _current['files'].append(object_key)
+            _current['rows'] += rows
+
+
+def profiled(name):
+    """
+    Decorator for Lambda handlers that captures a cProfile and/or tracemalloc profile.
+
+    Enabled by PROFILE_MODE and sampled with PROFILE_SAMPLE_RATE. The stats are
+    written to /tmp/profiles and uploaded to PROFILE_S3_BUCKET together with a
+    JSON summary of the files, row count, duration, memory peak and the sites
+    holding the most memory when the handler returns. cProfile only sees the
+    handler's own thread, time spent in worker threads shows up as waiting on
+    them.
+
+    Args:
+        name (str): Prefix of the profile files, usually the function's name
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not _should_profile():
+                return handler(event, context)
+            return _run_profiled(name, handler, event, context)
+        return wrapper
+    return decorator
+
+
+def _run_profiled(name, handler, event, context):
+    global _current
+
+    cpu = PROFILE_MODE in ('cpu', 'both')
+    memory = PROFILE_MODE in ('memory', 'both')
+    with _lock:
+        _current = {'files': [], 'rows': 0}
+
+    profile = cProfile.Profile() if cpu else None
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if profile:
+        profile.enable()
+    try:
+        return handler(event, context)
+    finally:
+        if profile:
+            profile.disable()
+        duration = time.perf_counter() - start
+
+        snapshot = None
+        peak = None
+        if memory:
+            # Allocations of the profiler itself are left out of the report
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        with _lock:
+            tags, _current = _current, None
+
+        try:
+            _save(name, context, duration, tags, profile, snapshot, peak)
+        except Exception as e:
+            # A failed upload must not fail the invocation
+            print(f"Failed to save profile: {str(e)}")
+
+
+def _save(name, context, duration, tags, profile, snapshot, peak):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    request_id = getattr(context, 'aws_request_id', None) or f"{os.getpid()}-{random.randrange(1 << 32):08x}"
+    stem = f"{name}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{request_id}"
+
+    summary = {
+        'name': name,
+        'request_id': request_id,
+        'mode': PROFILE_MODE,
+        'files': tags['files'],
+        'rows': tags['rows'],
+        'duration_seconds': round(duration, 3),
+    }
+
+    paths = []
+    if profile is not None:
+        path = os.path.join(PROFILE_DIR, stem + '.prof')
+        profile.dump_stats(path)
+        paths.append(path)
+
+    if snapshot is not None:
+        summary['peak_memory_bytes'] = peak
+        summary['top_allocations'] = [
+            {'site': str(stat.traceback[0]), 'size_bytes': stat.size, 'count': stat.count}
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]
+        ]
+
+    path = os.path.join(PROFILE_DIR, stem + '.json')
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    paths.append(path)
+
+    print(f"Profile {stem}: {len(tags['files'])} files, {tags['rows']} rows, "
+          f"{summary['duration_seconds']}s, peak memory {peak}")
+
+    if PROFILE_S3_BUCKET:
+        # S3 metadata lets profiles be selected by size without downloading the summaries
+        metadata = {'rows': str(tags['rows']), 'files': str(len(tags['files'])),
+                    'duration': str(summary['duration_seconds'])}
+        if tags['files']:
+            metadata['first-file'] = tags['files'][0][:512]
+        for path in paths:
+            key = PROFILE_S3_PREFIX + name + '/' + os.path.basename(path)
+            s3.upload_file(path, PROFILE_S3_BUCKET, key, ExtraArgs={'Metadata': metadata})
+        print(f"Profile uploaded to s3://{PROFILE_S3_BUCKET}/{PROFILE_S3_PREFIX}{name}/")
+
+
+def _profile_paths(sources):
+    """Resolves local .prof files and s3://bucket/prefix sources to local paths."""
+    paths = []
+    for source in sources:
+        if not source.startswith('s3://'):
+            paths.append(source)
+            continue
+
+        bucket, _, prefix = source[len('s3://'):].partition('/')
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith('.prof'):
+                    path = os.path.join(PROFILE_DIR, 'download', obj['Key'].replace('/', '_'))
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    s3.download_file(bucket, obj['Key'], path)
+                    paths.append(path)
+    return paths
+
+
+def merge_profiles(sources):
+    """
+    Returns:
+        pstats.Stats: The stats of all profiles added together
+    """
+    paths = _profile_paths(sources)
+    if not paths:
+        raise ValueError(f"No profiles found in {sources}")
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+    return stats
+
+
+def _cumulative_times(stats):
+    # stats.stats maps (file, line, function) to (calls, primitive calls, total, cumulative, callers)
+    return {function: entry[3] for function, entry in stats.stats.items()}
+
+
+def compare_profiles(baseline, candidate, top=20):
+    """
+    Lists the functions whose cumulative time per profiled invocation changed the most.
+
+    Args:
+        baseline (pstats.Stats): Merged stats before the change
+        candidate (pstats.Stats): Merged stats after the change
+
+    Returns:
+        typing.List[tuple]: (function, baseline seconds, candidate seconds, difference)
+    """
+    baseline_runs = max(len(baseline.files), 1)
+    candidate_runs = max(len(candidate.files), 1)
+    before = _cumulative_times(baseline)
+    after = _cumulative_times(candidate)
+
+    rows = []
+    for function in set(before) | set(after):
+        old = before.get(function, 0.0) / baseline_runs
+        new = after.get(function, 0.0) / candidate_runs
+        rows.append((pstats.func_std_string(function), old, new, new - old))
+
+    rows.sort(key=lambda row: abs(row[3]), reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and compare profiles captured by the profiling hook")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    merge = subparsers.add_parser("merge", help="Add profiles together and print the hottest functions")
+    merge.add_argument("sources", nargs="+", help=".prof files or s3://bucket/prefix")
+    merge.add_argument("--output", help="Write the merged profile to this file")
+    merge.add_argument("--sort", default="cumulative")
+    merge.add_argument("--top", type=int, default=30)
+
+    compare = subparsers.add_parser("compare", help="Show the largest per-invocation time differences")
+    compare.add_argument("--baseline", nargs="+", required=True)
+    compare.add_argument("--candidate", nargs="+", required=True)
+    compare.add_argument("--top", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        stats = merge_profiles(args.sources)
+        if args.output:
+            stats.dump_stats(args.output)
+            print(f"Merged {len(stats.files)} profiles into {args.output}")
+        stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+    else:
+        baseline = merge_profiles(args.baseline)
+        candidate = merge_profiles(args.candidate)
+        print(f"Baseline: {len(baseline.files)} profiles, candidate: {len(candidate.files)} profiles "
+              f"(seconds per invocation)")
+        print(f"{'baseline':>10} {'candidate':>10} {'diff':>10}  function")
+        for function, old, new, difference in compare_profiles(baseline, candidate, args.top):
+            print(f"{old:10.4f} {new:10.4f} {difference:+10.4f}  {function}")
+
+
+if __name__ == "__main__":
+    main()
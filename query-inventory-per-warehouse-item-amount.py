@@ -1,30 +1,19 @@
-import boto3
-
-# Initialize the DynamoDB client
-client = boto3.resource('dynamodb')
-table = client.Table('Inventory')
+import stock_index
 
 # List of warehouse options
 WAREHOUSES = ["BERLIN I", "FRANKFURT I", "HANNOVER I", "HANNOVER II", "HAMBURG I", "DUISBURG I", "all"]
 
 # Function to get a list of all items in a warehouse with inventory greater than y
 def get_items_with_inventory_greater_than(warehouse_name, threshold):
-    # Initialize an empty list to store the items
-    items_greater_than_threshold = []
-
-    # Retrieve items from the table for the specified warehouse
+    # Range query on the WarehouseStockIndex instead of scanning and filtering the whole table
     if warehouse_name == 'all':
-        response = table.scan()
+        warehouses = WAREHOUSES[:-1]
     else:
-        response = table.scan(FilterExpression=boto3.dynamodb.conditions.Attr('WarehouseName').eq(warehouse_name))
+        warehouses = [warehouse_name]
 
-    # Iterate over the items and check if inventory is greater than y
-    for item in response['Items']:
-        stock_level_change = int(item.get('StockLevelChange', 0))
-        if stock_level_change > threshold:
-            item_id = item['ItemId']
-            item_name = item['ItemName']
-            items_greater_than_threshold.append((item_id, item_name, stock_level_change))
+    items_greater_than_threshold = []
+    for warehouse in warehouses:
+        items_greater_than_threshold.extend(stock_index.items_above(warehouse, threshold))
 
     return items_greater_than_threshold
 
@@ -35,9 +24,6 @@ warehouse_name = input("Enter the name of the warehouse: ")
 # Get threshold value from the user
 threshold = int(input("Enter the threshold value: "))
 
-# Get items with inventory greater than the specified threshold for the specified warehouse
-items_greater_than_threshold = get_items_with_inventory_greater_than(warehouse_name, threshold)
-
 # Print the results separated by warehouse
 if warehouse_name == 'all':
     for warehouse in WAREHOUSES[:-1]:  # Exclude the 'all' option
@@ -48,6 +34,8 @@ if warehouse_name == 'all':
                 print(f"  | ItemID: {item_id} | ItemName: {item_name} | StockLevelChange: {stock_level_change} | ")
             print()
 else:
+    # Get items with inventory greater than the specified threshold for the specified warehouse
+    items_greater_than_threshold = get_items_with_inventory_greater_than(warehouse_name, threshold)
     print(f"Items in {warehouse_name} with inventory greater than {threshold}:")
     for item_id, item_name, stock_level_change in items_greater_than_threshold:
         print(f"  | ItemID: {item_id} | ItemName: {item_name} | StockLevelChange: {stock_level_change} | ")
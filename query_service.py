@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import json
+import os
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+import transaction_log
+
+# AWS resource initialization
+ddb = boto3.resource('dynamodb')
+inventory_table = ddb.Table('Inventory')
+streams_client = boto3.client('dynamodbstreams')
+
+# Seconds between two polls of the DynamoDB stream
+STREAM_POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', '1'))
+
+deserializer = TypeDeserializer()
+
+
+class InventoryIndex:
+    """
+    In-memory copy of the Inventory table with the aggregates the reports need.
+
+    Totals are maintained incrementally, so every query is a dictionary lookup
+    or a pass over one warehouse.
+    """
+
+    def __init__(self):
+        self.stock = {}
+        self.item_names = {}
+        self.by_warehouse = defaultdict(dict)
+        self.by_item = defaultdict(dict)
+        self.warehouse_totals = defaultdict(int)
+        self.daily_changes = defaultdict(lambda: defaultdict(int))
+        self.loaded_at = None
+
+    def set_stock(self, item_id, warehouse_name, stock, item_name=None):
+        old_stock = self.stock.get((item_id, warehouse_name), 0)
+        self.stock[(item_id, warehouse_name)] = stock
+        self.by_warehouse[warehouse_name][item_id] = stock
+        self.by_item[item_id][warehouse_name] = stock
+        self.warehouse_totals[warehouse_name] += stock - old_stock
+        if item_name:
+            self.item_names[item_id] = item_name
+        return stock - old_stock
+
+    def remove(self, item_id, warehouse_name):
+        old_stock = self.stock.pop((item_id, warehouse_name), 0)
+        self.by_warehouse[warehouse_name].pop(item_id, None)
+        self.by_item[item_id].pop(warehouse_name, None)
+        self.warehouse_totals[warehouse_name] -= old_stock
+        return -old_stock
+
+    def load(self, items):
+        for item in items:
+            self.set_stock(item['ItemId'], item['WarehouseName'],
+                           int(item.get('StockLevelChange', 0)), item.get('ItemName'))
+        self.loaded_at = datetime.now(timezone.utc)
+
+    def apply_stream_record(self, record):
+        """
+        Applies one DynamoDB Streams record (or a local stand-in with the same shape).
+        """
+        change = record['dynamodb']
+        keys = {name: deserializer.deserialize(value) for name, value in change['Keys'].items()}
+        item_id, warehouse_name = keys['ItemId'], keys['WarehouseName']
+
+        if record['eventName'] == 'REMOVE':
+            delta = self.remove(item_id, warehouse_name)
+        else:
+            image = {name: deserializer.deserialize(value) for name, value in change['NewImage'].items()}
+            delta = self.set_stock(item_id, warehouse_name, int(image.get('StockLevelChange', 0)),
+                                   image.get('ItemName'))
+
+        created = change.get('ApproximateCreationDateTime')
+        if isinstance(created, datetime):
+            day = created.astimezone(timezone.utc).date()
+        elif created is not None:
+            day = datetime.fromtimestamp(float(created), timezone.utc).date()
+        else:
+            day = datetime.now(timezone.utc).date()
+        self.daily_changes[day.isoformat()][(item_id, warehouse_name)] += delta
+
+    def _item_row(self, item_id, stock):
+        return {'ItemId': item_id, 'ItemName': self.item_names.get(item_id), 'Stock': stock}
+
+    def warehouse_items(self, warehouse_name, above=None, below=None):
+        rows = []
+        for item_id, stock in self.by_warehouse.get(warehouse_name, {}).items():
+            if above is not None and not stock > above:
+                continue
+            if below is not None and not stock < below:
+                continue
+            rows.append(self._item_row(item_id, stock))
+        return sorted(rows, key=lambda row: row['Stock'])
+
+    def item(self, item_id):
+        warehouses = dict(self.by_item.get(item_id, {}))
+        return {
+            'ItemId': item_id,
+            'ItemName': self.item_names.get(item_id),
+            'Warehouses': warehouses,
+            'Total': sum(warehouses.values())
+        }
+
+    def totals(self):
+        return dict(self.warehouse_totals)
+
+
+def scan_inventory(table):
+    """Reads the whole Inventory table, following the scan pagination."""
+    params = {'ProjectionExpression': 'ItemId, WarehouseName, StockLevelChange, ItemName'}
+    while True:
+        response = table.scan(**params)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class LocalChangeFeed:
+    """
+    Stand-in for DynamoDB Streams, records put here are delivered like stream records.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def put(self, record):
+        self.queue.put_nowait(record)
+
+    def modify(self, item_id, warehouse_name, stock, item_name=None):
+        # Builds a MODIFY record in the DynamoDB Streams wire format
+        image = {'ItemId': {'S': item_id}, 'WarehouseName': {'S': warehouse_name},
+                 'StockLevelChange': {'N': str(stock)}}
+        if item_name:
+            image['ItemName'] = {'S': item_name}
+        self.put({
+            'eventName': 'MODIFY',
+            'dynamodb': {
+                'Keys': {'ItemId': {'S': item_id}, 'WarehouseName': {'S': warehouse_name}},
+                'NewImage': image,
+                'ApproximateCreationDateTime': datetime.now(timezone.utc)
+            }
+        })
+
+    async def records(self):
+        while True:
+            yield await self.queue.get()
+
+
+class DynamoDBStreamFeed:
+    """
+    Polls the shards of the Inventory table's stream, starting at LATEST.
+    """
+
+    def __init__(self, stream_arn, poll_interval=STREAM_POLL_INTERVAL):
+        self.stream_arn = stream_arn
+        self.poll_interval = poll_interval
+        self.iterators = {}
+        self.finished_shards = set()
+
+    def start(self):
+        """Opens the shard iterators; call before loading the index so no change is missed."""
+        self._refresh_shards()
+
+    def _refresh_shards(self):
+        known = set(self.iterators) | self.finished_shards
+        # Shards that appear after startup are read from their beginning
+        iterator_type = 'TRIM_HORIZON' if known else 'LATEST'
+        params = {'StreamArn': self.stream_arn}
+        while True:
+            description = streams_client.describe_stream(**params)['StreamDescription']
+            for shard in description['Shards']:
+                shard_id = shard['ShardId']
+                if shard_id in known:
+                    continue
+                self.iterators[shard_id] = streams_client.get_shard_iterator(
+                    StreamArn=self.stream_arn, ShardId=shard_id, ShardIteratorType=iterator_type
+                )['ShardIterator']
+            if 'LastEvaluatedShardId' not in description:
+                break
+            params['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+
+    def _poll(self):
+        self._refresh_shards()
+        records = []
+        for shard_id, iterator in list(self.iterators.items()):
+            response = streams_client.get_records(ShardIterator=iterator)
+            records.extend(response['Records'])
+            if response.get('NextShardIterator'):
+                self.iterators[shard_id] = response['NextShardIterator']
+            else:
+                del self.iterators[shard_id]
+                self.finished_shards.add(shard_id)
+        return records
+
+    async def records(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            for record in await loop.run_in_executor(None, self._poll):
+                yield record
+            await asyncio.sleep(self.poll_interval)
+
+
+class QueryService:
+    """
+    Answers the inventory reports over HTTP from a warm InventoryIndex.
+
+    GET /warehouses                               total stock per warehouse
+    GET /warehouses/<name>/items[?above=y|below=y]  items of a warehouse
+    GET /items/<id>                               stock of an item in every warehouse
+    GET /daily/<yyyy-mm-dd>                       net change per warehouse and item on a day
+    """
+
+    def __init__(self, index, feed=None):
+        self.index = index
+        self.feed = feed
+        self._daily_from_log = {}
+
+    async def follow(self):
+        async for record in self.feed.records():
+            try:
+                self.index.apply_stream_record(record)
+            except Exception as e:
+                print(f"Failed to apply stream record: {str(e)}")
+
+    async def daily(self, day):
+        if transaction_log.TRANSACTION_LOG_BUCKET:
+            # The transaction log holds every day completely, past days never change
+            changes = self._daily_from_log.get(day)
+            if changes is None:
+                loop = asyncio.get_running_loop()
+                changes = await loop.run_in_executor(None, transaction_log.net_changes_on, date.fromisoformat(day))
+                if day < datetime.now(timezone.utc).date().isoformat():
+                    self._daily_from_log[day] = changes
+        elif day in self.index.daily_changes:
+            # Without the log only changes seen on the stream since startup are known
+            changes = self.index.daily_changes[day]
+        else:
+            return None
+
+        report = defaultdict(dict)
+        for (item_id, warehouse_name), delta in changes.items():
+            report[warehouse_name][item_id] = delta
+        return report
+
+    async def route(self, method, target):
+        if method != 'GET':
+            return 405, {'error': 'Only GET is supported'}
+
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if parts == ['health']:
+            return 200, {'items': len(self.index.stock), 'loaded_at': self.index.loaded_at and self.index.loaded_at.isoformat()}
+        if parts == ['warehouses']:
+            return 200, self.index.totals()
+        if len(parts) == 3 and parts[0] == 'warehouses' and parts[2] == 'items':
+            above = int(query['above']) if 'above' in query else None
+            below = int(query['below']) if 'below' in query else None
+            return 200, self.index.warehouse_items(parts[1].upper(), above, below)
+        if len(parts) == 2 and parts[0] == 'items':
+            return 200, self.index.item(parts[1])
+        if len(parts) == 2 and parts[0] == 'daily':
+            report = await self.daily(parts[1])
+            if report is None:
+                return 404, {'error': f"No changes recorded for {parts[1]}"}
+            return 200, report
+
+        return 404, {'error': f"Unknown path {url.path}"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+                # Skip the headers, requests have no body
+                keep_alive = True
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    if header.lower().startswith(b'connection:') and b'close' in header.lower():
+                        keep_alive = False
+
+                try:
+                    status, payload = await self.route(method, target)
+                except (ValueError, KeyError) as e:
+                    status, payload = 400, {'error': str(e)}
+
+                body = json.dumps(payload).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving {len(self.index.stock)} inventory entries on http://{host}:{port}")
+        tasks = [server.serve_forever()]
+        if self.feed is not None:
+            tasks.append(self.follow())
+        await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inventory query service with a warm in-memory index")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--stream-arn", default=os.environ.get('INVENTORY_STREAM_ARN'),
+                        help="Stream of the Inventory table that keeps the index current")
+    args = parser.parse_args()
+
+    feed = None
+    if args.stream_arn:
+        feed = DynamoDBStreamFeed(args.stream_arn)
+        feed.start()
+    else:
+        print("No stream configured, the index will not follow changes.")
+
+    index = InventoryIndex()
+    index.load(scan_inventory(inventory_table))
+
+    asyncio.run(QueryService(index, feed).serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
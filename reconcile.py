@@ -0,0 +1,327 @@
+import argparse
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+import inventory_batch
+import inventory_reader
+import throttle
+
+s3 = boto3.client('s3')
+dynamodb_client = boto3.client('dynamodb', config=throttle.CLIENT_CONFIG)
+
+INVENTORY_TABLE = os.environ.get('TABLE_NAME', 'Inventory')
+INVENTORY_BUCKET = os.environ.get('INVENTORY_BUCKET', 'unique-name-for-inventory-bucket-example')
+
+# Number of hash partitions the key space is split into
+RECONCILE_PARTITIONS = int(os.environ.get('RECONCILE_PARTITIONS', '256'))
+# Parallel scan segments and concurrent file readers
+RECONCILE_SCAN_SEGMENTS = int(os.environ.get('RECONCILE_SCAN_SEGMENTS', '8'))
+RECONCILE_READERS = int(os.environ.get('RECONCILE_READERS', '16'))
+
+# Digests are computed modulo a Mersenne prime
+MODULUS = (1 << 61) - 1
+
+
+def key_hash(item_id, warehouse_name, partitions):
+    """
+    Returns:
+        tuple: (partition of the key, weight of the key in its partition's digest)
+    """
+    digest = hashlib.blake2b(f"{item_id}\x00{warehouse_name}".encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little') % partitions, int.from_bytes(digest[8:], 'little') % MODULUS
+
+
+def add_to_digests(digests, stock_levels, partitions):
+    """
+    Adds weight(key) * value for every key to the digest of its partition.
+
+    The digest is linear in the values, so the digest of a sum of deltas is the
+    sum of the deltas' digests: every inventory file can be digested on its own
+    and the results cached, and a key with stock 0 digests like a missing key.
+    Two different states of a partition collide with probability ~2^-61.
+    """
+    for (item_id, warehouse_name), value in stock_levels.items():
+        partition, weight = key_hash(item_id, warehouse_name, partitions)
+        digests[partition] = (digests[partition] + weight * value) % MODULUS
+    return digests
+
+
+def digest_file_deltas(deltas, partitions):
+    """
+    Digests the summed deltas of one file and groups them by partition.
+
+    Returns:
+        tuple: (partition digests, dict mapping str(partition) to [ItemId, WarehouseName, delta] entries)
+    """
+    digests = [0] * partitions
+    partition_deltas = defaultdict(list)
+    for (item_id, warehouse_name), delta in deltas.items():
+        partition, weight = key_hash(item_id, warehouse_name, partitions)
+        digests[partition] = (digests[partition] + weight * delta) % MODULUS
+        partition_deltas[str(partition)].append([item_id, warehouse_name, delta])
+    return digests, dict(partition_deltas)
+
+
+class HistorySource:
+    """
+    The inventory files in S3 (or a local copy of inventory_files/) as the expected state.
+    """
+
+    def __init__(self, bucket_name=INVENTORY_BUCKET, directory=None, cache_path=None, readers=RECONCILE_READERS):
+        self.bucket_name = bucket_name
+        self.directory = directory
+        self.cache_path = cache_path
+        self.readers = readers
+        self.files_read = 0
+        self._file_deltas = {}
+
+    def list_files(self):
+        """
+        Returns:
+            typing.List[tuple]: (object key, version tag) of every inventory file
+        """
+        files = []
+        if self.directory:
+            for root, _, names in os.walk(os.path.join(self.directory, "inventory_files")):
+                for name in names:
+                    path = os.path.join(root, name)
+                    key = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                    if inventory_reader.is_inventory_key(key):
+                        stat = os.stat(path)
+                        files.append((key, f"{stat.st_size}-{int(stat.st_mtime)}"))
+        else:
+            paginator = s3.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix="inventory_files/"):
+                for obj in page.get('Contents', []):
+                    if inventory_reader.is_inventory_key(obj['Key']):
+                        files.append((obj['Key'], obj['ETag'].strip('"')))
+        return sorted(files)
+
+    def read_deltas(self, object_key):
+        if self.directory:
+            with open(os.path.join(self.directory, object_key), 'rb') as raw:
+                batch = inventory_batch.parse_inventory_batch(inventory_reader.open_text(raw, object_key))
+        else:
+            batch = inventory_batch.parse_inventory_batch(
+                inventory_reader.open_inventory_object(s3, self.bucket_name, object_key))
+        return batch.sum_by_key()
+
+    def _load_cache(self, partitions):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path) as f:
+            cache = json.load(f)
+        if cache.get('partitions') != partitions:
+            return {}
+        return cache['files']
+
+    def _save_cache(self, partitions, files):
+        if self.cache_path:
+            with open(self.cache_path, 'w') as f:
+                json.dump({'partitions': partitions, 'files': files}, f)
+
+    def digests(self, partitions):
+        """
+        Computes the partition digests of the summed history.
+
+        Every file's digests and its key deltas grouped by partition are kept
+        (and cached by key and ETag), so a routine run only reads the files that
+        arrived since the previous one and stock_levels() reads none.
+        """
+        files = self.list_files()
+        cache = self._load_cache(partitions)
+        missing = [key for key, tag in files
+                   if cache.get(key, {}).get('tag') != tag or 'deltas' not in cache[key]]
+
+        def digest_file(object_key):
+            return object_key, digest_file_deltas(self.read_deltas(object_key), partitions)
+
+        with ThreadPoolExecutor(max_workers=self.readers) as executor:
+            for object_key, (file_digests, partition_deltas) in executor.map(digest_file, missing):
+                cache[object_key] = {'digests': file_digests, 'deltas': partition_deltas}
+        for key, tag in files:
+            cache[key]['tag'] = tag
+        self.files_read += len(missing)
+
+        current = {key: cache[key] for key, _ in files}
+        self._save_cache(partitions, current)
+        self._file_deltas = {key: entry['deltas'] for key, entry in current.items()}
+
+        digests = [0] * partitions
+        for entry in current.values():
+            for partition, value in enumerate(entry['digests']):
+                digests[partition] = (digests[partition] + value) % MODULUS
+        print(f"History: {len(files)} files, {len(missing)} read, {len(files) - len(missing)} from cache.")
+        return digests
+
+    def stock_levels(self, partitions, selected):
+        """
+        Sums the history of the keys in the selected partitions only.
+
+        The key deltas kept by digests() are summed, no file is read again.
+        """
+        if not self._file_deltas:
+            self.digests(partitions)
+
+        totals = defaultdict(int)
+        for partition_deltas in self._file_deltas.values():
+            for partition in selected:
+                for item_id, warehouse_name, delta in partition_deltas.get(str(partition), ()):
+                    totals[(item_id, warehouse_name)] += delta
+        return dict(totals)
+
+
+def scan_table(table_name=INVENTORY_TABLE, segments=RECONCILE_SCAN_SEGMENTS):
+    """
+    Parallel scan of the Inventory table, reading only the key and the stock.
+
+    Returns:
+        dict: Maps (ItemId, WarehouseName) to StockLevelChange
+    """
+    controller = throttle.ThrottleController(initial_concurrency=segments, max_concurrency=segments)
+
+    def scan_segment(segment):
+        stock_levels = {}
+        params = {
+            'TableName': table_name,
+            'ProjectionExpression': 'ItemId, WarehouseName, StockLevelChange',
+            'Segment': segment,
+            'TotalSegments': segments,
+        }
+        while True:
+            response = controller.call(dynamodb_client.scan, **params)
+            for item in response['Items']:
+                key = (item['ItemId']['S'], item['WarehouseName']['S'])
+                stock_levels[key] = int(item.get('StockLevelChange', {'N': '0'})['N'])
+            if 'LastEvaluatedKey' not in response:
+                return stock_levels
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    stock_levels = {}
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        for segment_levels in executor.map(scan_segment, range(segments)):
+            stock_levels.update(segment_levels)
+    return stock_levels
+
+
+def reconcile(history, table_name=INVENTORY_TABLE, partitions=RECONCILE_PARTITIONS, segments=RECONCILE_SCAN_SEGMENTS):
+    """
+    Compares the Inventory table with the history, key by key only where the digests differ.
+
+    Returns:
+        dict: The drift report
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        history_future = executor.submit(history.digests, partitions)
+        table_future = executor.submit(scan_table, table_name, segments)
+        expected_digests = history_future.result()
+        table_levels = table_future.result()
+
+    table_digests = add_to_digests([0] * partitions, table_levels, partitions)
+    mismatched = {p for p in range(partitions) if expected_digests[p] != table_digests[p]}
+    print(f"{len(mismatched)} of {partitions} partitions differ.")
+
+    drift = []
+    if mismatched:
+        expected = history.stock_levels(partitions, mismatched)
+        actual = {key: stock for key, stock in table_levels.items()
+                  if key_hash(key[0], key[1], partitions)[0] in mismatched}
+        for key in sorted(set(expected) | set(actual)):
+            expected_stock = expected.get(key, 0)
+            actual_stock = actual.get(key)
+            if expected_stock != (actual_stock or 0):
+                drift.append({
+                    'ItemId': key[0],
+                    'WarehouseName': key[1],
+                    'Expected': expected_stock,
+                    'Actual': actual_stock,
+                    'Difference': expected_stock - (actual_stock or 0),
+                })
+
+    return {
+        'partitions': partitions,
+        'mismatched_partitions': sorted(mismatched),
+        'table_keys': len(table_levels),
+        'history_files_read': history.files_read,
+        'drift': drift,
+    }
+
+
+def apply_corrections(drift, table_name=INVENTORY_TABLE):
+    """
+    Sets each drifted key to its expected stock.
+
+    The write is conditional on the stock still being what the reconciliation
+    saw, so a key that was updated by ingest in the meantime is skipped.
+
+    Returns:
+        int: Number of keys corrected
+    """
+    controller = throttle.ThrottleController()
+    corrected = 0
+    for entry in drift:
+        params = {
+            'TableName': table_name,
+            'Key': {'ItemId': {'S': entry['ItemId']}, 'WarehouseName': {'S': entry['WarehouseName']}},
+            'UpdateExpression': 'SET StockLevelChange = :expected',
+            'ExpressionAttributeValues': {':expected': {'N': str(entry['Expected'])}},
+            'ReturnConsumedCapacity': 'TOTAL',
+        }
+        if entry['Actual'] is None:
+            params['ConditionExpression'] = 'attribute_not_exists(StockLevelChange)'
+        else:
+            params['ConditionExpression'] = 'StockLevelChange = :actual'
+            params['ExpressionAttributeValues'][':actual'] = {'N': str(entry['Actual'])}
+
+        try:
+            controller.call(dynamodb_client.update_item, **params)
+            corrected += 1
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            print(f"Skipped {entry['ItemId']} in {entry['WarehouseName']}, it changed during the reconciliation.")
+
+    controller.report("Corrections")
+    return corrected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile the Inventory table with the inventory file history")
+    parser.add_argument("--bucket", default=INVENTORY_BUCKET, help="Bucket holding inventory_files/")
+    parser.add_argument("--directory", help="Local directory holding inventory_files/ instead of the bucket")
+    parser.add_argument("--cache", help="JSON file caching the per-file digests and key deltas between runs")
+    parser.add_argument("--partitions", type=int, default=RECONCILE_PARTITIONS)
+    parser.add_argument("--segments", type=int, default=RECONCILE_SCAN_SEGMENTS)
+    parser.add_argument("--report", help="Write the drift report as JSON to this file")
+    parser.add_argument("--corrections", help="Write the correction batch as JSON to this file")
+    parser.add_argument("--apply", action="store_true", help="Apply the corrections to the table")
+    args = parser.parse_args()
+
+    history = HistorySource(args.bucket, args.directory, args.cache)
+    report = reconcile(history, partitions=args.partitions, segments=args.segments)
+
+    print(f"Compared {report['table_keys']} table keys, read {report['history_files_read']} files, "
+          f"found {len(report['drift'])} drifted keys in {len(report['mismatched_partitions'])} partitions.")
+    for entry in report['drift'][:20]:
+        print(f"  {entry['ItemId'][:12]} {entry['WarehouseName']:<12} expected {entry['Expected']:>6} "
+              f"actual {entry['Actual']}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.corrections:
+        with open(args.corrections, 'w') as f:
+            json.dump([{'ItemId': entry['ItemId'], 'WarehouseName': entry['WarehouseName'],
+                        'StockLevelChange': entry['Expected']} for entry in report['drift']], f, indent=2)
+    if args.apply and report['drift']:
+        print(f"Corrected {apply_corrections(report['drift'])} keys.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import csv
+import gzip
+import io
+import os
+import tempfile
+import uuid
+from datetime import datetime, timezone
+
+import boto3
+
+sns_client = boto3.client('sns', region_name='eu-central-1')
+s3 = boto3.client('s3')
+
+# SNS rejects messages above 256 KB; the margin covers the subject and attributes
+REPORT_MAX_MESSAGE_BYTES = int(os.environ.get('REPORT_MAX_MESSAGE_BYTES', '240000'))
+# Reports larger than this go to S3 as a gzip CSV (needs REPORT_BUCKET, otherwise they are split)
+REPORT_S3_THRESHOLD_BYTES = int(os.environ.get('REPORT_S3_THRESHOLD_BYTES', '1000000'))
+REPORT_BUCKET = os.environ.get('REPORT_BUCKET', '')
+REPORT_PREFIX = os.environ.get('REPORT_PREFIX', 'reports/')
+# Validity of the presigned link. A link stops working when the credentials that signed
+# it expire, and a Lambda's temporary role credentials last a few hours at most
+REPORT_LINK_EXPIRY_SECONDS = int(os.environ.get('REPORT_LINK_EXPIRY_SECONDS', str(60 * 60)))
+# Lines of a report sent to S3 that are quoted in the summary message
+REPORT_PREVIEW_LINES = int(os.environ.get('REPORT_PREVIEW_LINES', '20'))
+
+# SNS subjects are limited to 100 characters
+MAX_SUBJECT_LENGTH = 100
+
+
+def _size(text):
+    return len(text.encode('utf-8'))
+
+
+def _subject(subject, part, parts):
+    suffix = f" ({part}/{parts})" if parts > 1 else ""
+    return subject[:MAX_SUBJECT_LENGTH - len(suffix)] + suffix
+
+
+class _Chunker:
+    """Packs lines into messages of at most max_bytes, in linear time."""
+
+    def __init__(self, intro, max_bytes):
+        self.max_bytes = max_bytes
+        self.messages = []
+        self.total_bytes = 0
+        self._parts = [intro]
+        self._bytes = _size(intro)
+
+    def add(self, line):
+        line_bytes = _size(line)
+        if self._bytes + line_bytes > self.max_bytes and len(self._parts) > 1:
+            self._close()
+            self._parts = ["(continued)\n"]
+            self._bytes = _size(self._parts[0])
+        if line_bytes > self.max_bytes:
+            line = line.encode('utf-8')[:max(0, self.max_bytes - self._bytes - 4)].decode('utf-8', 'ignore') + "...\n"
+            line_bytes = _size(line)
+        self._parts.append(line)
+        self._bytes += line_bytes
+        self.total_bytes += line_bytes
+
+    def finish(self, footer):
+        if self._bytes + _size(footer) > self.max_bytes:
+            self._close()
+            self._parts = []
+        self._parts.append(footer)
+        self._close()
+        return self.messages
+
+    def _close(self):
+        self.messages.append(''.join(self._parts))
+
+
+def _write_csv(columns, buffered_rows, remaining_rows):
+    """
+    Streams the report rows into a gzip CSV file in /tmp.
+
+    Returns:
+        tuple: (path of the file, number of rows written)
+    """
+    handle, path = tempfile.mkstemp(suffix='.csv.gz')
+    os.close(handle)
+    count = 0
+    with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if columns:
+            writer.writerow(columns)
+        for rows in (buffered_rows, remaining_rows):
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    return path, count
+
+
+def publish_report(topic_arn, subject, rows, format_line, intro="", footer="", columns=None, report_name="report"):
+    """
+    Publishes a report of any size to SNS without building it in one string.
+
+    Rows are consumed once from `rows` (typically a generator). The report is
+    sent as one or more messages below REPORT_MAX_MESSAGE_BYTES; once it grows
+    beyond REPORT_S3_THRESHOLD_BYTES and REPORT_BUCKET is set, all rows are
+    written to S3 as a gzip CSV and a single summary with a presigned link and
+    the s3:// location (for reading it once the link expired) is published instead.
+
+    Args:
+        topic_arn (str): SNS topic to publish to
+        subject (str): Subject of the message(s)
+        rows (iterable): Report rows as tuples
+        format_line (callable): Turns a row into one line of the message text
+        intro (str): Text in front of the first line
+        footer (str): Text after the last line
+        columns (list): Header of the CSV file
+        report_name (str): Used in the S3 key of the CSV file
+
+    Returns:
+        dict: {'rows': ..., 'messages': ..., 's3_key': key of the CSV or None}
+    """
+    rows = iter(rows)
+    chunker = _Chunker(intro, REPORT_MAX_MESSAGE_BYTES)
+    buffered_rows = []
+
+    for row in rows:
+        buffered_rows.append(row)
+        line = format_line(row)
+        chunker.add(line if line.endswith("\n") else line + "\n")
+
+        if REPORT_BUCKET and chunker.total_bytes > REPORT_S3_THRESHOLD_BYTES:
+            return _publish_to_s3(topic_arn, subject, buffered_rows, rows, format_line,
+                                  intro, footer, columns, report_name)
+
+    messages = chunker.finish(footer)
+    for part, message in enumerate(messages, start=1):
+        sns_client.publish(
+            TopicArn=topic_arn,
+            Message=message,
+            Subject=_subject(subject, part, len(messages))
+        )
+    print(f"Report with {len(buffered_rows)} rows published in {len(messages)} message(s).")
+    return {'rows': len(buffered_rows), 'messages': len(messages), 's3_key': None}
+
+
+def _publish_to_s3(topic_arn, subject, buffered_rows, remaining_rows, format_line, intro, footer, columns, report_name):
+    path, count = _write_csv(columns, buffered_rows, remaining_rows)
+    # The uuid keeps reports written in the same second apart
+    key = (f"{REPORT_PREFIX}{report_name}/{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}"
+           f"-{uuid.uuid4().hex[:12]}.csv.gz")
+    try:
+        # Served as a gzip file; with Content-Encoding clients would unpack it into a .gz-named CSV
+        s3.upload_file(path, REPORT_BUCKET, key, ExtraArgs={'ContentType': 'application/gzip'})
+    finally:
+        os.remove(path)
+
+    link = s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': REPORT_BUCKET, 'Key': key},
+        ExpiresIn=REPORT_LINK_EXPIRY_SECONDS
+    )
+
+    summary = io.StringIO()
+    summary.write(intro)
+    for row in buffered_rows[:REPORT_PREVIEW_LINES]:
+        line = format_line(row)
+        summary.write(line if line.endswith("\n") else line + "\n")
+    summary.write(f"\n... {count} rows in total. The full report (gzip CSV) is stored at "
+                  f"s3://{REPORT_BUCKET}/{key}\n"
+                  f"Download link, valid for {REPORT_LINK_EXPIRY_SECONDS // 60} minutes:\n{link}\n")
+    summary.write(footer)
+
+    sns_client.publish(
+        TopicArn=topic_arn,
+        Message=summary.getvalue(),
+        Subject=_subject(subject, 1, 1)
+    )
+    print(f"Report with {count} rows written to s3://{REPORT_BUCKET}/{key}, summary published.")
+    return {'rows': count, 'messages': 1, 's3_key': key}
@@ -1,10 +1,12 @@
 import os
 import boto3
 
+import alert_state
+import report_publisher
+
 def restock_checker(event, context):
     # AWS resource initialization
     dynamodb = boto3.resource('dynamodb', region_name='eu-central-1')
-    sns_client = boto3.client('sns', region_name='eu-central-1')
     
     # Table names and SNS topic from environment variables
     inventory_table_name = 'Inventory'
@@ -18,7 +20,7 @@ def restock_checker(event, context):
     try:
         # Scan the Inventory table to find items below restock limit
         response = inventory_table.scan()
-        items_to_restock = []
+        restock_candidates = []
         
         for item in response['Items']:
             item_id = item['ItemId']
@@ -33,20 +35,22 @@ def restock_checker(event, context):
                 restock_limit = restock_item.get('RestockIfBelow')
                 
                 if stock_level_change is not None and restock_limit is not None:
-                    if stock_level_change < restock_limit:
-                        items_to_restock.append((item_id, warehouse_name, stock_level_change, restock_limit))
-        
+                    restock_candidates.append((item_id, warehouse_name, stock_level_change, restock_limit))
+
+        # Only items that newly fell below (or dropped further below) the limit are reported
+        items_to_restock = alert_state.filter_alerts(restock_candidates)
+
         if items_to_restock:
-            # If there are items to restock, send an email notification
-            message = "Dear Manager,\n\nThe following items are below the restock limit:\n\n"
-            for item in items_to_restock:
-                message += f"Item ID: {item[0]}, at {item[1]}, has its current stock ({item[2]}) below the threshold limit ({item[3]})\n"
-            message += "\nThis is an automated message."
-            
-            sns_client.publish(
-                TopicArn=sns_topic_arn,
-                Message=message,
-                Subject="Stock Alert"
+            # If there are items to restock, send an email notification (split or moved to S3 when large)
+            report_publisher.publish_report(
+                sns_topic_arn,
+                "Stock Alert",
+                items_to_restock,
+                lambda item: f"Item ID: {item[0]}, at {item[1]}, has its current stock ({item[2]}) below the threshold limit ({item[3]})",
+                intro="Dear Manager,\n\nThe following items are below the restock limit:\n\n",
+                footer="\nThis is an automated message.",
+                columns=["ItemId", "WarehouseName", "StockLevel", "RestockIfBelow"],
+                report_name="restock_checker"
             )
             print("Notification sent successfully!")
         else:
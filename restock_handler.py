@@ -2,8 +2,13 @@ import json
 import boto3
 import os
 
-dynamodb = boto3.resource('dynamodb')
-sns_client = boto3.client('sns')
+import report_publisher
+import throttle
+
+dynamodb = boto3.resource('dynamodb', config=throttle.CLIENT_CONFIG)
+
+# Backs off on throttling and resubmits unprocessed items within a retry budget
+write_controller = throttle.ThrottleController()
 
 def process_restock_thresholds(bucket_name, object_key):
     # Get the DynamoDB table name
@@ -26,14 +31,16 @@ def process_restock_thresholds(bucket_name, object_key):
     
     # Update the DynamoDB table with the restock thresholds
     try:
-        table = dynamodb.Table(table_name)
-        with table.batch_writer() as batch:
-            for threshold in restock_thresholds['ThresholdList']:
-                item_id = threshold['ItemId']
-                restock_if_below = threshold['RestockIfBelow']
-                batch.put_item(Item={'ItemId': item_id, 'RestockIfBelow': restock_if_below})
-                item_ids_to_restock.append(item_id)
-                
+        items = []
+        for threshold in restock_thresholds['ThresholdList']:
+            item_id = threshold['ItemId']
+            restock_if_below = threshold['RestockIfBelow']
+            items.append({'ItemId': item_id, 'RestockIfBelow': restock_if_below})
+            item_ids_to_restock.append(item_id)
+
+        write_controller.reset_stats()
+        write_controller.batch_write(dynamodb.meta.client, table_name, items, key_names=['ItemId'])
+        write_controller.report("Restock")
         print(f"Restock thresholds updated successfully in the '{table_name}' table.")
     except Exception as e:
         print(f"Failed to update restock thresholds in the '{table_name}' table: {e}")
@@ -47,19 +54,17 @@ def send_notification(item_ids, update_date):
         table_name = "Inventory"
         table = dynamodb.Table(table_name)
         
-        # Prepare the message with all item IDs
-        message = f"Dear manager,\n\n After the new JSON update on {update_date}, the following items have stock levels below the threshold and require your attention:\n"
-        for item_id in item_ids:
-            message += f"- Item ID: {item_id}\n"
-        
-        message += "\nThis is an automated email."
-        
-        # Send the notification if there are items to restock
+        # Send the notification if there are items to restock (split or moved to S3 when large)
         if item_ids:
-            sns_client.publish(
-                TopicArn=os.environ['SNS_TOPIC_ARN'],  # Use the environment variable for SNS topic ARN
-                Message=message,
-                Subject="Stock Alert"
+            report_publisher.publish_report(
+                os.environ['SNS_TOPIC_ARN'],  # Use the environment variable for SNS topic ARN
+                "Stock Alert",
+                ((item_id,) for item_id in item_ids),
+                lambda row: f"- Item ID: {row[0]}",
+                intro=f"Dear manager,\n\n After the new JSON update on {update_date}, the following items have stock levels below the threshold and require your attention:\n",
+                footer="\nThis is an automated email.",
+                columns=["ItemId"],
+                report_name="restock_handler"
             )
             print("Notification sent successfully!")
     except Exception as e:
@@ -0,0 +1,79 @@
+import boto3
+from boto3.dynamodb.conditions import Key
+
+# Initialize the DynamoDB client
+dynamodb = boto3.resource('dynamodb')
+table = dynamodb.Table('Inventory')
+
+# GSI with WarehouseName as partition key and the current stock as sort key.
+# DynamoDB maintains it on every write of StockLevelChange.
+STOCK_INDEX_NAME = 'WarehouseStockIndex'
+
+
+def query_stock(warehouse_name, greater_than=None, less_than=None, limit=None, ascending=True):
+    """
+    Range query over the stock levels of one warehouse.
+
+    Only the matching part of the index is read, so a report costs
+    O(log n + k) instead of a scan of the whole table.
+
+    Args:
+        warehouse_name (str): Warehouse to query
+        greater_than (int): Only items with stock > greater_than
+        less_than (int): Only items with stock < less_than
+        limit (int): Stop after this many items
+        ascending (bool): Lowest stock first (True) or highest stock first (False)
+
+    Returns:
+        typing.List[tuple]: (ItemId, ItemName, stock) sorted by stock
+    """
+    condition = Key('WarehouseName').eq(warehouse_name)
+    # Stock levels are integers, so the open bounds become closed ones for BETWEEN
+    if greater_than is not None and less_than is not None:
+        if greater_than + 1 > less_than - 1:
+            return []
+        condition = condition & Key('StockLevelChange').between(greater_than + 1, less_than - 1)
+    elif greater_than is not None:
+        condition = condition & Key('StockLevelChange').gt(greater_than)
+    elif less_than is not None:
+        condition = condition & Key('StockLevelChange').lt(less_than)
+
+    params = {
+        'IndexName': STOCK_INDEX_NAME,
+        'KeyConditionExpression': condition,
+        'ScanIndexForward': ascending
+    }
+
+    results = []
+    while True:
+        if limit is not None:
+            params['Limit'] = limit - len(results)
+        response = table.query(**params)
+        for item in response['Items']:
+            results.append((item['ItemId'], item.get('ItemName'), int(item['StockLevelChange'])))
+
+        if 'LastEvaluatedKey' not in response or (limit is not None and len(results) >= limit):
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return results
+
+
+def items_above(warehouse_name, threshold):
+    """Items of a warehouse with stock > threshold, lowest first."""
+    return query_stock(warehouse_name, greater_than=threshold)
+
+
+def items_below(warehouse_name, threshold):
+    """Items of a warehouse with stock < threshold, lowest first."""
+    return query_stock(warehouse_name, less_than=threshold)
+
+
+def lowest(warehouse_name, n):
+    """The n items of a warehouse with the lowest stock."""
+    return query_stock(warehouse_name, limit=n)
+
+
+def highest(warehouse_name, n):
+    """The n items of a warehouse with the highest stock."""
+    return query_stock(warehouse_name, limit=n, ascending=False)
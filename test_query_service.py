@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+
+import pytest
+
+import query_service
+from query_service import InventoryIndex, LocalChangeFeed, QueryService
+
+
+@pytest.fixture(autouse=True)
+def no_transaction_log(monkeypatch):
+    # Daily reports come from the index's own change counts
+    monkeypatch.setattr(query_service.transaction_log, 'TRANSACTION_LOG_BUCKET', '')
+
+
+def stream_record(event_name, item_id, warehouse_name, stock=None, item_name=None, created=None):
+    """Builds an INSERT/MODIFY/REMOVE record in the DynamoDB Streams wire format."""
+    keys = {'ItemId': {'S': item_id}, 'WarehouseName': {'S': warehouse_name}}
+    change = {'Keys': keys, 'ApproximateCreationDateTime': created or datetime.now(timezone.utc)}
+    if event_name != 'REMOVE':
+        change['NewImage'] = dict(keys, StockLevelChange={'N': str(stock)})
+        if item_name:
+            change['NewImage']['ItemName'] = {'S': item_name}
+    return {'eventName': event_name, 'dynamodb': change}
+
+
+def follow(index, fill):
+    """Feeds the records `fill` puts into a LocalChangeFeed through QueryService.follow."""
+    async def run():
+        feed = LocalChangeFeed()
+        fill(feed)
+        task = asyncio.ensure_future(QueryService(index, feed).follow())
+        while not feed.queue.empty():
+            await asyncio.sleep(0)
+        # Let the last record taken from the queue be applied
+        await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(run())
+    return index
+
+
+def route(service, target, method='GET'):
+    return asyncio.run(service.route(method, target))
+
+
+def request(service, target):
+    """Sends one HTTP request to the service and returns (status, payload)."""
+    async def run():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode('latin-1'))
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    head, body = asyncio.run(run()).split(b'\r\n\r\n', 1)
+    return int(head.split(b' ')[1]), json.loads(body)
+
+
+@pytest.fixture
+def index():
+    def fill(feed):
+        feed.put(stream_record('INSERT', 'apple', 'BERLIN', 10, 'Apple'))
+        feed.put(stream_record('INSERT', 'pear', 'BERLIN', 3, 'Pear'))
+        feed.put(stream_record('INSERT', 'apple', 'HAMBURG', 7))
+        feed.modify('pear', 'BERLIN', 25)
+        feed.modify('plum', 'HAMBURG', 1, 'Plum')
+
+    return follow(InventoryIndex(), fill)
+
+
+def test_insert_and_modify_update_stock_and_totals(index):
+    assert index.stock == {('apple', 'BERLIN'): 10, ('pear', 'BERLIN'): 25,
+                           ('apple', 'HAMBURG'): 7, ('plum', 'HAMBURG'): 1}
+    assert index.totals() == {'BERLIN': 35, 'HAMBURG': 8}
+    assert index.item('apple') == {'ItemId': 'apple', 'ItemName': 'Apple',
+                                   'Warehouses': {'BERLIN': 10, 'HAMBURG': 7}, 'Total': 17}
+
+
+def test_remove_takes_the_stock_out_of_the_totals(index):
+    follow(index, lambda feed: feed.put(stream_record('REMOVE', 'apple', 'HAMBURG')))
+
+    assert ('apple', 'HAMBURG') not in index.stock
+    assert index.totals() == {'BERLIN': 35, 'HAMBURG': 1}
+    assert index.item('apple')['Warehouses'] == {'BERLIN': 10}
+
+
+def test_daily_changes_are_net_deltas_per_day(index):
+    yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+
+    def fill(feed):
+        feed.put(stream_record('MODIFY', 'apple', 'BERLIN', 4, created=yesterday))
+        feed.put(stream_record('REMOVE', 'plum', 'HAMBURG', created=yesterday.timestamp()))
+
+    follow(index, fill)
+
+    today = index.daily_changes[datetime.now(timezone.utc).date().isoformat()]
+    assert today[('pear', 'BERLIN')] == 25
+    assert today[('apple', 'BERLIN')] == 10
+    assert dict(index.daily_changes[yesterday.date().isoformat()]) == {
+        ('apple', 'BERLIN'): -6, ('plum', 'HAMBURG'): -1}
+
+
+def test_a_failing_record_does_not_stop_the_feed(index):
+    def fill(feed):
+        feed.put({'eventName': 'MODIFY', 'dynamodb': {'Keys': {}}})
+        feed.modify('apple', 'BERLIN', 12)
+
+    follow(index, fill)
+    assert index.stock[('apple', 'BERLIN')] == 12
+
+
+def test_route_warehouses_and_items(index):
+    service = QueryService(index)
+
+    assert route(service, '/warehouses') == (200, {'BERLIN': 35, 'HAMBURG': 8})
+    assert route(service, '/items/pear') == (200, {'ItemId': 'pear', 'ItemName': 'Pear',
+                                                  'Warehouses': {'BERLIN': 25}, 'Total': 25})
+    status, rows = route(service, '/warehouses/berlin/items')
+    assert status == 200
+    assert [row['ItemId'] for row in rows] == ['apple', 'pear']
+
+
+def test_route_filters_items_above_and_below(index):
+    service = QueryService(index)
+
+    assert route(service, '/warehouses/BERLIN/items?above=10') == (
+        200, [{'ItemId': 'pear', 'ItemName': 'Pear', 'Stock': 25}])
+    assert route(service, '/warehouses/BERLIN/items?below=10') == (200, [])
+    assert route(service, '/warehouses/BERLIN/items?above=5&below=20') == (
+        200, [{'ItemId': 'apple', 'ItemName': 'Apple', 'Stock': 10}])
+
+
+def test_route_daily_report(index):
+    status, report = route(QueryService(index), f"/daily/{datetime.now(timezone.utc).date().isoformat()}")
+
+    assert status == 200
+    assert report['BERLIN'] == {'apple': 10, 'pear': 25}
+
+
+def test_route_errors(index):
+    service = QueryService(index)
+
+    assert route(service, '/daily/2001-01-01')[0] == 404
+    assert route(service, '/unknown')[0] == 404
+    assert route(service, '/warehouses', method='POST')[0] == 405
+
+
+def test_invalid_filter_is_a_bad_request(index):
+    service = QueryService(index)
+
+    assert request(service, '/warehouses/BERLIN/items?above=many')[0] == 400
+    assert request(service, '/warehouses/BERLIN/items?below=5') == (200, [])
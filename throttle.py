@@ -0,0 +1,281 @@
+import collections
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+# Clients used with the controller leave retrying to it, so every throttle is seen;
+# every call on such a client has to go through ThrottleController.call
+CLIENT_CONFIG = Config(retries={'mode': 'standard', 'max_attempts': 1})
+
+THROTTLE_ERRORS = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+}
+
+# Retried like botocore would, but they are no sign of exhausted capacity
+TRANSIENT_ERRORS = {
+    'InternalServerError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+}
+
+# BatchWriteItem accepts at most 25 put/delete requests
+BATCH_WRITE_SIZE = 25
+
+
+class RetryBudgetExceeded(Exception):
+    """Raised when a request is still throttled after the retry budget is used up."""
+
+
+class ThrottleController:
+    """
+    Shared rate and concurrency controller for DynamoDB writers.
+
+    Concurrency follows additive-increase/multiplicative-decrease: successful
+    requests grow the limit by `increase_step` slots per window of `limit`
+    requests, a throttle halves it (at most once per cooldown). Throttles,
+    5xx errors and connection errors or timeouts are retried; retries are
+    limited to a budget proportional to the number of requests in the last
+    `retry_budget_window` seconds and use full-jitter exponential backoff, so a
+    throttle storm cannot multiply the load.
+
+    Module-level controllers outlive a Lambda invocation: the concurrency
+    limit carries over, the counters are reset with reset_stats().
+    """
+
+    def __init__(self, initial_concurrency=4, min_concurrency=1, max_concurrency=64,
+                 increase_step=0.1, decrease_factor=0.5, decrease_cooldown=0.2, target_capacity=None,
+                 retry_budget_ratio=0.2, min_retry_budget=20, retry_budget_window=10.0,
+                 base_delay=0.05, max_delay=5.0):
+        """
+        Args:
+            increase_step (float): Slots added per `limit` successful requests
+            target_capacity (float): Optional consumed write units per second to stay below
+            retry_budget_ratio (float): Retries allowed per request made in the window
+            min_retry_budget (int): Retries allowed in a window without requests
+            retry_budget_window (float): Seconds of requests and retries the budget counts
+        """
+        self.min_concurrency = min_concurrency
+        self.increase_step = increase_step
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.target_capacity = target_capacity
+        self.retry_budget_ratio = retry_budget_ratio
+        self.min_retry_budget = min_retry_budget
+        self.retry_budget_window = retry_budget_window
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.limit = float(initial_concurrency)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._last_decrease = 0.0
+        self._recent_capacity = collections.deque()
+        self._recent_requests = collections.deque()
+        self._recent_retries = collections.deque()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Starts the counters reported by stats() over, e.g. at the start of an invocation."""
+        with self._condition:
+            self.started = time.monotonic()
+            self.requests = 0
+            self.successes = 0
+            self.throttles = 0
+            self.errors = 0
+            self.retries = 0
+            self.consumed_capacity = 0.0
+
+    def _acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self.requests += 1
+            now = time.monotonic()
+            self._prune_recent(now)
+            self._recent_requests.append(now)
+
+    def _release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _capacity_rate(self, now):
+        while self._recent_capacity and now - self._recent_capacity[0][0] > 1.0:
+            self._recent_capacity.popleft()
+        return sum(units for _, units in self._recent_capacity)
+
+    def on_success(self, consumed_capacity=0.0):
+        now = time.monotonic()
+        with self._condition:
+            self.successes += 1
+            self.consumed_capacity += consumed_capacity
+            self._recent_capacity.append((now, consumed_capacity))
+
+            if self.target_capacity and self._capacity_rate(now) > self.target_capacity:
+                # Above the capacity target: treat it like a soft throttle signal
+                self._decrease(now)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + self.increase_step / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            self.throttles += 1
+            self._decrease(time.monotonic())
+
+    def on_error(self):
+        with self._condition:
+            self.errors += 1
+
+    def _decrease(self, now):
+        # A burst of throttles from requests that were already in flight counts once
+        if now - self._last_decrease >= self.decrease_cooldown:
+            self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+            self._last_decrease = now
+
+    def _prune_recent(self, now):
+        for recent in (self._recent_requests, self._recent_retries):
+            while recent and now - recent[0] > self.retry_budget_window:
+                recent.popleft()
+
+    def _take_retry(self):
+        now = time.monotonic()
+        with self._condition:
+            self._prune_recent(now)
+            budget = (self.min_retry_budget + self.retry_budget_ratio * len(self._recent_requests)
+                      - len(self._recent_retries))
+            if budget < 1:
+                return False
+            self.retries += 1
+            self._recent_retries.append(now)
+            return True
+
+    def backoff(self, attempt):
+        # Full jitter: spreads the retries of concurrent writers over the whole window
+        time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls a boto3 operation inside a concurrency slot, retrying throttles and transient errors.
+
+        Raises:
+            RetryBudgetExceeded: If the request is still throttled and the budget is used up
+            ClientError, ConnectionError, HTTPClientError: If it still fails with a
+                transient error when the budget is used up
+        """
+        attempt = 0
+        while True:
+            error = None
+            self._acquire()
+            try:
+                response = function(*args, **kwargs)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code in THROTTLE_ERRORS:
+                    self.on_throttle()
+                elif code in TRANSIENT_ERRORS or _status_code(e) >= 500:
+                    self.on_error()
+                    error = e
+                else:
+                    raise
+            except (ConnectionError, HTTPClientError) as e:
+                # Connection failures and read/connect timeouts
+                self.on_error()
+                error = e
+            else:
+                self.on_success(_consumed_units(response))
+                return response
+            finally:
+                self._release()
+
+            if not self._take_retry():
+                if error is not None:
+                    raise error
+                raise RetryBudgetExceeded(f"Still throttled after {attempt + 1} attempts")
+            self.backoff(attempt)
+            attempt += 1
+
+    def batch_write(self, client, table_name, items, key_names=None, workers=1):
+        """
+        Puts items with BatchWriteItem, resubmitting UnprocessedItems with backoff.
+
+        Args:
+            client: A DynamoDB client (or a resource's meta.client)
+            table_name (str): Table to write to
+            items (iterable): Items to put
+            key_names (list): Key attributes; if given, later items replace earlier
+                ones with the same key, as BatchWriteItem rejects duplicates
+            workers (int): Batches written in parallel; the controller's limit
+                decides how many of them are actually in flight
+
+        Raises:
+            RetryBudgetExceeded: If items are still unprocessed when the budget is used up
+        """
+        items = list(items)
+        if key_names:
+            items = list({tuple(item[name] for name in key_names): item for item in items}.values())
+
+        def write_batch(batch):
+            requests = [{'PutRequest': {'Item': item}} for item in batch]
+            written = 0
+            attempt = 0
+            while requests:
+                response = self.call(client.batch_write_item,
+                                     RequestItems={table_name: requests},
+                                     ReturnConsumedCapacity='TOTAL')
+                unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+                written += len(requests) - len(unprocessed)
+                requests = unprocessed
+                if requests:
+                    # Partially throttled batch
+                    self.on_throttle()
+                    if not self._take_retry():
+                        raise RetryBudgetExceeded(f"{len(requests)} items left unprocessed in {table_name}")
+                    self.backoff(attempt)
+                    attempt += 1
+            return written
+
+        batches = [items[start:start + BATCH_WRITE_SIZE] for start in range(0, len(items), BATCH_WRITE_SIZE)]
+        if workers <= 1 or len(batches) <= 1:
+            return sum(write_batch(batch) for batch in batches)
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+            return sum(executor.map(write_batch, batches))
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'requests': self.requests,
+            'successes': self.successes,
+            'throttles': self.throttles,
+            'errors': self.errors,
+            'retries': self.retries,
+            'concurrency_limit': round(self.limit, 2),
+            'requests_per_second': round(self.successes / elapsed, 2),
+            'capacity_per_second': round(self.consumed_capacity / elapsed, 2),
+        }
+
+    def report(self, name="Writer"):
+        print(f"{name} throttle stats: {self.stats()}")
+
+
+def _status_code(error):
+    return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+
+
+def _consumed_units(response):
+    consumed = response.get('ConsumedCapacity') if isinstance(response, dict) else None
+    if isinstance(consumed, list):
+        return sum(entry.get('CapacityUnits', 0) for entry in consumed)
+    if isinstance(consumed, dict):
+        return consumed.get('CapacityUnits', 0)
+    return 0.0
@@ -0,0 +1,435 @@
+import argparse
+import functools
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+s3 = boto3.client('s3')
+
+# Bucket and prefix of the log (no bucket disables logging in the ingest path)
+TRANSACTION_LOG_BUCKET = os.environ.get('TRANSACTION_LOG_BUCKET', '')
+TRANSACTION_LOG_PREFIX = os.environ.get('TRANSACTION_LOG_PREFIX', 'transaction_log/')
+
+SEGMENT_MAGIC = b'ITXL'
+SNAPSHOT_MAGIC = b'ITXS'
+FORMAT_VERSION = 1
+
+# magic, version, base epoch seconds, row count, warehouse count, item count
+HEADER = struct.Struct('<4sBqIII')
+
+# A file's rows may start in the hour before the partition its segment is stored in
+SEGMENT_LOOKBACK_HOURS = 1
+
+# Clock skew between writers: a snapshot leaves segments journaled more recently to the next one
+JOURNAL_SETTLE_SECONDS = int(os.environ.get('TRANSACTION_LOG_JOURNAL_SETTLE_SECONDS', '60'))
+
+
+def _to_epoch(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp())
+
+
+def _pack_array(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack_array(typecode, payload, offset, count):
+    values = array(typecode)
+    end = offset + values.itemsize * count
+    values.frombytes(payload[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
+
+
+def _pack_strings(strings):
+    encoded = '\x00'.join(strings).encode('utf-8')
+    return struct.pack('<I', len(encoded)) + encoded
+
+
+def _unpack_strings(payload, offset, count):
+    (length,) = struct.unpack_from('<I', payload, offset)
+    offset += 4
+    if count == 0:
+        return [], offset + length
+    return payload[offset:offset + length].decode('utf-8').split('\x00'), offset + length
+
+
+def _encode(magic, base_epoch, warehouses, items, columns):
+    """Shared layout: header, both dictionaries, then the packed int columns."""
+    body = b''.join(
+        [HEADER.pack(magic, FORMAT_VERSION, base_epoch, len(columns[0]), len(warehouses), len(items)),
+         _pack_strings(warehouses),
+         _pack_strings(items)]
+        + [_pack_array(column) for column in columns]
+    )
+    return zlib.compress(body, 6)
+
+
+def _decode(magic, data, typecodes):
+    payload = zlib.decompress(data)
+    file_magic, version, base_epoch, rows, n_warehouses, n_items = HEADER.unpack_from(payload, 0)
+    if file_magic != magic or version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported transaction log object (magic {file_magic!r}, version {version})")
+
+    offset = HEADER.size
+    warehouses, offset = _unpack_strings(payload, offset, n_warehouses)
+    items, offset = _unpack_strings(payload, offset, n_items)
+
+    columns = []
+    for typecode in typecodes:
+        column, offset = _unpack_array(typecode, payload, offset, rows)
+        columns.append(column)
+
+    return base_epoch, warehouses, items, columns
+
+
+def encode_segment(batch):
+    """
+    Encodes the transactions of one inventory file as a compact segment.
+
+    The batch's ItemId and WarehouseName dictionaries are stored once; codes,
+    timestamps (seconds after the segment's first transaction) and deltas are
+    stored as packed int arrays.
+
+    Args:
+        batch (inventory_batch.InventoryBatch): The parsed inventory file
+
+    Returns:
+        bytes: The compressed segment
+    """
+    base_epoch = min(batch.timestamp_column, default=0)
+    offset_column = array('I', (timestamp - base_epoch for timestamp in batch.timestamp_column))
+
+    return _encode(SEGMENT_MAGIC, base_epoch, batch.warehouses, batch.item_ids,
+                   [batch.warehouse_column, batch.item_column, offset_column, batch.delta_column])
+
+
+def decode_segment(data):
+    """
+    Returns:
+        typing.Iterator[tuple]: (epoch seconds, WarehouseName, ItemId, StockLevelChange)
+    """
+    base_epoch, warehouses, items, columns = _decode(SEGMENT_MAGIC, data, 'HIIi')
+    warehouse_column, item_column, offset_column, delta_column = columns
+    for i in range(len(delta_column)):
+        yield (base_epoch + offset_column[i], warehouses[warehouse_column[i]],
+               items[item_column[i]], delta_column[i])
+
+
+def encode_snapshot(taken_at, stock_levels):
+    """
+    Encodes the full stock state at epoch second `taken_at`.
+
+    Args:
+        taken_at (int): Epoch seconds the snapshot is valid for (inclusive)
+        stock_levels (dict): Maps (ItemId, WarehouseName) to the stock level
+    """
+    warehouse_codes = {}
+    item_codes = {}
+    warehouse_column = array('H')
+    item_column = array('I')
+    stock_column = array('q')
+
+    for (item_id, warehouse_name), stock in stock_levels.items():
+        warehouse_column.append(warehouse_codes.setdefault(warehouse_name, len(warehouse_codes)))
+        item_column.append(item_codes.setdefault(item_id, len(item_codes)))
+        stock_column.append(stock)
+
+    return _encode(SNAPSHOT_MAGIC, taken_at, list(warehouse_codes), list(item_codes),
+                   [warehouse_column, item_column, stock_column])
+
+
+def decode_snapshot(data):
+    """
+    Returns:
+        tuple: (taken_at epoch seconds, dict mapping (ItemId, WarehouseName) to stock)
+    """
+    taken_at, warehouses, items, columns = _decode(SNAPSHOT_MAGIC, data, 'HIq')
+    warehouse_column, item_column, stock_column = columns
+    stock_levels = {
+        (items[item_column[i]], warehouses[warehouse_column[i]]): stock_column[i]
+        for i in range(len(stock_column))
+    }
+    return taken_at, stock_levels
+
+
+def _hour_prefix(epoch):
+    return TRANSACTION_LOG_PREFIX + datetime.fromtimestamp(epoch, timezone.utc).strftime('segments/%Y/%m/%d/%H/')
+
+
+def _segment_hour(key):
+    """Epoch seconds of the hour partition a segment key is stored in."""
+    stamp = key[len(TRANSACTION_LOG_PREFIX + 'segments/'):].rsplit('/', 1)[0]
+    return int(datetime.strptime(stamp, '%Y/%m/%d/%H').replace(tzinfo=timezone.utc).timestamp())
+
+
+def segment_key(object_key, batch):
+    # The segment name follows the source file, so a reprocessed file maps to the segment already logged
+    file_name = object_key.rsplit('/', 1)[-1].split('.', 1)[0]
+    return _hour_prefix(min(batch.timestamp_column)) + file_name + '.seg'
+
+
+def journal_key(segment, logged_at):
+    """
+    Key of a segment's entry in the journal, which lists the segments in the order they were written.
+    """
+    return (TRANSACTION_LOG_PREFIX + 'journal/' + logged_at.strftime('%Y%m%dT%H%M%S.%f') + '/'
+            + segment[len(TRANSACTION_LOG_PREFIX + 'segments/'):])
+
+
+def _journal_entry(key):
+    """
+    Returns:
+        tuple: (time the segment was logged, segment key) of a journal key
+    """
+    stamp, segment = key[len(TRANSACTION_LOG_PREFIX + 'journal/'):].split('/', 1)
+    return (datetime.strptime(stamp, '%Y%m%dT%H%M%S.%f').replace(tzinfo=timezone.utc),
+            TRANSACTION_LOG_PREFIX + 'segments/' + segment)
+
+
+def snapshot_key(taken_at):
+    return TRANSACTION_LOG_PREFIX + datetime.fromtimestamp(taken_at, timezone.utc).strftime('snapshots/%Y%m%dT%H%M%S.snap')
+
+
+def append_segment(object_key, batch):
+    """
+    Writes the transactions of one inventory file to the hourly segment log.
+
+    The segment is stored in the hour partition of its first transaction and
+    listed in the journal under the time it was written, so snapshots and
+    lookups find late files whatever the time of their rows.
+
+    Returns:
+        str: The key of the segment, or None if there was nothing to write
+    """
+    if not len(batch):
+        return None
+
+    key = segment_key(object_key, batch)
+    try:
+        s3.head_object(Bucket=TRANSACTION_LOG_BUCKET, Key=key)
+        print(f"{object_key} is already logged in {key}.")
+        return key
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+
+    # Journal entry first: every segment that exists is in the journal
+    s3.put_object(Bucket=TRANSACTION_LOG_BUCKET, Key=journal_key(key, datetime.now(timezone.utc)), Body=b'')
+    s3.put_object(Bucket=TRANSACTION_LOG_BUCKET, Key=key, Body=encode_segment(batch))
+    print(f"Appended {len(batch)} transactions from {object_key} to {key}.")
+    return key
+
+
+def _list_keys(prefix, start_after=None):
+    paginator = s3.get_paginator('list_objects_v2')
+    params = {'Bucket': TRANSACTION_LOG_BUCKET, 'Prefix': prefix}
+    if start_after:
+        params['StartAfter'] = start_after
+    for page in paginator.paginate(**params):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+
+# Segments and snapshots are immutable once written, so decoded objects can be cached
+@functools.lru_cache(maxsize=256)
+def _load_segment(key):
+    data = s3.get_object(Bucket=TRANSACTION_LOG_BUCKET, Key=key)['Body'].read()
+    return tuple(decode_segment(data))
+
+
+def _segment_rows(key):
+    try:
+        return _load_segment(key)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        # Journal entry of a segment that was not (yet) written
+        return ()
+
+
+@functools.lru_cache(maxsize=8)
+def _load_snapshot(key):
+    response = s3.get_object(Bucket=TRANSACTION_LOG_BUCKET, Key=key)
+    taken_at, stock_levels = decode_snapshot(response['Body'].read())
+    return taken_at, stock_levels, response.get('Metadata', {}).get('journal-watermark') or None
+
+
+def nearest_snapshot(at):
+    """
+    Returns:
+        tuple: (taken_at, stock levels, journal watermark) of the latest snapshot
+               not after `at`, or (None, {}, None) if there is none
+    """
+    target = snapshot_key(at)
+    best = None
+    for key in _list_keys(TRANSACTION_LOG_PREFIX + 'snapshots/'):
+        if key <= target:
+            best = key
+        else:
+            break
+
+    if best is None:
+        return None, {}, None
+    return _load_snapshot(best)
+
+
+def _segments_between(start, end):
+    """Lists the segment keys whose hour partition may hold rows in (start, end]."""
+    hour = datetime.fromtimestamp(start, timezone.utc).replace(minute=0, second=0)
+    hour -= timedelta(hours=SEGMENT_LOOKBACK_HOURS)
+    last = datetime.fromtimestamp(end, timezone.utc)
+    while hour <= last:
+        yield from _list_keys(_hour_prefix(int(hour.timestamp())))
+        hour += timedelta(hours=1)
+
+
+def _rebuild(at_epoch, keys=None, logged_before=None):
+    """
+    Rebuilds stock levels as of `at_epoch` from the nearest snapshot.
+
+    A snapshot covers the rows up to its point in time of the segments in the
+    journal up to its watermark. On top of it go all rows up to `at_epoch` of
+    the segments journaled after the watermark (late files included), and the
+    rows after the snapshot's point in time of the segments it covered.
+
+    Args:
+        logged_before (datetime): Leave out the segments journaled at or after
+            this time entirely (a snapshot leaves them to the next one)
+
+    Returns:
+        tuple: (dict of stock levels, journal key of the last segment included)
+    """
+    taken_at, snapshot_levels, watermark = nearest_snapshot(at_epoch)
+
+    if keys is None:
+        stock_levels = defaultdict(int, snapshot_levels)
+    else:
+        stock_levels = defaultdict(int, {key: snapshot_levels[key] for key in keys if key in snapshot_levels})
+
+    def add_rows(segment, after):
+        for epoch, warehouse_name, item_id, delta in _segment_rows(segment):
+            if (after is None or after < epoch) and epoch <= at_epoch \
+                    and (keys is None or (item_id, warehouse_name) in keys):
+                stock_levels[(item_id, warehouse_name)] += delta
+
+    journaled_after = set()
+    included = set()
+    last_key = watermark
+    for key in _list_keys(TRANSACTION_LOG_PREFIX + 'journal/', start_after=watermark):
+        logged_at, segment = _journal_entry(key)
+        journaled_after.add(segment)
+        # Journal keys sort by time, the skipped entries are the newest
+        if logged_before is not None and logged_at >= logged_before:
+            continue
+        last_key = key
+        if segment not in included and _segment_hour(segment) <= at_epoch:
+            add_rows(segment, None)
+            included.add(segment)
+
+    if taken_at is not None:
+        for segment in _segments_between(taken_at, at_epoch):
+            if segment not in journaled_after:
+                add_rows(segment, taken_at)
+
+    return dict(stock_levels), last_key
+
+
+def stock_levels_at(at, keys=None):
+    """
+    Rebuilds stock levels as of `at` from the nearest snapshot plus the deltas since.
+
+    Args:
+        at (datetime): Point in time to rebuild (inclusive)
+        keys (set): Optional (ItemId, WarehouseName) pairs to restrict the result to
+
+    Returns:
+        dict: Maps (ItemId, WarehouseName) to the stock level at that time
+    """
+    return _rebuild(_to_epoch(at), keys)[0]
+
+
+def stock_at(item_id, warehouse_name, at):
+    """Returns the stock level of one item in one warehouse at time `at`."""
+    key = (item_id, warehouse_name)
+    return stock_levels_at(at, {key}).get(key, 0)
+
+
+def net_changes_on(day):
+    """
+    Sums the stock changes of one UTC day from the segment log.
+
+    Args:
+        day (date): The day to sum
+
+    Returns:
+        dict: Maps (ItemId, WarehouseName) to the net change on that day
+    """
+    start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+    end = start + 24 * 60 * 60
+
+    changes = defaultdict(int)
+    for key in _segments_between(start, end - 1):
+        for epoch, warehouse_name, item_id, delta in _load_segment(key):
+            if start <= epoch < end:
+                changes[(item_id, warehouse_name)] += delta
+
+    return dict(changes)
+
+
+def write_snapshot(at):
+    """
+    Stores a full stock snapshot as of `at`, built from the previous snapshot and the log.
+
+    Segments journaled in the last JOURNAL_SETTLE_SECONDS are left to the next
+    snapshot, as their journal entries may still be getting written.
+
+    Returns:
+        str: The key of the new snapshot
+    """
+    at_epoch = _to_epoch(at)
+    logged_before = datetime.now(timezone.utc) - timedelta(seconds=JOURNAL_SETTLE_SECONDS)
+    stock_levels, watermark = _rebuild(at_epoch, logged_before=logged_before)
+    key = snapshot_key(at_epoch)
+    s3.put_object(Bucket=TRANSACTION_LOG_BUCKET, Key=key, Body=encode_snapshot(at_epoch, stock_levels),
+                  Metadata={'journal-watermark': watermark or ''})
+    print(f"Snapshot of {len(stock_levels)} stock levels up to journal entry {watermark} written to {key}.")
+    return key
+
+
+def snapshot_handler(event, context):
+    # Scheduled entry point: snapshot the state at the start of the current hour
+    at = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(seconds=1)
+    key = write_snapshot(at)
+    return {
+        'statusCode': 200,
+        'body': key
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Point-in-time stock lookup from the transaction log")
+    parser.add_argument("item_id")
+    parser.add_argument("warehouse_name")
+    parser.add_argument("at", help="ISO8601 timestamp, e.g. 2024-05-01T12:00:00+00:00")
+    args = parser.parse_args()
+
+    at = datetime.fromisoformat(args.at.replace('Z', '+00:00'))
+    stock = stock_at(args.item_id, args.warehouse_name.upper(), at)
+    print(f"Stock of item '{args.item_id}' in '{args.warehouse_name.upper()}' at {at.isoformat()}: {stock}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import json
+import os
+import signal
+import time
+import uuid
+from collections import defaultdict
+
+import boto3
+from botocore.exceptions import ClientError
+
+import alert_state
+import throttle
+
+# AWS resource initialization
+ddb = boto3.resource('dynamodb', config=throttle.CLIENT_CONFIG)
+inventory_table = ddb.Table(os.environ.get('TABLE_NAME', 'Inventory'))
+sqs_client = boto3.client('sqs', region_name='eu-central-1')
+
+# Queue between the inventory handlers and the accumulator (empty disables write-behind)
+write_behind_queue_url = os.environ.get('WRITE_BEHIND_QUEUE_URL', '')
+
+# Longest time a delta may sit in the accumulator before it is applied to DynamoDB
+MAX_STALENESS_SECONDS = float(os.environ.get('WRITE_BEHIND_MAX_STALENESS_SECONDS', '30'))
+
+# Time the Lambda keeps for requeueing the unwritten deltas before it times out
+FLUSH_TIME_MARGIN_SECONDS = float(os.environ.get('WRITE_BEHIND_FLUSH_TIME_MARGIN_SECONDS', '10'))
+
+# Window that run() has taken over from the queue but not fully applied yet
+CHECKPOINT_PATH = os.environ.get('WRITE_BEHIND_CHECKPOINT_PATH', 'write_behind_checkpoint.json')
+
+# Keeps each SQS message well below the 256 KB limit (~80 bytes per entry)
+MAX_ENTRIES_PER_MESSAGE = 2000
+
+# Adapts the flush rate to throttling on the Inventory table
+write_controller = throttle.ThrottleController()
+
+
+def _send_entries(entries, **fields):
+    messages_sent = 0
+    for start in range(0, len(entries), MAX_ENTRIES_PER_MESSAGE):
+        sqs_client.send_message(
+            QueueUrl=write_behind_queue_url,
+            MessageBody=json.dumps(dict(fields, deltas=entries[start:start + MAX_ENTRIES_PER_MESSAGE]),
+                                   separators=(',', ':'))
+        )
+        messages_sent += 1
+    return messages_sent
+
+
+def enqueue_deltas(bucket_name, object_key, deltas):
+    """
+    Sends the summed stock changes of one inventory file to the write-behind queue.
+
+    Args:
+        bucket_name (str): Bucket the inventory file was read from
+        object_key (str): Key of the inventory file
+        deltas (dict): Maps (ItemId, WarehouseName) to the summed StockLevelChange
+
+    Returns:
+        int: Number of messages sent
+    """
+    entries = [[item_id, warehouse_name, delta]
+               for (item_id, warehouse_name), delta in deltas.items()]
+
+    messages_sent = _send_entries(entries, bucket=bucket_name, key=object_key)
+    print(f"Queued {len(entries)} deltas from {object_key} in {messages_sent} message(s).")
+    return messages_sent
+
+
+def _new_window_id():
+    return uuid.uuid4().hex
+
+
+class DeltaAccumulator:
+    """
+    Merges per-file delta batches so every hot key is written once per window
+    instead of once per file.
+
+    Every window has an id that is stored on the keys it updates, and a key is
+    only updated if it does not carry the id yet. Applying a window again (a
+    retried write, a requeued remainder, a replayed checkpoint) skips the keys
+    it already wrote, as long as no other window wrote them in between: the key
+    only remembers the last window, so if a concurrent accumulator updates a
+    key after this window did, a replay of this window adds its delta again.
+    """
+
+    def __init__(self, max_staleness=MAX_STALENESS_SECONDS):
+        self.max_staleness = max_staleness
+        # Window id -> (ItemId, WarehouseName) -> delta
+        self.windows = defaultdict(lambda: defaultdict(int))
+        self.window_id = _new_window_id()
+        self.oldest_delta_at = None
+        self.files_merged = 0
+
+    @property
+    def pending(self):
+        return sum(len(window) for window in self.windows.values())
+
+    def add_message(self, body):
+        """
+        Merges a queued batch into the open window; a requeued remainder keeps its own window.
+
+        Returns:
+            str: Id of the window the batch was merged into
+        """
+        batch = json.loads(body)
+        window_id = batch.get('window', self.window_id)
+        window = self.windows[window_id]
+        for item_id, warehouse_name, delta in batch['deltas']:
+            window[(item_id, warehouse_name)] += int(delta)
+
+        if self.oldest_delta_at is None:
+            self.oldest_delta_at = time.monotonic()
+        self.files_merged += 1
+        return window_id
+
+    def is_due(self):
+        return (self.oldest_delta_at is not None
+                and time.monotonic() - self.oldest_delta_at >= self.max_staleness)
+
+    def _apply(self, window_id, key, delta):
+        item_id, warehouse_name = key
+        try:
+            response = write_controller.call(
+                inventory_table.update_item,
+                Key={'ItemId': item_id, 'WarehouseName': warehouse_name},
+                UpdateExpression='ADD StockLevelChange :val SET WriteBehindWindow = :window',
+                ConditionExpression='attribute_not_exists(WriteBehindWindow) OR WriteBehindWindow <> :window',
+                ExpressionAttributeValues={':val': delta, ':window': window_id},
+                ReturnValues='UPDATED_NEW',
+                ReturnConsumedCapacity='TOTAL'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # This window already wrote the key
+            return None
+        return int(response['Attributes']['StockLevelChange'])
+
+    def flush(self, deadline=None):
+        """
+        Applies the merged deltas of every window to the Inventory table.
+
+        Keys are removed from their window as soon as they are written. If a
+        write fails, or the `deadline` (time.monotonic()) passes, the unwritten
+        keys stay pending for requeue() or another flush. Deltas added during or
+        after the flush go into a new window.
+
+        Returns:
+            int: Number of update_item calls made
+        """
+        self.window_id = _new_window_id()
+        # The reported stats cover this flush only
+        write_controller.reset_stats()
+        updates = 0
+        stock_levels = {}
+        try:
+            for window_id in list(self.windows):
+                window = self.windows[window_id]
+                for key in list(window):
+                    if deadline is not None and time.monotonic() >= deadline:
+                        print(f"Flush deadline reached with {self.pending} keys pending.")
+                        return updates
+                    # Zero deltas are written too: like the direct path's ADD 0 they
+                    # create keys that do not exist yet, which can then alert
+                    stock_level = self._apply(window_id, key, window[key])
+                    updates += 1
+                    if stock_level is not None:
+                        stock_levels[key] = stock_level
+                    del window[key]
+                del self.windows[window_id]
+        finally:
+            try:
+                alert_state.notify_low_stock(stock_levels)
+            except Exception as e:
+                print(f"Failed to check restock levels: {str(e)}")
+
+            if updates or self.files_merged:
+                print(f"Flushed {updates} updates merged from {self.files_merged} file batch(es).")
+                write_controller.report("Accumulator")
+            self.files_merged = 0
+            self.oldest_delta_at = time.monotonic() if self.pending else None
+        return updates
+
+    def requeue(self):
+        """
+        Sends the unwritten keys back to the write-behind queue, each under its window id.
+
+        Returns:
+            int: Number of messages sent
+        """
+        messages_sent = 0
+        for window_id in list(self.windows):
+            entries = [[item_id, warehouse_name, delta]
+                       for (item_id, warehouse_name), delta in self.windows[window_id].items()]
+            messages_sent += _send_entries(entries, window=window_id)
+            del self.windows[window_id]
+        self.oldest_delta_at = None
+        print(f"Requeued the unwritten deltas in {messages_sent} message(s).")
+        return messages_sent
+
+    def to_checkpoint(self, message_ids):
+        return {
+            'windows': {window_id: [[item_id, warehouse_name, delta]
+                                    for (item_id, warehouse_name), delta in window.items()]
+                        for window_id, window in self.windows.items() if window},
+            'messages': list(message_ids),
+        }
+
+    def restore(self, checkpoint):
+        for window_id, entries in checkpoint['windows'].items():
+            for item_id, warehouse_name, delta in entries:
+                self.windows[window_id][(item_id, warehouse_name)] += int(delta)
+        if self.pending:
+            self.oldest_delta_at = time.monotonic()
+
+
+def lambda_handler(event, context):
+    """
+    SQS event source entry point. The event source mapping's batching window
+    is the staleness bound; every invocation merges its batch and flushes it.
+
+    Whatever could not be written (an error, or too little time left) is
+    requeued under its window id and the batch is acknowledged, so SQS never
+    redelivers messages whose deltas were partly applied. Only if the requeue
+    fails are the messages none of whose keys were written reported as batch
+    item failures; the rest is logged for the reconciliation to repair.
+    """
+    records = event.get('Records', [])
+    accumulator = DeltaAccumulator()
+    record_windows = [accumulator.add_message(record['body']) for record in records]
+
+    deadline = None
+    if context is not None:
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - FLUSH_TIME_MARGIN_SECONDS
+
+    updates = 0
+    try:
+        updates = accumulator.flush(deadline)
+    except Exception as e:
+        print(f"Flush failed with {accumulator.pending} keys pending: {str(e)}")
+
+    failures = []
+    if accumulator.pending:
+        try:
+            accumulator.requeue()
+        except Exception as e:
+            print(f"Failed to requeue {accumulator.pending} unwritten keys: {str(e)}")
+            for record, window_id in zip(records, record_windows):
+                window = accumulator.windows.get(window_id, {})
+                if all((item_id, warehouse_name) in window
+                       for item_id, warehouse_name, _ in json.loads(record['body'])['deltas']):
+                    failures.append({'itemIdentifier': record['messageId']})
+            print(f"{len(failures)} untouched message(s) are retried, the unwritten deltas of the other "
+                  f"{len(records) - len(failures)} are lost until the next reconciliation.")
+
+    print(json.dumps({'messages': len(records), 'updates': updates, 'failures': len(failures)}))
+    return {'batchItemFailures': failures}
+
+
+def _save_checkpoint(checkpoint):
+    temporary_path = CHECKPOINT_PATH + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary_path, CHECKPOINT_PATH)
+
+
+def _load_checkpoint():
+    if not os.path.exists(CHECKPOINT_PATH):
+        return None
+    with open(CHECKPOINT_PATH) as f:
+        return json.load(f)
+
+
+def run(max_staleness=MAX_STALENESS_SECONDS):
+    """
+    Long-running consumer. Pending deltas are flushed on SIGTERM/SIGINT.
+
+    Before a flush the open windows and the ids of the messages they merged
+    are written to a local checkpoint, then the messages are deleted and the
+    windows applied; the checkpoint is removed once they are fully written. A
+    consumer that died in between replays its checkpoint on start (no other
+    writer has touched the keys since, so the window ids skip what was already
+    written) and drops the checkpointed messages if SQS delivers them again.
+    """
+    accumulator = DeltaAccumulator(max_staleness)
+    receipt_handles = {}
+    stopping = []
+
+    checkpoint = _load_checkpoint()
+    applied_messages = set(checkpoint['messages']) if checkpoint else set()
+    if checkpoint:
+        print(f"Replaying the checkpoint of {len(applied_messages)} message(s) left by a previous run.")
+        accumulator.restore(checkpoint)
+
+    def request_stop(signum, frame):
+        print(f"Received signal {signum}, flushing before shutdown.")
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    def delete_messages(handles):
+        for start in range(0, len(handles), 10):
+            sqs_client.delete_message_batch(
+                QueueUrl=write_behind_queue_url,
+                Entries=[{'Id': str(i), 'ReceiptHandle': handle}
+                         for i, handle in enumerate(handles[start:start + 10])]
+            )
+
+    def flush_window():
+        if receipt_handles:
+            _save_checkpoint(accumulator.to_checkpoint(applied_messages | set(receipt_handles)))
+            delete_messages(list(receipt_handles.values()))
+            receipt_handles.clear()
+        elif accumulator.pending:
+            _save_checkpoint(accumulator.to_checkpoint(applied_messages))
+
+        accumulator.flush()
+        if os.path.exists(CHECKPOINT_PATH):
+            os.remove(CHECKPOINT_PATH)
+
+    try:
+        if accumulator.pending:
+            flush_window()
+
+        while not stopping:
+            response = sqs_client.receive_message(
+                QueueUrl=write_behind_queue_url,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=min(20, max(1, int(max_staleness)))
+            )
+            for message in response.get('Messages', []):
+                if message['MessageId'] in applied_messages:
+                    # Redelivered after the checkpoint was written but before it was deleted
+                    delete_messages([message['ReceiptHandle']])
+                    continue
+                accumulator.add_message(message['Body'])
+                receipt_handles[message['MessageId']] = message['ReceiptHandle']
+
+            if accumulator.is_due():
+                try:
+                    flush_window()
+                except Exception as e:
+                    # The checkpoint keeps the unwritten keys, the next flush retries them
+                    print(f"Flush failed with {accumulator.pending} keys pending: {str(e)}")
+    finally:
+        flush_window()
+
+
+if __name__ == "__main__":
+    run()